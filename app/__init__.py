@@ -37,6 +37,7 @@ def initialize_server():
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "Retry-After"],
     )
     
     app.include_router(admin.router, prefix=API_PREFIX)
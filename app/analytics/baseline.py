@@ -0,0 +1,94 @@
+import json
+import time
+import hashlib
+import threading
+
+from .rul import RemainingUsefulLifetimeModel
+from .harmonic_distance import PackedPeaks
+from ..influxdb.influx import InfluxDB
+from ..utils.constants import HEALTHY_BASELINE_CHECK_INTERVAL
+
+
+class HealthyBaseline:
+    '''
+    Harmonic peaks of the zone A labeled data packed once and shared by every healthy zone distance computation.
+    Labeled data is reloaded when its signature, the ids, zones, peaks and times of the labeled measurements, changes,
+    which is checked at most every check_interval seconds.
+    The signature the stored distances were measured against is kept in influx, when it differs the distances, RUL values
+    and RUL models are deleted so the scheduler and the endpoints compute them again.
+    '''
+
+    def __init__(self, influx: InfluxDB, rul_models = None, check_interval: float = HEALTHY_BASELINE_CHECK_INTERVAL):
+        self.influx = influx
+        self.rul_models = rul_models
+        self.check_interval = check_interval
+
+        # Callers waiting on a reload share its result instead of loading the labeled data again
+        self._lock = threading.Lock()
+
+        self._references = None
+        self._signature = None
+        self._checked_at = None
+        self._loaded_at = None
+
+        self._checks = 0
+        self._loads = 0
+        self._resets = 0
+
+
+    def references(self) -> PackedPeaks:
+        '''Packed zone A harmonic peaks, None without any labeled data'''
+
+        with self._lock:
+            now = time.monotonic()
+
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                self._refresh()
+                self._checked_at = now
+
+            return self._references
+
+
+    def _refresh(self):
+        signature = hashlib.sha256(json.dumps(self.influx.get_labeled_data_signature()).encode('utf-8')).hexdigest()
+        self._checks += 1
+
+        if signature == self._signature:
+            return
+
+        labeled_peaks = self.influx.get_labeled_harmonic_peaks()
+        references = RemainingUsefulLifetimeModel.healthy_references(labeled_peaks) if labeled_peaks else None
+
+        # Distances measured against other references are stale, also after a restart with relabeled data
+        if signature != self.influx.get_healthy_baseline_signature():
+            self.influx.clear_healthy_zone_data()
+
+            if self.rul_models is not None:
+                self.rul_models.clear()
+
+            self.influx.write_healthy_baseline_signature(signature=signature)
+            self._resets += 1
+
+        self._references = references
+        self._signature = signature
+        self._loaded_at = time.time()
+        self._loads += 1
+
+
+    def invalidate(self):
+        '''Reloads the labeled data on the next call'''
+
+        with self._lock:
+            self._signature = None
+            self._checked_at = None
+
+
+    def status(self):
+        with self._lock:
+            return {
+                'references': len(self._references) if self._references is not None else 0,
+                'checks': self._checks,
+                'loads': self._loads,
+                'resets': self._resets,
+                'loaded_at': self._loaded_at
+            }
@@ -0,0 +1,106 @@
+import numpy as np
+
+from typing import List
+
+
+class MeasurementBatch:
+    '''
+    Samples of many measurements kept in one contiguous (number of samples, 3) buffer.
+    Measurement i owns the rows offsets[i]:offsets[i + 1], its ids are node_ids[node_codes[i]] and measurement_ids[measurement_codes[i]].
+    '''
+
+    __slots__ = ('samples', 'offsets', 'node_ids', 'measurement_ids', 'node_codes', 'measurement_codes')
+
+    def __init__(self,
+                 samples: np.ndarray,
+                 offsets: np.ndarray,
+                 node_ids: List[str],
+                 measurement_ids: List[str],
+                 node_codes: np.ndarray,
+                 measurement_codes: np.ndarray):
+
+        self.samples = np.ascontiguousarray(samples, dtype=np.float64).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.node_ids = list(node_ids)
+        self.measurement_ids = list(measurement_ids)
+        self.node_codes = np.asarray(node_codes, dtype=np.int64)
+        self.measurement_codes = np.asarray(measurement_codes, dtype=np.int64)
+
+        if self.offsets.shape[0] != self.node_codes.shape[0] + 1 or self.node_codes.shape != self.measurement_codes.shape:
+            raise ValueError('Offsets and ids do not describe the same measurements')
+
+        if self.offsets[0] != 0 or self.offsets[-1] != self.samples.shape[0] or np.any(np.diff(self.offsets) <= 0):
+            raise ValueError('Offsets must split the samples into non empty measurements')
+
+
+    @classmethod
+    def empty(cls):
+        return cls(samples=np.empty((0, 3)), offsets=[0], node_ids=[], measurement_ids=[], node_codes=[], measurement_codes=[])
+
+
+    def __len__(self):
+        return self.node_codes.shape[0]
+
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+
+    def keys(self):
+        '''(nodeId, measurementId) of every measurement in buffer order'''
+
+        return [(self.node_ids[n], self.measurement_ids[m]) for n, m in zip(self.node_codes.tolist(), self.measurement_codes.tolist())]
+
+
+    def sums(self, values: np.ndarray = None) -> np.ndarray:
+        '''Per measurement sums of the given per sample rows, the samples themselves by default'''
+
+        values = self.samples if values is None else values
+        if not len(self):
+            return np.empty((0,) + values.shape[1:], dtype=values.dtype)
+
+        return np.add.reduceat(values, self.offsets[:-1], axis=0)
+
+
+    def means(self) -> np.ndarray:
+        return self.sums() / self.lengths[:, np.newaxis]
+
+
+    def normalize(self):
+        '''Removes the mean of every measurement from its samples in place'''
+
+        means = self.means()
+
+        # Single sample measurements are kept as they are
+        means[self.lengths <= 1] = 0.0
+
+        self.samples -= np.repeat(means, self.lengths, axis=0)
+
+        return self
+
+
+    def rms(self) -> np.ndarray:
+        '''(number of measurements, 3) root mean square of x, y and z'''
+
+        return np.sqrt(self.sums(np.square(self.samples)) / self.lengths[:, np.newaxis])
+
+
+    def select(self, mask: np.ndarray):
+        '''Returns a new batch with the measurements where mask is true'''
+
+        mask = np.asarray(mask, dtype=bool)
+        if mask.all():
+            return self
+
+        if not mask.any():
+            return MeasurementBatch.empty()
+
+        lengths = self.lengths[mask]
+
+        return MeasurementBatch(samples=self.samples[np.repeat(mask, self.lengths)],
+                                offsets=np.concatenate(([0], np.cumsum(lengths))),
+                                node_ids=self.node_ids,
+                                measurement_ids=self.measurement_ids,
+                                node_codes=self.node_codes[mask],
+                                measurement_codes=self.measurement_codes[mask])
@@ -1,50 +1,47 @@
 import numpy as np
 
-from collections import defaultdict
+from sklearn.cluster import MeanShift, estimate_bandwidth
 
-from sklearn.cluster import MeanShift
+from ..utils.constants import OUTLIER_SAMPLE_SIZE
 
 class MeanShiftClustering:
+    '''
+    Marks the measurements outside the most frequent MeanShift cluster of average accelerations as outliers.
+    The bandwidth is estimated and the model is fitted with bin seeding on at most sample_size reference averages,
+    the scored averages are assigned to their closest cluster.
+    '''
 
-    def __init__(self, vibration_data = None, measurements_average_accelaration = None):
-        self.vibration_data = vibration_data
-        
-        self.measurements_id = None
-        self.measurements_averages = None
-        
-        self.model = MeanShift()
-        self._model_fitted = False
+    def __init__(self, sample_size: int = OUTLIER_SAMPLE_SIZE, random_state: int = 0):
+        self.sample_size = sample_size
+        self.random_state = random_state
 
-        if measurements_average_accelaration is not None:
-            self.measurements_id = list(measurements_average_accelaration.keys())
-            self.measurements_averages = list(measurements_average_accelaration.values())
 
+    def _sample(self, averages: np.ndarray) -> np.ndarray:
+        if averages.shape[0] <= self.sample_size:
+            return averages
 
-    def _fit(self):
-        if self.measurements_averages is None:
-            raise NotImplementedError
-        
-        self.model.fit(self.measurements_averages)
-        self._model_fitted = True
+        rng = np.random.default_rng(self.random_state)
 
+        return averages[rng.choice(averages.shape[0], self.sample_size, replace=False)]
 
-    def outlier_detection(self) -> defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: []))):
-        if not self._model_fitted:
-            try:
-                self._fit()
-            except NotImplementedError:
-                return None
 
-        predicted_labels = np.array(self.model.labels_)
-        # Finding the most frequent label for vibration data clustering
-        normal_data_label = np.bincount(predicted_labels).argmax()
+    def outliers(self, averages: np.ndarray, reference: np.ndarray = None) -> np.ndarray:
+        '''
+        Returns a mask of the outliers among (number of measurements, 3) average accelerations,
+        the clusters are fitted on the reference averages or on the scored ones without a reference
+        '''
 
-        valid_measurements = [measurement for i, measurement in enumerate(self.measurements_id) if predicted_labels[i] == normal_data_label]
+        sample = self._sample(averages if reference is None else reference)
 
-        filtered_data = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: [])))
-        for nId, measurements in self.vibration_data.items():
-            for mId, samples in measurements.items():
-                if mId in valid_measurements:
-                    filtered_data[nId][mId] = samples
+        bandwidth = estimate_bandwidth(sample, random_state=self.random_state)
+        # Averages that are all the same make a single cluster
+        if bandwidth <= 0:
+            return np.zeros(averages.shape[0], dtype=bool)
 
-        return filtered_data
\ No newline at end of file
+        model = MeanShift(bandwidth=bandwidth, bin_seeding=True).fit(sample)
+        predicted_labels = model.predict(averages)
+
+        # Finding the most frequent label of the fitted data, so it does not depend on which averages are scored together
+        normal_data_label = np.bincount(model.labels_).argmax()
+
+        return predicted_labels != normal_data_label
@@ -0,0 +1,115 @@
+import numpy as np
+
+from typing import List, Dict
+
+from ..utils.constants import SMOOTHING_WINDOW_SIZE
+
+
+class PackedPeaks:
+    '''
+    Harmonic peaks of many measurements padded into (number of measurements, maximum number of peaks) arrays,
+    with the maximum frequency and peak value of every measurement the distances are normalized by.
+    '''
+
+    __slots__ = ('frequencies', 'values', 'counts', 'maximum_frequencies', 'maximum_values')
+
+    def __init__(self, frequencies: np.ndarray, values: np.ndarray, counts: np.ndarray):
+        self.frequencies = frequencies
+        self.values = values
+        self.counts = counts
+
+        mask = self.mask
+        self.maximum_frequencies = np.max(np.where(mask, frequencies, 0), axis=1, initial=0)
+        self.maximum_values = np.max(np.where(mask, values, 0), axis=1, initial=0)
+
+
+    @classmethod
+    def from_lists(cls, harmonic_peaks: List[List[Dict[str, float]]]):
+        '''Packs [{'frequency', 'peak_value'}] peak lists keeping the order of the peaks in every list'''
+
+        counts = np.fromiter((len(peaks) for peaks in harmonic_peaks), dtype=np.int64, count=len(harmonic_peaks))
+        width = int(counts.max()) if counts.shape[0] else 0
+
+        frequencies = np.zeros((counts.shape[0], width))
+        values = np.zeros((counts.shape[0], width))
+
+        for i, peaks in enumerate(harmonic_peaks):
+            frequencies[i, :len(peaks)] = [peak['frequency'] for peak in peaks]
+            values[i, :len(peaks)] = [peak['peak_value'] for peak in peaks]
+
+        return cls(frequencies=frequencies, values=values, counts=counts)
+
+
+    def __len__(self):
+        return self.counts.shape[0]
+
+
+    @property
+    def mask(self) -> np.ndarray:
+        return np.arange(self.frequencies.shape[1]) < self.counts[:, np.newaxis]
+
+
+def harmonic_peak_distances(measurements: PackedPeaks, references: PackedPeaks) -> np.ndarray:
+    '''
+    Distance of every measurement to every reference, (number of measurements, number of references).
+    Pairs are matched in lockstep, the loop runs once per peak position instead of once per pair and peak.
+    Matching follows RemainingUsefulLifetimeModel._harmonic_peak_distance:
+    measurement peaks are taken from the last one, each is matched to the closest remaining reference peak by frequency,
+    a match within SMOOTHING_WINDOW_SIZE adds their distance to the running distance and removes the reference peak,
+    otherwise the running distance restarts at the norm of the measurement peak.
+    '''
+
+    M, R = len(measurements), len(references)
+    K1, K2 = measurements.frequencies.shape[1], references.frequencies.shape[1]
+
+    q1_mask = np.broadcast_to(measurements.mask[:, np.newaxis, :], (M, R, K1))
+    q2_mask = np.broadcast_to(references.mask[np.newaxis, :, :], (M, R, K2))
+
+    q1_frequencies = np.broadcast_to(measurements.frequencies[:, np.newaxis, :], (M, R, K1))
+    q1_values = np.broadcast_to(measurements.values[:, np.newaxis, :], (M, R, K1))
+    q2_frequencies = np.broadcast_to(references.frequencies[np.newaxis, :, :], (M, R, K2))
+    q2_values = np.broadcast_to(references.values[np.newaxis, :, :], (M, R, K2))
+
+    # Normalizing every pair by the maximum peak and frequency of both of its peak lists
+    maximum_frequency = np.maximum(measurements.maximum_frequencies[:, np.newaxis], references.maximum_frequencies[np.newaxis, :])
+    maximum_peak = np.maximum(measurements.maximum_values[:, np.newaxis], references.maximum_values[np.newaxis, :])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q1_frequencies = q1_frequencies / maximum_frequency[:, :, np.newaxis]
+        q1_values = q1_values / maximum_peak[:, :, np.newaxis]
+        q2_frequencies = q2_frequencies / maximum_frequency[:, :, np.newaxis]
+        q2_values = q2_values / maximum_peak[:, :, np.newaxis]
+
+    remaining = q2_mask.copy()
+    summation = np.zeros((M, R))
+    counter = np.zeros((M, R), dtype=np.int64)
+    dist = np.zeros((M, R))
+
+    pairs = np.ogrid[:M, :R]
+
+    # Without any reference peak every measurement peak is skipped, there is nothing to match
+    for k in range(K1 - 1 if K2 and M and R else -1, -1, -1):
+        freq, peak = q1_frequencies[:, :, k], q1_values[:, :, k]
+
+        # Measurement peaks are skipped without counting once every reference peak is matched
+        active = q1_mask[:, :, k] & remaining.any(axis=2)
+
+        closest = np.argmin(np.where(remaining, np.abs(q2_frequencies - freq[:, :, np.newaxis]), np.inf), axis=2)
+        closest_freq = q2_frequencies[pairs[0], pairs[1], closest]
+        closest_peak = q2_values[pairs[0], pairs[1], closest]
+
+        with np.errstate(invalid='ignore'):
+            matched = active & (np.abs(freq - closest_freq) * maximum_frequency < SMOOTHING_WINDOW_SIZE)
+
+        dist = np.where(matched, dist + np.sqrt((freq - closest_freq) ** 2 + (peak - closest_peak) ** 2), dist)
+        dist = np.where(active & ~matched, np.sqrt(freq ** 2 + peak ** 2), dist)
+
+        summation += np.where(active, dist, 0)
+        counter += active
+
+        remaining[pairs[0], pairs[1], closest] &= ~matched
+
+    unmatched = np.sum(np.where(remaining, q2_values, 0), axis=2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (summation + unmatched) / (counter + references.counts[np.newaxis, :])
@@ -0,0 +1,176 @@
+import numpy as np
+
+from collections import defaultdict
+from typing import Iterable, Tuple
+
+from scipy.fft import rfft
+from scipy.signal import get_window
+
+from .spectrum import SpectrumParameters, compact_psd
+from ..utils.constants import SAMPLING_RATE
+
+
+class RunningRMS:
+    '''RMS of the mean removed samples of one measurement, merged chunk by chunk from their count, mean and squared deviations'''
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = np.zeros(3)
+        self.m2 = np.zeros(3)
+
+
+    def update(self, samples: np.ndarray):
+        '''Adds a (number of samples, 3) chunk'''
+
+        count = samples.shape[0]
+        if not count:
+            return
+
+        mean = samples.mean(axis=0)
+        m2 = np.sum((samples - mean) ** 2, axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+
+    def value(self) -> np.ndarray:
+        # Single sample measurements are not normalized by the batch path either
+        if self.count == 1:
+            return np.abs(self.mean)
+
+        return np.sqrt(self.m2 / self.count)
+
+
+class RunningWelch:
+    '''
+    Welch PSD of one measurement computed segment by segment as samples arrive, x, y and z are summed up.
+    Only the samples of an unfinished segment are kept between chunks.
+    '''
+
+    __slots__ = ('segment_length', 'overlap', 'window', 'pending', 'power', 'segments', 'count')
+
+    def __init__(self, spectrum: SpectrumParameters):
+        self.segment_length = spectrum.segment_length
+        self.overlap = spectrum.overlap
+        self.window = get_window('hann', self.segment_length)
+
+        self.pending = np.empty((0, 3))
+        self.power = np.zeros((self.segment_length // 2 + 1, 3))
+        self.segments = 0
+        self.count = 0
+
+
+    def update(self, samples: np.ndarray):
+        '''Adds a (number of samples, 3) chunk'''
+
+        self.count += samples.shape[0]
+        self.pending = np.concatenate((self.pending, samples))
+
+        step = self.segment_length - self.overlap
+        if self.pending.shape[0] < self.segment_length:
+            return
+
+        # (number of segments, segment length, 3) view over the pending samples
+        segments = np.lib.stride_tricks.sliding_window_view(self.pending, self.segment_length, axis=0)[::step].transpose(0, 2, 1)
+
+        self.power += self._periodograms(segments, self.window)
+        self.segments += segments.shape[0]
+        self.pending = self.pending[segments.shape[0] * step:].copy()
+
+
+    @staticmethod
+    def _periodograms(segments: np.ndarray, window: np.ndarray) -> np.ndarray:
+        '''Sum of the one sided power of constant detrended and windowed segments'''
+
+        detrended = segments - segments.mean(axis=1, keepdims=True)
+
+        return np.sum(np.abs(rfft(detrended * window[:, np.newaxis], axis=1)) ** 2, axis=0)
+
+
+    @staticmethod
+    def _density(power: np.ndarray, window: np.ndarray) -> np.ndarray:
+        '''Scales averaged periodograms the way scipy.signal.welch does for a density'''
+
+        density = power / (SAMPLING_RATE * np.sum(window ** 2))
+
+        if window.shape[0] % 2:
+            density[1:] *= 2
+        else:
+            density[1:-1] *= 2
+
+        return np.sum(density, axis=1)
+
+
+    def value(self) -> np.ndarray:
+        if self.segments:
+            return self._density(self.power / self.segments, self.window)
+
+        # Measurements shorter than a segment make a single segment of their own length, as in the batch path
+        window = get_window('hann', self.count)
+
+        return self._density(self._periodograms(self.pending[np.newaxis], window), window)
+
+
+class IncrementalFeatureExtractor:
+    '''
+    Computes RMS and welch PSD features from a stream of (nodeId, measurementId, time, x, y, z) pieces,
+    such as InfluxDB.iter_vibration_chunks, without holding whole measurements in memory.
+    '''
+
+    def __init__(self, spectrum: SpectrumParameters = None, psd: bool = True):
+        self.spectrum = spectrum if spectrum is not None else SpectrumParameters(method='welch')
+
+        if psd and self.spectrum.method != 'welch':
+            raise ValueError('Only the welch PSD can be computed incrementally')
+
+        self.psd = psd
+
+        self._rms = {}
+        self._welch = {}
+
+
+    def consume(self, pieces: Iterable[Tuple]):
+        for nId, mId, _, x, y, z in pieces:
+            samples = np.column_stack((x, y, z))
+
+            if (nId, mId) not in self._rms:
+                self._rms[(nId, mId)] = RunningRMS()
+
+                if self.psd:
+                    self._welch[(nId, mId)] = RunningWelch(spectrum=self.spectrum)
+
+            self._rms[(nId, mId)].update(samples)
+
+            if self.psd:
+                self._welch[(nId, mId)].update(samples)
+
+        return self
+
+
+    def rms_feature_extraction(self):
+        '''Root Mean Square feature, the format of Preprocesser.rms_feature_extraction'''
+
+        rms_feature = defaultdict(lambda: defaultdict(lambda: {}))
+
+        for (nId, mId), running_rms in self._rms.items():
+            x, y, z = running_rms.value().tolist()
+            rms_feature[nId][mId] = {'x': x, 'y': y, 'z': z}
+
+        return rms_feature
+
+
+    def compact_psd_feature_extraction(self):
+        '''Welch PSD feature, the format of Preprocesser.compact_psd_feature_extraction'''
+
+        psd_feature = defaultdict(lambda: defaultdict(lambda: {}))
+
+        for (nId, mId), running_welch in self._welch.items():
+            psd_feature[nId][mId] = compact_psd(running_welch.value(), number_of_samples=running_welch.count, spectrum=self.spectrum)
+
+        return psd_feature
@@ -0,0 +1,169 @@
+import time
+import threading
+import numpy as np
+
+from collections import defaultdict, OrderedDict
+from typing import Dict, List, Tuple
+
+from .batch import MeasurementBatch
+from .clustering import MeanShiftClustering
+from ..utils.env_vars import OUTLIER_DETECTION
+from ..utils.constants import OUTLIER_MAD_THRESHOLD, OUTLIER_MIN_MEASUREMENTS, OUTLIER_CLUSTERING_MIN_MEASUREMENTS, OUTLIER_HISTORY_SIZE
+
+# Scales the median absolute deviation to the standard deviation of normally distributed data
+MAD_SCALE = 1.4826
+
+
+class RobustOutlierDetection:
+    '''
+    Marks the measurements whose average acceleration is more than threshold scaled median absolute deviations away
+    from the median of the reference averages of their node on any axis.
+    '''
+
+    def __init__(self, threshold: float = OUTLIER_MAD_THRESHOLD):
+        self.threshold = threshold
+
+
+    def outliers(self, averages: np.ndarray, reference: np.ndarray = None) -> np.ndarray:
+        '''Returns a mask of the outliers among (number of measurements, 3) average accelerations, compared against themselves without a reference'''
+
+        reference = averages if reference is None else reference
+
+        median = np.median(reference, axis=0)
+        deviation = np.abs(averages - median)
+
+        # Identical averages have no deviation, only exact matches of the median are inliers then
+        mad = np.maximum(MAD_SCALE * np.median(np.abs(reference - median), axis=0), np.finfo(np.float64).eps * np.maximum(np.abs(median), 1.0))
+
+        return np.any(deviation / mad > self.threshold, axis=1)
+
+
+class NodeHistory:
+    '''
+    Average accelerations of the last history_size measurements scored on every node, so small batches are scored against
+    the recent measurements of their node instead of each other. Outliers are kept too, after a level shift such as a sensor
+    remount the new level becomes the median once it makes up most of the history. A measurement scored again is not added again.
+    '''
+
+    def __init__(self, history_size: int = OUTLIER_HISTORY_SIZE):
+        self.history_size = history_size
+
+        # nodeId -> {measurementId: [x, y, z] average} in the order the measurements were scored
+        self._history = defaultdict(lambda: OrderedDict())
+        self._lock = threading.Lock()
+
+
+    def add(self, nodeId: str, measurementIds: List[str], averages: np.ndarray) -> np.ndarray:
+        '''Adds the averages of a node and returns the (number of measurements, 3) reference to score them against'''
+
+        with self._lock:
+            history = self._history[nodeId]
+            new = np.array([mId not in history for mId in measurementIds], dtype=bool)
+
+            # The scored averages are part of the reference even when the history is smaller than the batch
+            reference = np.concatenate((np.array(list(history.values())).reshape(-1, 3), averages[new]))
+
+            for i in np.flatnonzero(new).tolist():
+                history[measurementIds[i]] = averages[i].tolist()
+
+            while len(history) > self.history_size:
+                history.popitem(last=False)
+
+        return reference
+
+
+class OutlierFilter:
+    '''
+    Outlier detection stage of the preprocesser, drops the measurements whose average acceleration is far from the rest of their node.
+    method is none, mad (RobustOutlierDetection) or meanshift (MeanShiftClustering), both score a measurement against the
+    history of its node and only once the history holds min_measurements averages, so a decision does not depend on the
+    measurements it is batched with. The time spent is kept for the status endpoint.
+    '''
+
+    METHODS = ('none', 'mad', 'meanshift')
+
+    def __init__(self, method: str = OUTLIER_DETECTION, min_measurements: int = None):
+        if method not in OutlierFilter.METHODS:
+            raise ValueError(f'Outlier detection method must be one of {", ".join(OutlierFilter.METHODS)}')
+
+        # Clusters of a few dozen averages split ordinary spread, MeanShift needs a larger history than the median
+        if min_measurements is None:
+            min_measurements = OUTLIER_CLUSTERING_MIN_MEASUREMENTS if method == 'meanshift' else OUTLIER_MIN_MEASUREMENTS
+
+        self.method = method
+        self.min_measurements = min_measurements
+
+        self._history = NodeHistory()
+        self._robust = RobustOutlierDetection()
+        self._clustering = MeanShiftClustering()
+        self._lock = threading.Lock()
+
+        self._calls = 0
+        self._measurements = 0
+        self._outliers = 0
+        self._total_time = 0.0
+        self._last_time = 0.0
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.method != 'none'
+
+
+    def _node_outliers(self, nodeId: str, measurementIds: List[str], averages: np.ndarray) -> np.ndarray:
+        reference = self._history.add(nodeId=nodeId, measurementIds=measurementIds, averages=averages)
+
+        # Outliers are not processed again, nothing is marked before the node has enough measurements to compare against
+        if reference.shape[0] < self.min_measurements:
+            return np.zeros(averages.shape[0], dtype=bool)
+
+        if self.method == 'mad':
+            return self._robust.outliers(averages=averages, reference=reference)
+
+        return self._clustering.outliers(averages=averages, reference=reference)
+
+
+    def filter(self, batch: MeasurementBatch) -> Tuple[MeasurementBatch, Dict[Tuple[str, str], List[float]]]:
+        '''Returns the batch without its outliers and the {(nodeId, measurementId): [x, y, z] average acceleration} outliers'''
+
+        if not self.enabled or not len(batch):
+            return batch, {}
+
+        start = time.perf_counter()
+
+        keys = batch.keys()
+        averages = batch.means()
+        outliers = np.zeros(len(batch), dtype=bool)
+
+        for code in np.unique(batch.node_codes).tolist():
+            rows = np.flatnonzero(batch.node_codes == code)
+            outliers[rows] = self._node_outliers(nodeId=batch.node_ids[code], measurementIds=[keys[i][1] for i in rows.tolist()], averages=averages[rows])
+
+        outlier_averages = {keys[i]: averages[i].tolist() for i in np.flatnonzero(outliers).tolist()}
+
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._calls += 1
+            self._measurements += len(batch)
+            self._outliers += len(outlier_averages)
+            self._total_time += elapsed
+            self._last_time = elapsed
+
+        return batch.select(~outliers), outlier_averages
+
+
+    def status(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'calls': self._calls,
+                'measurements': self._measurements,
+                'outliers': self._outliers,
+                # Seconds spent detecting outliers
+                'last_time': self._last_time,
+                'average_time': self._total_time / self._calls if self._calls else 0.0
+            }
+
+
+outlier_filter = OutlierFilter()
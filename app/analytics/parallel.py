@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+from .batch import MeasurementBatch
+from .spectrum import power_spectral_density
+
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    '''Shared worker pool, processes are spawned so they do not inherit the threads of the server'''
+
+    global _pool, _pool_workers
+
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+            _pool_workers = workers
+
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _attach(name: str, shape):
+    shm = shared_memory.SharedMemory(name=name)
+
+    return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+def _psd_chunk(samples_name: str, number_of_rows: int, psd_name: str, starts: np.ndarray, number_of_samples: int):
+    '''Worker side, writes the PSD of equal length measurements beginning at the given rows into the output block'''
+
+    samples_shm, samples = _attach(name=samples_name, shape=(number_of_rows, 3))
+    psd_shm, psd = _attach(name=psd_name, shape=(number_of_rows,))
+
+    try:
+        rows = starts[:, np.newaxis] + np.arange(number_of_samples)
+        psd[rows] = power_spectral_density(samples[rows])
+    finally:
+        del samples, psd
+        samples_shm.close()
+        psd_shm.close()
+
+
+def parallel_power_spectral_density(batch: MeasurementBatch, workers: int) -> np.ndarray:
+    '''
+    PSD of every measurement of the batch computed on the worker pool, aligned with the batch samples.
+    Samples and results go through shared memory, only the chunk row offsets are pickled.
+    Every chunk writes its own rows so the result does not depend on the order the workers finish.
+    '''
+
+    number_of_rows = batch.samples.shape[0]
+    lengths = batch.lengths
+
+    samples_shm = shared_memory.SharedMemory(create=True, size=max(batch.samples.nbytes, 1))
+    psd_shm = shared_memory.SharedMemory(create=True, size=max(number_of_rows * 8, 1))
+
+    try:
+        np.ndarray(batch.samples.shape, dtype=np.float64, buffer=samples_shm.buf)[:] = batch.samples
+
+        pool = get_pool(workers=workers)
+        futures = []
+
+        # Measurements of the same length are split into one chunk per worker
+        for number_of_samples in np.unique(lengths).tolist():
+            indices = np.flatnonzero(lengths == number_of_samples)
+
+            for chunk in np.array_split(indices, min(workers, indices.shape[0])):
+                futures.append(pool.submit(_psd_chunk, samples_shm.name, number_of_rows, psd_shm.name, batch.offsets[chunk], number_of_samples))
+
+        for future in futures:
+            future.result()
+
+        return np.ndarray((number_of_rows,), dtype=np.float64, buffer=psd_shm.buf).copy()
+    finally:
+        samples_shm.close()
+        samples_shm.unlink()
+        psd_shm.close()
+        psd_shm.unlink()
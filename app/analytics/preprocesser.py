@@ -1,129 +1,123 @@
 import numpy as np
 
-from scipy.fft import dct, fftfreq
-from scipy.signal import find_peaks
-
-from .clustering import MeanShiftClustering
+from .batch import MeasurementBatch
+from .spectrum import SpectrumParameters, power_spectral_density, top_peaks, compact_psd, compact_peaks
+from .parallel import parallel_power_spectral_density
+from .outliers import OutlierFilter, outlier_filter as default_outlier_filter
 
 from collections import defaultdict
-from copy import deepcopy
-from typing import List, Dict
 
-from ..utils.constants import SMOOTHING_WINDOW_SIZE, SAMPLING_RATE, MAXIMUM_NUMBER_OF_PEAKS
+from ..utils.constants import SMOOTHING_WINDOW_SIZE, MAXIMUM_NUMBER_OF_PEAKS, PARALLEL_MIN_SAMPLES
+from ..utils.env_vars import FEATURE_EXTRACTION_WORKERS
 
 class Preprocesser:
 
     def __init__(self,
-                 matrices: Dict[str, Dict[str, Dict[str, List]]] = None,
-                 nodes_ids = None,
-                 measurements_ids = None):
-
-        self.matrices = matrices
-        self.nodes_ids = nodes_ids
-        self.measurements_ids = measurements_ids
+                 batch: MeasurementBatch = None,
+                 spectrum: SpectrumParameters = None,
+                 workers: int = FEATURE_EXTRACTION_WORKERS,
+                 outlier_filter: OutlierFilter = default_outlier_filter):
+        if batch is None:
+            raise ValueError('Measurement batch is not created!')
 
-        # TODO: Set a threshold for including outlier detection process
-        if False:
-            self.matrices = self._outlier_detection(vibration_data=matrices)
+        self.batch = batch
+        self.nodes_ids = batch.node_ids
+        self.measurements_ids = batch.measurement_ids
+        self.spectrum = spectrum if spectrum is not None else SpectrumParameters()
+        self.workers = workers
 
-        # Normalizing samples to remove gravity effect
-        self.normalized_data = self._normalize_vibration_data()
+        self._psd = None
 
+        # Measurements left out as outliers, {(nodeId, measurementId): [x, y, z] average acceleration}
+        self.batch, self.outliers = outlier_filter.filter(batch=self.batch)
 
-    def _normalize_vibration_data(self):
-        '''Normalized the input data to remove gravity effect'''
+        # Normalizing samples in place to remove gravity effect, the batch belongs to this preprocesser
+        self.batch.normalize()
 
-        if self.matrices is None:
-            raise ValueError('Matrices are not created!')
 
-        normalized_matrices = deepcopy(self.matrices)
+    def _group_by_length(self):
+        '''Yields the indices of equal length measurements and the (number of measurements, number of samples) batch rows they own'''
 
-        for nId, measurements in normalized_matrices.items():
-            for mId, m in measurements.items():
-                number_of_samples = m['x'].shape[0]
+        lengths = self.batch.lengths
 
-                # Subtracting the average sum of samples from the collected samples
-                if number_of_samples > 1:
-                    normalized_matrices[nId][mId]['x'] -= np.mean(m['x'])
-                    normalized_matrices[nId][mId]['y'] -= np.mean(m['y'])
-                    normalized_matrices[nId][mId]['z'] -= np.mean(m['z'])
+        for number_of_samples in np.unique(lengths).tolist():
+            indices = np.flatnonzero(lengths == number_of_samples)
 
-        return normalized_matrices
+            yield indices, self.batch.offsets[indices][:, np.newaxis] + np.arange(number_of_samples)
 
     
     def rms_feature_extraction(self):
         '''Root Mean Square feature'''
 
-        rms_feature = deepcopy(self.normalized_data)
+        rms_feature = defaultdict(lambda: defaultdict(lambda: {}))
 
-        for nId, measurements in rms_feature.items():
-            for mId, m in measurements.items():
-
-                rms_feature[nId][mId]['x'] = np.sqrt(np.mean(np.absolute(m['x']) ** 2))
-                rms_feature[nId][mId]['y'] = np.sqrt(np.mean(np.absolute(m['y']) ** 2))
-                rms_feature[nId][mId]['z'] = np.sqrt(np.mean(np.absolute(m['z']) ** 2))
+        for (nId, mId), (x, y, z) in zip(self.batch.keys(), self.batch.rms().tolist()):
+            rms_feature[nId][mId] = {'x': x, 'y': y, 'z': z}
 
         return rms_feature
 
 
+    def _power_spectral_density(self):
+        '''PSD of every measurement aligned with the batch samples, measurement i owns psd[offsets[i]:offsets[i + 1]]'''
+
+        if self._psd is not None:
+            return self._psd
+
+        # Large batches are split across worker processes, small ones are not worth the transfer
+        if self.workers > 1 and self.batch.samples.shape[0] >= PARALLEL_MIN_SAMPLES:
+            self._psd = parallel_power_spectral_density(batch=self.batch, workers=self.workers)
+            return self._psd
+
+        self._psd = np.empty(self.batch.samples.shape[0], dtype=np.float64)
+
+        for _, rows in self._group_by_length():
+            self._psd[rows] = power_spectral_density(self.batch.samples[rows])
+
+        return self._psd
+
+
+    def _spectra(self):
+        '''Yields the measurement indices, (number of measurements, number of bins) spectra and frequency axis of every measurement length'''
+
+        # The full resolution PSD is shared with the worker pool, the reduced spectra are computed per length
+        psd = self._power_spectral_density() if self.spectrum.method == 'dct' else None
+
+        for indices, rows in self._group_by_length():
+            spectra = psd[rows] if psd is not None else self.spectrum.spectra(self.batch.samples[rows])
+
+            yield indices, spectra, self.spectrum.frequencies(rows.shape[1])
+
+
     def psd_feature_extraction(self):
         '''Power Spectral Density feature'''
 
         psd_feature = defaultdict(lambda: defaultdict(lambda: []))
+        keys = self.batch.keys()
 
-        for nId, measurements in self.normalized_data.items():
-            for mId, m in measurements.items():
-                number_of_samples = m['x'].shape[0]
-
-                x_psd_feature = (dct(m['x'], type=2, norm='ortho') ** 2) / number_of_samples
-                y_psd_feature = (dct(m['y'], type=2, norm='ortho') ** 2) / number_of_samples
-                z_psd_feature = (dct(m['z'], type=2, norm='ortho') ** 2) / number_of_samples
-                
-                psd_values = x_psd_feature + y_psd_feature + z_psd_feature
-                freqs = fftfreq(m['x'].shape[0], d=1/SAMPLING_RATE)
-                
-                for _, (freq, psd_value) in enumerate(zip(freqs, psd_values)):
-                    psd_feature[nId][mId].append({
-                        'psd_value': psd_value,
-                        'frequency': freq
-                    })
-
-        return psd_feature
+        for indices, spectra, freqs in self._spectra():
+            freqs = freqs.tolist()
 
+            for i, measurement_psd in zip(indices.tolist(), spectra.tolist()):
+                nId, mId = keys[i]
+                psd_feature[nId][mId] = [{'psd_value': psd_value, 'frequency': freq} for freq, psd_value in zip(freqs, measurement_psd)]
 
-    def _compute_measurements_average_accelaration(self, vibration_measurements: Dict[str, Dict[str, Dict[str, List]]]):
-        '''Using this method to pinpoint outlier sensor data'''
-        
-        # Creating a 3-cells vector for each measurement indicating x, y, z means for each measurement
-        average_accelaration_points = defaultdict(lambda: [0.0, 0.0, 0.0])
-        measurements_samples = defaultdict(lambda: 0)
+        return psd_feature
 
-        for _, measurements in vibration_measurements.items():
-            for mId, m in measurements.items():
-                measurements_samples[mId] += m['x'].shape[0]
 
-                average_accelaration_points[mId][0] += np.sum(m['x'])
-                average_accelaration_points[mId][1] += np.sum(m['y'])
-                average_accelaration_points[mId][2] += np.sum(m['z'])
-        
-        for mId in average_accelaration_points.keys():
-            average_accelaration_points[mId][0] /= measurements_samples[mId]
-            average_accelaration_points[mId][1] /= measurements_samples[mId]
-            average_accelaration_points[mId][2] /= measurements_samples[mId]
+    def compact_psd_feature_extraction(self):
+        '''Power Spectral Density feature as one float32 vector per measurement'''
 
-        return average_accelaration_points
-    
+        psd_feature = defaultdict(lambda: defaultdict(lambda: {}))
+        keys = self.batch.keys()
+        lengths = self.batch.lengths
 
-    def _outlier_detection(self, vibration_data: Dict[str, Dict[str, Dict[str, List]]]):
-        '''Returns filtered data after outlier detection process'''
+        for indices, spectra, _ in self._spectra():
+            for i, measurement_psd in zip(indices.tolist(), spectra):
+                nId, mId = keys[i]
+                psd_feature[nId][mId] = compact_psd(measurement_psd, number_of_samples=lengths[i], spectrum=self.spectrum)
 
-        # Computing measurements average accelaration for outlier detection
-        measurement_average_accelaration = self._compute_measurements_average_accelaration(vibration_measurements=vibration_data)
-        
-        ms = MeanShiftClustering(vibration_data=vibration_data, measurements_average_accelaration=measurement_average_accelaration)
+        return psd_feature
 
-        return ms.outlier_detection()
-    
 
     def _check_parseval_theorem(self, psd, rms):
         '''A simple function to check the correctness of feature extraction'''
@@ -150,35 +144,59 @@ class Preprocesser:
         return smoothed
     
 
-    def _find_peaks(self, x, freqs):
-        '''Returning the most dominant peaks and corresponding frequencies of a specific signal'''
+    def harmonic_peak_arrays(self):
+        '''
+        Returns the measurement index, frequency and value of the most dominant peaks of every measurement PSD.
+        Peaks are ordered by measurement and then by descending value.
+        '''
+
+        measurement_indices, frequencies, peak_values = [], [], []
+
+        for indices, spectra, freqs in self._spectra():
+            peak_rows, peak_columns = top_peaks(spectra, number_of_peaks=MAXIMUM_NUMBER_OF_PEAKS)
 
-        peaks_index, _ = find_peaks(x)
+            measurement_indices.append(indices[peak_rows])
+            frequencies.append(freqs[peak_columns])
+            peak_values.append(spectra[peak_rows, peak_columns])
 
-        harmonic_peak_feature = [(freqs[i], x[i]) for i in peaks_index]
-        harmonic_peak_feature = sorted(harmonic_peak_feature, key=lambda t: t[1], reverse=True)
-        harmonic_peak_feature = harmonic_peak_feature[:MAXIMUM_NUMBER_OF_PEAKS]
-        
-        result = [{'peak_value': peak_value, 'frequency': freq} for (freq, peak_value) in harmonic_peak_feature]
+        if not measurement_indices:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
 
-        return result
+        measurement_indices = np.concatenate(measurement_indices)
+        order = np.argsort(measurement_indices, kind='stable')
+
+        return measurement_indices[order], np.concatenate(frequencies)[order], np.concatenate(peak_values)[order]
 
 
     def harmonic_peak_feature_extraction(self):
-        '''Extracting harmonic peak feature from PSD feature after smoothing using hann window'''
+        '''Extracting harmonic peak feature from PSD feature'''
+
+        harmonic_peaks = defaultdict(lambda: defaultdict(lambda: []))
+        keys = self.batch.keys()
+
+        for nId, mId in keys:
+            harmonic_peaks[nId][mId] = []
+
+        measurement_indices, frequencies, peak_values = self.harmonic_peak_arrays()
+
+        for i, freq, peak_value in zip(measurement_indices.tolist(), frequencies.tolist(), peak_values.tolist()):
+            nId, mId = keys[i]
+            harmonic_peaks[nId][mId].append({'peak_value': peak_value, 'frequency': freq})
+
+        return harmonic_peaks
+
 
-        harmonic_peaks = self.psd_feature_extraction()
+    def compact_harmonic_peak_feature_extraction(self):
+        '''Harmonic peak feature as float32 frequency and peak value vectors per measurement'''
 
-        for nId, measurements in harmonic_peaks.items():
-            for mId, psd_features in measurements.items():
-                frequencies, psd_values = [], []
-                
-                for psd_feature in psd_features:
-                    psd_values.append(psd_feature['psd_value'])
-                    frequencies.append(psd_feature['frequency'])
+        harmonic_peaks = defaultdict(lambda: defaultdict(lambda: {}))
+        keys = self.batch.keys()
 
-                # smoothed_feature = self._smooth(x=psd_values, method='hanning')
+        measurement_indices, frequencies, peak_values = self.harmonic_peak_arrays()
+        boundaries = np.searchsorted(measurement_indices, np.arange(len(keys) + 1))
 
-                harmonic_peaks[nId][mId] = self._find_peaks(x=psd_values, freqs=frequencies)
+        for i, (nId, mId) in enumerate(keys):
+            start, end = boundaries[i], boundaries[i + 1]
+            harmonic_peaks[nId][mId] = compact_peaks(frequencies[start:end], peak_values[start:end])
 
-        return harmonic_peaks
\ No newline at end of file
+        return harmonic_peaks
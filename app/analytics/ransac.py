@@ -1,17 +1,30 @@
+import numpy as np
+
 from sklearn.linear_model import RANSACRegressor
 
 
 class RANSAC:
     def __init__(self):
-        self.ransac = RANSACRegressor()
+        # Fixed seed so refitting the same points gives the same model
+        self.ransac = RANSACRegressor(random_state=0)
         self.fitted = False
 
 
     def fit(self, X, y):
         if X is None or y is None:
             return False
-        
-        self.ransac.fit(X=X, y=y)
+
+        # A single feature may be given as a flat list
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+
+        try:
+            self.ransac.fit(X=X, y=y)
+        except ValueError:
+            # Too few points or no consensus set
+            return False
+
         self.fitted = True
 
         return True
@@ -21,4 +34,15 @@ class RANSAC:
         if not self.fitted:
             return None
         
-        return self.ransac.predict(X=line_X)
\ No newline at end of file
+        return self.ransac.predict(X=line_X)
+
+
+    def coefficients(self):
+        '''Slope and intercept of the line fitted on the inliers'''
+
+        if not self.fitted:
+            return None
+
+        estimator = self.ransac.estimator_
+
+        return {'slope': float(np.ravel(estimator.coef_)[0]), 'intercept': float(np.ravel(estimator.intercept_)[0])}
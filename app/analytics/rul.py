@@ -1,7 +1,8 @@
 import numpy as np
 
 from .ransac import RANSAC
-from ..utils.constants import SMOOTHING_WINDOW_SIZE, HEALTHY_ZONE_THRESHOLD
+from .harmonic_distance import PackedPeaks, harmonic_peak_distances
+from ..utils.constants import SMOOTHING_WINDOW_SIZE, HEALTHY_ZONE_THRESHOLD, MAXIMUM_RUL_IN_DAYS
 
 from typing import List, Dict, Tuple
 from collections import defaultdict
@@ -23,7 +24,10 @@ class RemainingUsefulLifetimeModel:
 
 
     def _harmonic_peak_distance(self, p_1: List[Dict[str, float]], p_2: List[Dict[str, float]]) -> float:
-        '''This function estimates the dissimilarity between two harmonic peak features. The model learning process in based on this function.'''
+        '''
+        This function estimates the dissimilarity between two harmonic peak features. The model learning process in based on this function.
+        Reference implementation for a single pair, harmonic_peak_distances computes the same distance for many pairs at once.
+        '''
 
         q1 = [(harmonic_peak['frequency'], harmonic_peak['peak_value']) for harmonic_peak in p_1]
         q2 = [(harmonic_peak['frequency'], harmonic_peak['peak_value']) for harmonic_peak in p_2]
@@ -68,32 +72,39 @@ class RemainingUsefulLifetimeModel:
         return (summation + np.sum(list(map(lambda point: point[1], q2)))) / (counter + len(p_2))
 
     
-    def _get_peak_harmonic_distance_from_healthy_zone(self,
-                                                     harmonic_peak: Dict[str, float],
-                                                     healthy_harmonic_peaks: List[List[Dict[str, float]]]):
-
-        harmonic_distances = [self._harmonic_peak_distance(p_1=harmonic_peak, p_2=healthy_harmonic_peak) for healthy_harmonic_peak in healthy_harmonic_peaks]
-                    
-        return harmonic_distances
-    
-    
     def _get_service_time_in_days(self, service_time: float, starting_service_time: float):
         return (service_time - starting_service_time) // (24 * 60 * 60)
     
     
-    def get_measurements_distance_from_healthy_zone(self,
-                                                    harmonic_peaks: Dict[str, Dict[str, List[Dict[str, float]]]],
-                                                    labeled_peaks: Dict):
-        
+    @staticmethod
+    def healthy_references(labeled_peaks: Dict) -> PackedPeaks:
+        '''Packs the harmonic peaks of the zone A labeled data, the references distances are measured against'''
+
         healthy_harmonic_peaks = []
         for _, labeled_data in labeled_peaks.items():
-            if labeled_peaks['zone'] == 'A':
+            if labeled_data['zone'] == 'A':
                 healthy_harmonic_peaks.append(labeled_data['harmonic_peaks'])
+
+        return PackedPeaks.from_lists(healthy_harmonic_peaks)
+
+
+    def get_measurements_distance_from_healthy_zone(self,
+                                                    harmonic_peaks: Dict[str, Dict[str, List[Dict[str, float]]]],
+                                                    labeled_peaks: Dict = None,
+                                                    references: PackedPeaks = None):
+        '''Distances of every measurement to every healthy reference, references packed beforehand may be given instead of labeled_peaks'''
+
+        references = references if references is not None else self.healthy_references(labeled_peaks)
+
+        keys = [(nId, mId) for nId, measurements in harmonic_peaks.items() for mId in measurements.keys()]
+
+        # Distances of all measurements to all healthy references are computed together
+        harmonic_distances = harmonic_peak_distances(measurements=PackedPeaks.from_lists([harmonic_peaks[nId][mId] for nId, mId in keys]),
+                                                     references=references)
                 
         distances = defaultdict(lambda: defaultdict(lambda: []))
-        for nId, measurements in harmonic_peaks.items():
-            for mId, harmonic_peak in measurements.items():
-                distances[nId][mId] = self._get_peak_harmonic_distance_from_healthy_zone(harmonic_peak=harmonic_peak, healthy_harmonic_peaks=healthy_harmonic_peaks)
+        for (nId, mId), measurement_distances in zip(keys, harmonic_distances.tolist()):
+            distances[nId][mId] = measurement_distances
                 
         return distances
     
@@ -101,22 +112,52 @@ class RemainingUsefulLifetimeModel:
     def fit_rul_model(self,
                       starting_service_time: float,
                       all_measurements: List[Dict[str, str | float]],
-                      harmonic_peaks: Dict[str, Dict[str, List[Dict[str, float]]]],
-                      labeled_peaks: Dict
+                      distances: Dict[str, Dict[str, List[float]]]
                       ) -> bool:
-        
-        distances = self.get_measurements_distance_from_healthy_zone(harmonic_peaks=harmonic_peaks, labeled_peaks=labeled_peaks)
+        '''
+        Fits the distance from the healthy zone of one node against its service time in days.
+        The distance of a measurement is its distance to the closest healthy reference, measurements without one are left out.
+        '''
         
         measurements_distances = dict()
         for _, measurements in distances.items():
             for mId, distance in measurements.items():
-                measurements_distances[mId] = distance
+                distance = [d for d in distance if np.isfinite(d)]
+                if distance:
+                    measurements_distances[mId] = min(distance)
         
-        measurements_ids = [measurement['measurementId'] for measurement in all_measurements]
+        measurements_ids = [measurement['measurementId'] for measurement in all_measurements if measurement['measurementId'] in measurements_distances]
         measurements_time = {measurement['measurementId']: self._get_service_time_in_days(service_time=measurement['time'], starting_service_time=starting_service_time) for measurement in all_measurements}
         
+        # A line needs at least two points
+        if len(measurements_ids) < 2:
+            return False
+        
         X_train = [measurements_time[measurement_id] for measurement_id in measurements_ids]
         y_train = [measurements_distances[measurement_id] for measurement_id in measurements_ids]
         
         return self._ransac.fit(X=X_train, y=y_train)
-        
\ No newline at end of file
+    
+    
+    @property
+    def coefficients(self) -> Dict[str, float]:
+        return self._ransac.coefficients()
+    
+    
+    def get_rul_in_days(self, service_time: float, starting_service_time: float, coefficients: Dict[str, float] = None) -> float:
+        '''
+        Days from service_time until the fitted distance reaches HEALTHY_ZONE_THRESHOLD, 0 once it has reached it.
+        A distance that does not grow is reported as MAXIMUM_RUL_IN_DAYS, the stored coefficients of a model may be given instead of fitting.
+        '''
+        
+        coefficients = coefficients if coefficients is not None else self.coefficients
+        slope, intercept = coefficients['slope'], coefficients['intercept']
+        service_day = self._get_service_time_in_days(service_time=service_time, starting_service_time=starting_service_time)
+        
+        if slope * service_day + intercept >= HEALTHY_ZONE_THRESHOLD:
+            return 0.0
+        
+        if slope <= 0:
+            return float(MAXIMUM_RUL_IN_DAYS)
+        
+        return float(min((HEALTHY_ZONE_THRESHOLD - intercept) / slope - service_day, MAXIMUM_RUL_IN_DAYS))
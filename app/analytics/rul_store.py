@@ -0,0 +1,86 @@
+import threading
+
+from collections import defaultdict
+from typing import List
+
+from .rul import RemainingUsefulLifetimeModel
+from ..influxdb.influx import InfluxDB
+from ..postgresdb.postgres import SessionLocal
+from ..postgresdb.models import RulModel
+
+
+class RulModelStore:
+    '''
+    Per node RUL models kept in postgres as fitted coefficients with a version and a training watermark.
+    A node is refit only when its distance points differ from the ones its model was fitted on or its RUL is no longer stored,
+    the resulting RUL is written to influx so reading it is a single lookup.
+    '''
+
+    def __init__(self, influx: InfluxDB, session_factory = SessionLocal):
+        self.influx = influx
+        self.session_factory = session_factory
+
+        # Refits of the same node must not race on its row
+        self._lock = threading.Lock()
+
+
+    def refresh(self, nodeId: str = None) -> List[str]:
+        '''Refits the models of the scope that have new distance points, returns the refit nodes'''
+
+        starting_service_date = self.influx.get_starting_service_date()
+        if starting_service_date is None:
+            return []
+
+        catalog = self.influx.get_measurement_catalog(nodeId=nodeId)
+        distances = self.influx.get_harmonic_peak_distance_from_healthy_zone(nodeId=nodeId)
+        stored = {rul['node_id'] for rul in self.influx.get_rul_values(nodeId=nodeId)}
+
+        points = defaultdict(lambda: [])
+        for measurement in catalog:
+            if distances.get(measurement['nodeId'], {}).get(measurement['measurementId']):
+                points[measurement['nodeId']].append(measurement)
+
+        with self._lock, self.session_factory() as db:
+            models = {model.node_id: model for model in db.query(RulModel).filter(RulModel.node_id.in_(list(points.keys())))}
+
+            rul_values = {}
+            for nId, measurements in points.items():
+                watermark = max(measurement['time'] for measurement in measurements)
+                model = models.get(nId)
+
+                # RUL values deleted with the processed data are written again even if the model is up to date
+                if model is not None and model.watermark == watermark and model.number_of_points == len(measurements) and nId in stored:
+                    continue
+
+                rul_model = RemainingUsefulLifetimeModel()
+                if not rul_model.fit_rul_model(starting_service_time=starting_service_date, all_measurements=measurements, distances={nId: distances[nId]}):
+                    continue
+
+                if model is None:
+                    model = RulModel(node_id=nId, version=0)
+                    db.add(model)
+
+                model.version += 1
+                model.coefficients = rul_model.coefficients
+                model.watermark = watermark
+                model.number_of_points = len(measurements)
+
+                rul_values[nId] = {'rul_in_days': rul_model.get_rul_in_days(service_time=watermark, starting_service_time=starting_service_date), 'time': watermark}
+
+            # Values are written before the models so a failed write is retried by the next refresh
+            self.influx.write_rul_values(rul_values=rul_values)
+            db.commit()
+
+        return list(rul_values.keys())
+
+
+    def clear(self, nodeIds: List[str] = None):
+        '''Deletes the models of the given nodes, or every model, so they are fitted again from the recomputed distances'''
+
+        with self._lock, self.session_factory() as db:
+            query = db.query(RulModel)
+            if nodeIds is not None:
+                query = query.filter(RulModel.node_id.in_(nodeIds))
+
+            query.delete(synchronize_session=False)
+            db.commit()
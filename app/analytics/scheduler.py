@@ -0,0 +1,303 @@
+import math
+import time
+import asyncio
+import logging
+
+from collections import defaultdict, deque
+from typing import Dict, List, Tuple
+
+from .outliers import outlier_filter
+from .preprocesser import Preprocesser
+from .rul import RemainingUsefulLifetimeModel
+from .harmonic_distance import PackedPeaks
+from .spectrum import SpectrumParameters, expand_features, expand_peaks
+from ..utils.env_vars import PRECOMPUTE_CONCURRENCY
+from ..utils.constants import PRECOMPUTE_BATCH_SIZE, PRECOMPUTE_RECONCILE_INTERVAL, PRECOMPUTE_THROUGHPUT_WINDOW
+
+
+logger = logging.getLogger(__name__)
+
+
+class PrecomputeScheduler:
+    '''
+    Computes and writes the rms, dct PSD, dct harmonic peaks and healthy zone distances of ingested measurements in the background,
+    the RUL models of nodes with new distances are refit afterwards.
+    Measurements are queued when the background writer has stored them and by periodic reconciliation of the catalog with the processed rows,
+    which also picks up measurements ingested while the server was down.
+    '''
+
+    # Spectrum of the precomputed PSD and harmonic peaks, the one the distances and RUL are based on
+    SPECTRUM = SpectrumParameters()
+
+    def __init__(self,
+                 concurrency: int = PRECOMPUTE_CONCURRENCY,
+                 batch_size: int = PRECOMPUTE_BATCH_SIZE,
+                 reconcile_interval: float = PRECOMPUTE_RECONCILE_INTERVAL,
+                 throughput_window: float = PRECOMPUTE_THROUGHPUT_WINDOW):
+
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.reconcile_interval = reconcile_interval
+        self.throughput_window = throughput_window
+
+        self.influx = None
+        self.rul_models = None
+        self.baseline = None
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+
+        # (nodeId, measurementId) -> (measurement time, time it was queued) of the queued and running measurements
+        self._pending: Dict[Tuple[str, str], Tuple[float, float]] = {}
+
+        self._running_measurements = 0
+        self._computed_measurements = 0
+        self._failed_measurements = 0
+        self._completions = deque()
+        self._last_lag = 0.0
+        self._total_lag = 0.0
+        self._last_reconcile = None
+        self._last_reconcile_queued = 0
+
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+
+    def start(self, influx, rul_models, baseline):
+        '''
+        Starts the workers and the reconciliation on the running event loop,
+        influx is an AsyncInfluxDB, rul_models a RulModelStore and baseline the HealthyBaseline distances are measured against.
+        '''
+
+        if self.running:
+            return
+
+        self.influx = influx
+        self.rul_models = rul_models
+        self.baseline = baseline
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.ensure_future(self._reconcile_periodically()))
+
+
+    async def stop(self):
+        if not self.running:
+            return
+
+        self._loop = None
+
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+    def notify(self, measurements: List[Tuple[str, str, float]]):
+        '''Queues stored (nodeId, measurementId, time) measurements, safe to call from the background writer thread'''
+
+        loop = self._loop
+        if loop is None:
+            return
+
+        try:
+            loop.call_soon_threadsafe(self.enqueue, measurements)
+        except RuntimeError:
+            # The event loop closed while the writer was flushing on shutdown
+            pass
+
+
+    def enqueue(self, measurements: List[Tuple[str, str, float]]) -> int:
+        '''Queues (nodeId, measurementId, time) measurements that are not queued or running yet, returns how many were queued'''
+
+        if not self.running:
+            return 0
+
+        queued = 0
+        for nId, mId, measurement_time in measurements:
+            if (nId, mId) in self._pending:
+                continue
+
+            self._pending[(nId, mId)] = (measurement_time, time.monotonic())
+            self._queue.put_nowait((nId, mId))
+            queued += 1
+
+        return queued
+
+
+    def is_pending(self, nodeId: str = None, measurementId: str = None) -> bool:
+        '''Whether a measurement of the scope is queued or running'''
+
+        return any((nodeId is None or nId == nodeId) and (measurementId is None or mId == measurementId) for nId, mId in self._pending.keys())
+
+
+    async def reconcile(self, nodeId: str = None, measurementId: str = None) -> int:
+        '''Queues the catalog measurements of the scope missing any precomputed feature, returns how many were queued'''
+
+        spectrum = PrecomputeScheduler.SPECTRUM.key
+
+        catalog, references, *processed = await asyncio.gather(
+            self.influx.get_measurement_catalog(nodeId=nodeId, measurementId=measurementId),
+            self.influx.run(self.baseline.references),
+            self.influx.get_processed_measurements('rms_feature', field='x_rms_value', nodeId=nodeId, measurementId=measurementId),
+            self.influx.get_processed_measurements('psd_spectrum', field='psd_0', spectrum=spectrum, nodeId=nodeId, measurementId=measurementId),
+            self.influx.get_processed_measurements('harmonic_peak_spectrum', field='frequency_0', spectrum=spectrum, nodeId=nodeId, measurementId=measurementId))
+
+        # Distances are only written once there are healthy references to measure them against
+        if self._has_healthy_references(references):
+            processed.append(await self.influx.get_processed_measurements('harmonic_peak_distance', field='distance', nodeId=nodeId, measurementId=measurementId))
+
+        processed = set.intersection(*processed)
+
+        # Outliers have no features and are not computed again
+        if outlier_filter.enabled:
+            processed |= await self.influx.get_outlier_measurements(nodeId=nodeId, measurementId=measurementId)
+
+        return self.enqueue([(m['nodeId'], m['measurementId'], m['time']) for m in catalog if (m['nodeId'], m['measurementId']) not in processed])
+
+
+    async def _reconcile_periodically(self):
+        while True:
+            try:
+                self._last_reconcile_queued = await self.reconcile()
+                self._last_reconcile = time.time()
+
+                # Also fits the models of distances written before the model store existed
+                await self._refresh_rul_models()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Precompute reconciliation failed')
+
+            await asyncio.sleep(self.reconcile_interval)
+
+
+    async def _work(self):
+        while True:
+            keys = [await self._queue.get()]
+            while len(keys) < self.batch_size and not self._queue.empty():
+                keys.append(self._queue.get_nowait())
+
+            # One query per node, measurement ids are only filtered within the node
+            measurements = defaultdict(lambda: {})
+            for nId, mId in keys:
+                measurements[nId][mId] = self._pending[(nId, mId)][0]
+
+            for nId, node_measurements in measurements.items():
+                self._running_measurements += len(node_measurements)
+
+                try:
+                    await self._process(nodeId=nId, measurements=node_measurements)
+                    self._completed([(nId, mId) for mId in node_measurements.keys()], failed=False)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception(f'Precomputing {len(node_measurements)} measurements of node {nId} failed')
+                    self._completed([(nId, mId) for mId in node_measurements.keys()], failed=True)
+                finally:
+                    self._running_measurements -= len(node_measurements)
+
+
+    async def _process(self, nodeId: str, measurements: Dict[str, float]):
+        '''Computes and writes the features of the given {measurementId: time} measurements of a node'''
+
+        # Samples are stored from the measurement time on, the read starts at the earliest measurement of the batch
+        batch, references = await asyncio.gather(self.influx.get_analytics_input(nodeId=nodeId, measurementsIds=list(measurements.keys()), start=math.floor(min(measurements.values()))),
+                                                 self.influx.run(self.baseline.references))
+        if not len(batch):
+            return
+
+        rms_features, psd_features, harmonic_peaks, distances, outliers = await self.influx.run(self._extract, batch, references)
+        times = {(nodeId, mId): measurement_time for mId, measurement_time in measurements.items()}
+
+        await asyncio.gather(self.influx.write_outliers(outliers=outliers, times=times),
+                             self.influx.write_rms_features(rms_features=rms_features, times=times),
+                             self.influx.write_psd_features(psd_features=psd_features, times=times),
+                             self.influx.write_harmonic_peaks(harmonic_peaks=harmonic_peaks, spectrum=PrecomputeScheduler.SPECTRUM.key, times=times))
+
+        if distances is not None:
+            await self.influx.write_harmonic_peak_ditance_from_healthy_zone(distances=distances, times=times)
+            await self._refresh_rul_models(nodeId=nodeId)
+
+
+    async def _refresh_rul_models(self, nodeId: str = None):
+        # The features are written already, a failed refit is retried with the next distances or reconciliation
+        try:
+            await self.influx.run(self.rul_models.refresh, nodeId=nodeId)
+        except Exception:
+            logger.exception(f'Refitting the RUL models of {nodeId if nodeId is not None else "all nodes"} failed')
+
+
+    @staticmethod
+    def _has_healthy_references(references: PackedPeaks) -> bool:
+        return references is not None and len(references) > 0
+
+
+    @staticmethod
+    def _extract(batch, references: PackedPeaks):
+        '''Feature extraction of a batch, runs off the event loop'''
+
+        preprocessor = Preprocesser(batch=batch, spectrum=PrecomputeScheduler.SPECTRUM)
+
+        rms_features = preprocessor.rms_feature_extraction()
+        psd_features = preprocessor.compact_psd_feature_extraction()
+        harmonic_peaks = preprocessor.compact_harmonic_peak_feature_extraction()
+
+        distances = None
+        if PrecomputeScheduler._has_healthy_references(references):
+            distances = RemainingUsefulLifetimeModel().get_measurements_distance_from_healthy_zone(harmonic_peaks=expand_features(harmonic_peaks, expand=expand_peaks),
+                                                                                                   references=references)
+
+        return rms_features, psd_features, harmonic_peaks, distances, preprocessor.outliers
+
+
+    def _completed(self, keys: List[Tuple[str, str]], failed: bool):
+        now = time.monotonic()
+
+        for key in keys:
+            _, queued_at = self._pending.pop(key)
+
+            if failed:
+                self._failed_measurements += 1
+                continue
+
+            self._last_lag = now - queued_at
+            self._total_lag += self._last_lag
+            self._computed_measurements += 1
+
+        if not failed:
+            self._completions.append((now, len(keys)))
+
+
+    def status(self):
+        now = time.monotonic()
+
+        while self._completions and self._completions[0][0] < now - self.throughput_window:
+            self._completions.popleft()
+
+        oldest = min((queued_at for _, queued_at in self._pending.values()), default=None)
+
+        return {
+            'running': self.running,
+            'concurrency': self.concurrency,
+            'queue_depth': len(self._pending) - self._running_measurements,
+            'running_measurements': self._running_measurements,
+            'computed_measurements': self._computed_measurements,
+            'failed_measurements': self._failed_measurements,
+            # Seconds the oldest queued or running measurement has been waiting for its features
+            'lag': now - oldest if oldest is not None else 0.0,
+            # Seconds from queueing to written features
+            'last_lag': self._last_lag,
+            'average_lag': self._total_lag / self._computed_measurements if self._computed_measurements else 0.0,
+            # Measurements per second over the throughput window
+            'throughput': sum(count for _, count in self._completions) / self.throughput_window,
+            'last_reconcile': self._last_reconcile,
+            'last_reconcile_queued': self._last_reconcile_queued
+        }
+
+
+precompute_scheduler = PrecomputeScheduler()
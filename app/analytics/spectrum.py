@@ -0,0 +1,200 @@
+import base64
+import numpy as np
+
+from scipy.fft import dct, fftfreq, rfftfreq
+from scipy.signal import find_peaks, welch
+from typing import Dict, List
+
+from ..utils.constants import SAMPLING_RATE, WELCH_SEGMENT_LENGTH, PSD_NUMBER_OF_BINS
+
+
+def power_spectral_density(stacked: np.ndarray) -> np.ndarray:
+    '''PSD of (number of measurements, number of samples, 3) equal length measurements, x, y and z are summed up'''
+
+    return np.sum(dct(stacked, type=2, norm='ortho', axis=1) ** 2, axis=2) / stacked.shape[1]
+
+
+class SpectrumParameters:
+    '''
+    How the PSD of a measurement is computed.
+    dct is the full resolution PSD, one bin per sample.
+    welch averages the periodograms of overlapping segments, giving segment_length // 2 + 1 bins,
+    segments overlap by half of their length unless overlap is given.
+    binned sums the dct PSD into number_of_bins equally wide frequency bands.
+    Only the parameters of the chosen method are validated.
+    '''
+
+    __slots__ = ('method', 'segment_length', 'overlap', 'number_of_bins')
+
+    METHODS = ['dct', 'welch', 'binned']
+
+    def __init__(self,
+                 method: str = 'dct',
+                 segment_length: int = WELCH_SEGMENT_LENGTH,
+                 overlap: int = None,
+                 number_of_bins: int = PSD_NUMBER_OF_BINS):
+
+        if method not in SpectrumParameters.METHODS:
+            raise ValueError(f'Unknown spectrum method {method}')
+
+        if overlap is None:
+            overlap = segment_length // 2
+
+        if method == 'welch' and (segment_length < 2 or not 0 <= overlap < segment_length):
+            raise ValueError('Welch segments need at least 2 samples and an overlap smaller than the segment length')
+
+        if method == 'binned' and number_of_bins < 1:
+            raise ValueError('At least one frequency bin is needed')
+
+        self.method = method
+        self.segment_length = int(segment_length)
+        self.overlap = int(overlap)
+        self.number_of_bins = int(number_of_bins)
+
+
+    @property
+    def key(self) -> str:
+        '''Identifies the spectrum in storage, parameters a method does not use are left out'''
+
+        if self.method == 'welch':
+            return f'welch-{self.segment_length}-{self.overlap}'
+
+        if self.method == 'binned':
+            return f'binned-{self.number_of_bins}'
+
+        return 'dct'
+
+
+    @classmethod
+    def from_key(cls, key: str):
+        method, *values = key.split('-')
+
+        if method == 'welch':
+            return cls(method=method, segment_length=int(values[0]), overlap=int(values[1]))
+
+        if method == 'binned':
+            return cls(method=method, number_of_bins=int(values[0]))
+
+        return cls(method=method)
+
+
+    def _segment(self, number_of_samples: int):
+        '''Segment length and overlap used for a measurement, short measurements make a single segment'''
+
+        segment_length = min(self.segment_length, number_of_samples)
+
+        return segment_length, min(self.overlap, segment_length - 1)
+
+
+    def frequencies(self, number_of_samples: int) -> np.ndarray:
+        '''Frequency of every bin of the spectrum of a measurement'''
+
+        if self.method == 'welch':
+            return rfftfreq(self._segment(number_of_samples)[0], d=1/SAMPLING_RATE)
+
+        if self.method == 'binned':
+            # Dct bin k lies at k * SAMPLING_RATE / (2 * number_of_samples), bands are labeled by their center
+            number_of_bins = min(self.number_of_bins, number_of_samples)
+            return (np.arange(number_of_bins) + 0.5) * (SAMPLING_RATE / 2) / number_of_bins
+
+        return fftfreq(number_of_samples, d=1/SAMPLING_RATE)
+
+
+    def spectra(self, stacked: np.ndarray) -> np.ndarray:
+        '''(number of measurements, number of bins) spectra of (number of measurements, number of samples, 3) equal length measurements'''
+
+        number_of_samples = stacked.shape[1]
+
+        if self.method == 'welch':
+            segment_length, overlap = self._segment(number_of_samples)
+            _, psd = welch(stacked, fs=SAMPLING_RATE, nperseg=segment_length, noverlap=overlap, axis=1)
+
+            return np.sum(psd, axis=2)
+
+        psd = power_spectral_density(stacked)
+
+        if self.method == 'binned':
+            number_of_bins = min(self.number_of_bins, number_of_samples)
+            return np.add.reduceat(psd, np.arange(number_of_bins) * number_of_samples // number_of_bins, axis=1)
+
+        return psd
+
+
+def peak_mask(spectra: np.ndarray) -> np.ndarray:
+    '''Marks the local maxima of (number of spectra, number of bins) spectra the same way scipy.signal.find_peaks does'''
+
+    mask = np.zeros(spectra.shape, dtype=bool)
+    mask[:, 1:-1] = (spectra[:, 1:-1] > spectra[:, :-2]) & (spectra[:, 1:-1] > spectra[:, 2:])
+
+    # Flat peaks are left to scipy, which reports the middle of the plateau
+    for row in np.flatnonzero(np.any(spectra[:, 1:] == spectra[:, :-1], axis=1)).tolist():
+        mask[row] = False
+        mask[row, find_peaks(spectra[row])[0]] = True
+
+    return mask
+
+
+def top_peaks(spectra: np.ndarray, number_of_peaks: int):
+    '''
+    Returns the row and column of the highest peaks of every spectrum, ordered by row and then by descending value.
+    Equal values keep the lower column first, the same order a stable descending sort of the peaks gives.
+    '''
+
+    is_peak = peak_mask(spectra)
+    number_of_bins = spectra.shape[1]
+
+    # Only peaks reaching the k-th highest peak value of their spectrum remain candidates
+    if 0 < number_of_peaks < number_of_bins:
+        candidates = np.where(is_peak, spectra, -np.inf)
+        kth_index = np.argpartition(candidates, number_of_bins - number_of_peaks, axis=1)[:, number_of_bins - number_of_peaks]
+        is_peak &= candidates >= candidates[np.arange(spectra.shape[0]), kth_index][:, np.newaxis]
+
+    rows, columns = np.nonzero(is_peak)
+
+    order = np.lexsort((columns, -spectra[rows, columns], rows))
+    rows, columns = rows[order], columns[order]
+
+    # Values tied with the k-th peak can leave more than number_of_peaks candidates in a row
+    keep = np.arange(rows.shape[0]) - np.searchsorted(rows, rows) < number_of_peaks
+
+    return rows[keep], columns[keep]
+
+
+def encode_array(values: np.ndarray) -> str:
+    '''Base64 of the values as little endian float32'''
+
+    return base64.b64encode(np.asarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+def decode_array(text: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype='<f4')
+
+
+def compact_psd(psd: np.ndarray, number_of_samples: int, spectrum: SpectrumParameters) -> Dict:
+    '''Compact PSD of one measurement, the frequency axis is rebuilt from the spectrum, the number of samples and the sampling rate'''
+
+    return {'spectrum': spectrum.key, 'sampling_rate': SAMPLING_RATE, 'number_of_samples': int(number_of_samples), 'psd': encode_array(psd)}
+
+
+def expand_psd(compact: Dict) -> List[Dict[str, float]]:
+    '''One {'psd_value', 'frequency'} dict per bin, the format of Preprocesser.psd_feature_extraction'''
+
+    freqs = SpectrumParameters.from_key(compact['spectrum']).frequencies(compact['number_of_samples']).tolist()
+
+    return [{'psd_value': psd_value, 'frequency': freq} for freq, psd_value in zip(freqs, decode_array(compact['psd']).tolist())]
+
+
+def compact_peaks(frequencies: np.ndarray, peak_values: np.ndarray) -> Dict:
+    return {'frequency': encode_array(frequencies), 'peak_value': encode_array(peak_values)}
+
+
+def expand_peaks(compact: Dict) -> List[Dict[str, float]]:
+    '''One {'peak_value', 'frequency'} dict per peak, the format of Preprocesser.harmonic_peak_feature_extraction'''
+
+    return [{'peak_value': peak_value, 'frequency': freq} for freq, peak_value in zip(decode_array(compact['frequency']).tolist(), decode_array(compact['peak_value']).tolist())]
+
+
+def expand_features(features: Dict[str, Dict[str, Dict]], expand) -> Dict[str, Dict[str, List[Dict[str, float]]]]:
+    '''Expands every compact feature of a {nodeId: {measurementId: feature}} result'''
+
+    return {nId: {mId: expand(feature) for mId, feature in measurements.items()} for nId, measurements in features.items()}
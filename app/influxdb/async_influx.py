@@ -0,0 +1,45 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .influx import InfluxDB
+from ..utils.constants import INFLUXDB_EXECUTOR_WORKERS
+
+
+class AsyncInfluxDB:
+    '''
+    Async version of InfluxDB for the route handlers, every method of InfluxDB is available as a coroutine.
+    Calls run on a dedicated thread pool so a slow query does not stall the event loop and independent queries can be awaited together.
+    Generator methods (iter_*) and attributes are returned unchanged, streaming responses already iterate them outside the event loop.
+    '''
+
+    def __init__(self, influx: InfluxDB = None, max_workers: int = INFLUXDB_EXECUTOR_WORKERS):
+        self.influx = influx if influx is not None else InfluxDB()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='influx-query')
+
+
+    async def run(self, function, *args, **kwargs):
+        '''Runs a blocking function on the influx thread pool'''
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.influx, name)
+
+        if not callable(attribute) or name.startswith('iter_'):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def method(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+
+        return method
+
+
+    async def close(self):
+        await self.run(self.influx.close)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,141 @@
+import json
+import time
+import inspect
+import functools
+import threading
+
+from collections import OrderedDict
+
+from ..utils.constants import FEATURE_CACHE_MAX_ENTRIES, FEATURE_CACHE_MAX_BYTES, PROCESSED_DATA_EXPIRATION_TIME
+
+
+class FeatureCache:
+    '''
+    Thread safe LRU cache of feature query results keyed by (feature, nodeId, measurementId, parameters).
+    Processed rows do not expire, entries are dropped by the writers of their node through invalidate.
+    The ttl, PROCESSED_DATA_EXPIRATION_TIME minutes, only bounds how long rows written by another process go unseen.
+    Cached values are shared and must not be modified.
+    '''
+
+    def __init__(self,
+                 max_entries: int = FEATURE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = FEATURE_CACHE_MAX_BYTES,
+                 ttl: float = PROCESSED_DATA_EXPIRATION_TIME * 60):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+            return entry[0]
+
+
+    def put(self, key, value):
+        # Size of the json response the value turns into, sets of keys are measured as lists, a value larger than the whole cache is not kept
+        size = len(json.dumps(value, default=list))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+    def invalidate(self, nodeIds=None):
+        '''Drops the entries of the given nodes and every fleet wide entry, or everything when no node is given'''
+
+        with self._lock:
+            if nodeIds is None:
+                keys = list(self._entries.keys())
+            else:
+                nodeIds = set(nodeIds)
+                keys = [key for key in self._entries.keys() if key[1] is None or key[1] in nodeIds]
+
+            for key in keys:
+                self._remove(key)
+
+            self._invalidations += len(keys)
+
+
+    def status(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations
+            }
+
+
+feature_cache = FeatureCache()
+
+
+def cached_feature(feature: str, cache_empty: bool = False):
+    '''
+    Serves a feature getter from feature_cache, empty results are not cached so missing features get computed.
+    cache_empty keeps empty results of getters, such as the outlier marks, that are empty most of the time.
+    '''
+
+    def decorator(getter):
+        signature = inspect.signature(getter)
+
+        @functools.wraps(getter)
+        def wrapper(self, *args, **kwargs):
+            arguments = signature.bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+
+            parameters = {name: value for name, value in arguments.arguments.items() if name not in ('self', 'nodeId', 'measurementId')}
+            key = (feature, arguments.arguments.get('nodeId'), arguments.arguments.get('measurementId'), tuple(sorted(parameters.items())))
+
+            result = feature_cache.get(key)
+            if result is not None:
+                return result
+
+            result = getter(self, *args, **kwargs)
+            if result or cache_empty:
+                feature_cache.put(key, result)
+
+            return result
+
+        return wrapper
+
+    return decorator
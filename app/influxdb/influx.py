@@ -1,64 +1,151 @@
 import json
+import time
+import functools
+import numpy as np
+import pandas as pd
 from datetime import datetime
 from collections import defaultdict
-from typing import Dict
+from typing import Callable, Dict, List, Tuple
 
 from ..models.SendDataModel import NodeModel
-from ..utils.env_vars import INFLUXDB_ORG, INFLUXDB_BUCKET, INFLUXDB_TOKEN, INFLUXDB_URI
-from ..utils.constants import PROCESSED_DATA_EXPIRATION_TIME
-
-from influxdb_client import InfluxDBClient, Point
+from ..models.BinaryDataModel import MeasurementArrays, check_measurement
+from ..analytics.batch import MeasurementBatch
+from ..utils.env_vars import INFLUXDB_ORG, INFLUXDB_BUCKET, INFLUXDB_TOKEN, INFLUXDB_URI, INFLUXDB_STORAGE_LAYOUT
+from ..utils.constants import SAMPLING_RATE, VIBRATION_STREAM_CHUNK_SIZE, SPECTRUM_FIELD_SIZE
+from .writer import BackgroundWriter
+from .feature_cache import feature_cache, cached_feature
+from .line_protocol import encode_lines, encode_row, to_timestamp, WRITE_PRECISION
+from .pagination import encode_cursor, decode_cursor, flux_range, flux_time, samples_range
+
+from influxdb_client import InfluxDBClient, Dialect
 from influxdb_client.client.write_api import SYNCHRONOUS
 
 
 class InfluxDB:
-    MAIN_MEASUREMENT = ['vibration_measurement']
+    MAIN_MEASUREMENT = ['vibration_measurement', 'measurement_catalog']
     ALL_MEASUREMENTS = MAIN_MEASUREMENT + ['psd_feature',
+                                           'psd_spectrum',
                                            'rms_feature',
                                            'harmonic_peaks',
+                                           'harmonic_peak_spectrum',
                                            'labeled_harmonic_peaks',
                                            'harmonic_peak_distance',
-                                           'rul_values']
-
-    def __init__(self):
+                                           'rul_values',
+                                           'outlier_measurement',
+                                           'healthy_baseline']
+    STORAGE_LAYOUTS = ['v1', 'v2']
+    # Plain csv with a single header row, used by the columnar read path
+    CSV_DIALECT = Dialect(header=True, delimiter=',', annotations=[], comment_prefix='#', date_time_format='RFC3339')
+
+    def __init__(self, storage_layout: str = INFLUXDB_STORAGE_LAYOUT):
+        if storage_layout not in InfluxDB.STORAGE_LAYOUTS:
+            raise ValueError(f'Unknown storage layout {storage_layout}')
+
+        self.storage_layout = storage_layout
         self.client = InfluxDBClient(url=INFLUXDB_URI, org=INFLUXDB_ORG, token=INFLUXDB_TOKEN)
         self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
         self.query_api = self.client.query_api()
+        self.background_writer = BackgroundWriter(write_api=self.write_api, bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, write_precision=WRITE_PRECISION)
 
 
-    def write_vibration_data(self, data: Dict[str, NodeModel]):
-        points = []
-        
-        for nodeId, nodeModel in data.items():
+    def write_vibration_data(self, data: Dict[str, NodeModel], on_written: Callable[[List[Tuple[str, str, float]]], None] = None):
+        measurements = []
 
+        for nodeId, nodeModel in data.items():
             for measurementId, measurement in nodeModel.measurements.items():
-                for i, vibrationData in enumerate(measurement.data):
-                    
-                    new_point = Point('vibration_measurement')\
-                        .tag('nodeId', nodeId)\
-                            .tag('measurementId', measurementId)\
-                                .tag('index', i)\
-                                    .field('x', vibrationData.x)\
-                                        .field('y', vibrationData.y)\
-                                            .field('z', vibrationData.z)\
-                                                .time(time=datetime.utcfromtimestamp(measurement.time))
-                    
-                    points.append(new_point)
-
-        self.write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=points)
-
-
-    def get_vibration_data(self, nodeId: str = None, measurementId: str = None):
+                number_of_samples = len(measurement.data)
+
+                measurement = MeasurementArrays(node_id=nodeId,
+                                                measurement_id=measurementId,
+                                                time=measurement.time,
+                                                x=np.fromiter((v.x for v in measurement.data), dtype=np.float64, count=number_of_samples),
+                                                y=np.fromiter((v.y for v in measurement.data), dtype=np.float64, count=number_of_samples),
+                                                z=np.fromiter((v.z for v in measurement.data), dtype=np.float64, count=number_of_samples))
+
+                # Nothing is queued when a measurement of the request is invalid
+                check_measurement(measurement)
+                measurements.append(measurement)
+
+        self.write_vibration_arrays(measurements=measurements, on_written=on_written)
+
+
+    def write_vibration_arrays(self, measurements: List[MeasurementArrays], on_written: Callable[[List[Tuple[str, str, float]]], None] = None):
+        '''Queues the measurements for the background writer, on_written gets their (nodeId, measurementId, time) once they are stored'''
+
+        records = []
+        number_of_points = 0
+
+        for measurement in measurements:
+            records.append(self.encode_vibration_measurement(measurement=measurement))
+            records.append(self._encode_catalog_entry(nodeId=measurement.node_id,
+                                                      measurementId=measurement.measurement_id,
+                                                      time=measurement.time,
+                                                      sample_count=measurement.number_of_samples))
+            number_of_points += measurement.number_of_samples + 1
+
+        self.background_writer.enqueue(records=records,
+                                       number_of_points=number_of_points,
+                                       on_written=functools.partial(self._vibration_data_written, measurements=[(m.node_id, m.measurement_id, m.time) for m in measurements], on_written=on_written))
+
+
+    def _vibration_data_written(self, measurements: List[Tuple[str, str, float]], on_written: Callable[[List[Tuple[str, str, float]]], None] = None):
+        # The cached catalog and features of these nodes and of the whole fleet no longer cover all of their measurements
+        feature_cache.invalidate(nodeIds={nId for nId, _, _ in measurements})
+
+        if on_written is not None:
+            on_written(measurements)
+
+
+    def encode_vibration_measurement(self, measurement: MeasurementArrays) -> str:
+        '''Encodes the samples of a measurement in the configured storage layout'''
+
+        tags = {'nodeId': measurement.node_id, 'measurementId': measurement.measurement_id}
+        fields = {'x': measurement.x, 'y': measurement.y, 'z': measurement.z}
+        timestamp = to_timestamp(measurement.time)
+
+        if self.storage_layout == 'v2':
+            # Sample i is stored at time + i / SAMPLING_RATE, so no per sample tag is needed
+            offsets = np.rint(np.arange(measurement.number_of_samples) * (to_timestamp(1) / SAMPLING_RATE))
+
+            return encode_lines('vibration_measurement', tags=tags, fields=fields, timestamps=timestamp + offsets)
+
+        return encode_lines('vibration_measurement', tags=tags, fields=fields, timestamp=timestamp, index_tag='index')
+
+
+    def _encode_catalog_entry(self, nodeId: str, measurementId: str, time: float, sample_count: int) -> str:
+        '''One catalog point per measurement lets listings avoid scanning the samples'''
+
+        return encode_lines('measurement_catalog',
+                            tags={'nodeId': nodeId, 'measurementId': measurementId},
+                            fields={'sample_count': [sample_count]},
+                            timestamp=to_timestamp(time))
+
+
+    def _write_records(self, records: List[str]):
+        records = [record for record in records if record]
+
+        if records:
+            self.write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=records, write_precision=WRITE_PRECISION)
+
+
+    def get_vibration_data(self,
+                           nodeId: str = None,
+                           measurementId: str = None,
+                           start: float = None,
+                           stop: float = None,
+                           measurementsIds: List[str] = None):
         '''Returns all vibration data written in db if nodeId is None'''
 
         filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
         filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
+        filter_by_measurements = f'|> filter(fn:(r) => contains(value: r.measurementId, set: {json.dumps(measurementsIds)}))'
 
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: 0)\
+        |> {flux_range(start=start, stop=stop)}\
         |> filter(fn:(r) => r._measurement == "vibration_measurement")\
         {filter_by_node if nodeId is not None else ""}\
         {filter_by_measurement if measurementId is not None else ""}\
+        {filter_by_measurements if measurementsIds is not None else ""}\
         |> keep(columns: ["_time", "_field", "_value", "nodeId", "measurementId", "index"])\
         |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
         |> yield()'
@@ -75,88 +162,378 @@ class InfluxDB:
                 'time': r['_time'] // 1000
             })
 
+        if self.storage_layout == 'v2':
+            # Samples carry their own offsets in v2, all of them are reported with the measurement time
+            for measurements in results.values():
+                for samples in measurements.values():
+                    measurement_time = min(sample['time'] for sample in samples)
+
+                    for sample in samples:
+                        sample['time'] = measurement_time
+
         return results
+
+
+    def get_vibration_data_page(self,
+                                nodeId: str = None,
+                                measurementId: str = None,
+                                start: float = None,
+                                stop: float = None,
+                                limit: int = None,
+                                cursor: str = None):
+        '''Returns at most `limit` measurements ordered by time, and the cursor of the next page if there is one'''
+
+        if limit is None and cursor is None:
+            return self.get_vibration_data(nodeId=nodeId, measurementId=measurementId, start=start, stop=stop), None
+
+        # Measurements of different nodes may share an id and a second, the node keeps the order total
+        def page_key(m):
+            return (m['time'], m['measurementId'], m['nodeId'])
+
+        measurements = self.get_all_measurements(nodeId=nodeId, measurementId=measurementId, start=start, stop=stop)
+        measurements = sorted(measurements, key=page_key)
+
+        if cursor is not None:
+            cursor_key = decode_cursor(cursor)
+            measurements = [m for m in measurements if page_key(m) > cursor_key]
+
+        page = measurements if limit is None else measurements[:limit]
+        if not page:
+            return defaultdict(lambda: defaultdict(lambda: [])), None
+
+        next_cursor = None
+        if len(page) < len(measurements):
+            next_cursor = encode_cursor(time=page[-1]['time'], measurementId=page[-1]['measurementId'], nodeId=page[-1]['nodeId'])
+
+        page_start, page_stop = samples_range(page)
+
+        results = self.get_vibration_data(nodeId=nodeId,
+                                          start=max(page_start, start) if start is not None else page_start,
+                                          stop=min(page_stop, stop) if stop is not None else page_stop,
+                                          measurementsIds=sorted({m['measurementId'] for m in page}))
+
+        # Ids are filtered across nodes, measurements of the time window that are not on the page are dropped
+        keys = {(m['nodeId'], m['measurementId']) for m in page}
+        for nId in list(results.keys()):
+            for mId in list(results[nId].keys()):
+                if (nId, mId) not in keys:
+                    del results[nId][mId]
+
+            if not results[nId]:
+                del results[nId]
+
+        return results, next_cursor
     
 
-    def get_all_nodes_id(self):
+    def iter_vibration_chunks(self,
+                              nodeId: str = None,
+                              measurementId: str = None,
+                              start: float = None,
+                              stop: float = None,
+                              chunk_size: int = VIBRATION_STREAM_CHUNK_SIZE,
+                              measurementsIds: List[str] = None):
+        '''
+        Yields (nodeId, measurementId, time, x, y, z) pieces while the query result is streamed, at most `chunk_size` rows at a time.
+        Samples of a measurement arrive in order and contiguously, a measurement may be split over several pieces.
+        '''
+
+        filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
+        filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
+        filter_by_measurements = f'|> filter(fn:(r) => contains(value: r.measurementId, set: {json.dumps(measurementsIds)}))'
+
+        if self.storage_layout == 'v1':
+            order_samples = '|> map(fn:(r) => ({r with index: int(v: r.index)}))|> sort(columns: ["index"])'
+        else:
+            order_samples = '|> sort(columns: ["_time"])'
+
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: 0)\
+        |> {flux_range(start=start, stop=stop)}\
         |> filter(fn:(r) => r._measurement == "vibration_measurement")\
-        |> keep(columns: ["_time", "_field", "_value", "nodeId"])\
+        {filter_by_node if nodeId is not None else ""}\
+        {filter_by_measurement if measurementId is not None else ""}\
+        {filter_by_measurements if measurementsIds is not None else ""}\
+        |> keep(columns: ["_time", "_field", "_value", "nodeId", "measurementId", "index"])\
         |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
-        |> unique(column: "nodeId")'
+        |> group(columns: ["nodeId", "measurementId"])\
+        {order_samples}\
+        |> group()\
+        |> keep(columns: ["_time", "nodeId", "measurementId", "x", "y", "z"])'
 
-        query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
-        query_result = json.loads(query_result.to_json(orient='records'))
+        dtypes = {'_time': 'str', 'nodeId': 'str', 'measurementId': 'str', 'x': 'float64', 'y': 'float64', 'z': 'float64'}
+        response = self.query_api.query_raw(org=INFLUXDB_ORG, query=query, dialect=InfluxDB.CSV_DIALECT)
 
-        results = [r['nodeId'] for r in query_result]
+        try:
+            for chunk in pd.read_csv(response, usecols=list(dtypes.keys()), dtype=dtypes, chunksize=chunk_size):
+                nodes, measurements, times = chunk['nodeId'].to_numpy(), chunk['measurementId'].to_numpy(), chunk['_time'].to_numpy()
+                x, y, z = chunk['x'].to_numpy(), chunk['y'].to_numpy(), chunk['z'].to_numpy()
 
-        return results
+                boundaries = np.flatnonzero((nodes[1:] != nodes[:-1]) | (measurements[1:] != measurements[:-1])) + 1
 
+                for start, end in zip([0] + boundaries.tolist(), boundaries.tolist() + [x.shape[0]]):
+                    yield nodes[start], measurements[start], pd.Timestamp(times[start]).timestamp(), x[start:end], y[start:end], z[start:end]
+        except pd.errors.EmptyDataError:
+            return
+        finally:
+            response.close()
+
+
+    def iter_vibration_measurements(self, nodeId: str = None, measurementId: str = None, start: float = None, stop: float = None):
+        '''Yields one measurement at a time with the same samples get_vibration_data returns for it'''
+
+        def to_measurement(key, measurement_time, pieces):
+            x, y, z = (np.concatenate([piece[axis] for piece in pieces]).tolist() for axis in range(3))
+            measurement_time = int(measurement_time)
+
+            return {
+                'nodeId': key[0],
+                'measurementId': key[1],
+                'samples': [{'x': a, 'y': b, 'z': c, 'time': measurement_time} for a, b, c in zip(x, y, z)]
+            }
+
+        key, measurement_time, pieces = None, None, []
+
+        for nId, mId, piece_time, x, y, z in self.iter_vibration_chunks(nodeId=nodeId, measurementId=measurementId, start=start, stop=stop):
+            if (nId, mId) != key:
+                if pieces:
+                    yield to_measurement(key, measurement_time, pieces)
+
+                key, measurement_time, pieces = (nId, mId), piece_time, []
+
+            pieces.append((x, y, z))
+
+        if pieces:
+            yield to_measurement(key, measurement_time, pieces)
+
+
+    def _query_columns(self, query: str, dtypes: Dict[str, str]) -> Dict[str, np.ndarray]:
+        '''Runs a query returning a single table and decodes the requested columns of its csv stream into numpy arrays'''
+
+        response = self.query_api.query_raw(org=INFLUXDB_ORG, query=query, dialect=InfluxDB.CSV_DIALECT)
+
+        try:
+            df = pd.read_csv(response, usecols=list(dtypes.keys()), dtype=dtypes)
+        except pd.errors.EmptyDataError:
+            return {column: np.empty(0, dtype=dtype) for column, dtype in dtypes.items()}
+        finally:
+            response.close()
+
+        return {column: df[column].to_numpy() for column in dtypes.keys()}
+
+
+    def get_analytics_input(self,
+                            nodeId: str = None,
+                            measurementId: str = None,
+                            measurementsIds: List[str] = None,
+                            start: float = None,
+                            stop: float = None):
+        '''Fetches the samples of the requested scope in a single query as one measurement batch'''
 
-    def get_all_measurements_id(self, nodeId: str = None):
         filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
+        filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
+        filter_by_measurements = f'|> filter(fn:(r) => contains(value: r.measurementId, set: {json.dumps(measurementsIds)}))'
+
+        dtypes = {'nodeId': 'str', 'measurementId': 'str', 'x': 'float64', 'y': 'float64', 'z': 'float64'}
+        if self.storage_layout == 'v1':
+            dtypes['index'] = 'int64'
 
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: 0)\
+        |> {flux_range(start=start, stop=stop)}\
         |> filter(fn:(r) => r._measurement == "vibration_measurement")\
         {filter_by_node if nodeId is not None else ""}\
-        |> keep(columns: ["_time", "_field", "_value", "measurementId"])\
+        {filter_by_measurement if measurementId is not None else ""}\
+        {filter_by_measurements if measurementsIds is not None else ""}\
+        |> keep(columns: ["_time", "_field", "_value", "nodeId", "measurementId", "index"])\
         |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
-        |> unique(column: "measurementId")'
+        |> group()\
+        |> keep(columns: {json.dumps(list(dtypes.keys()))})'
 
-        query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
-        query_result = json.loads(query_result.to_json(orient='records'))
+        columns = self._query_columns(query=query, dtypes=dtypes)
 
-        results = [r['measurementId'] for r in query_result]
+        if not columns['x'].shape[0]:
+            return MeasurementBatch.empty()
 
-        return results
-    
+        node_ids, node_codes = np.unique(columns['nodeId'], return_inverse=True)
+        measurement_ids, measurement_codes = np.unique(columns['measurementId'], return_inverse=True)
+
+        # Sorting samples by measurement, v1 samples are ordered by their index and v2 samples keep their time order
+        sort_keys = (measurement_codes, node_codes)
+        if self.storage_layout == 'v1':
+            sort_keys = (columns['index'],) + sort_keys
+
+        order = np.lexsort(sort_keys)
+        node_codes, measurement_codes = node_codes[order], measurement_codes[order]
+
+        starts = np.concatenate(([0], np.flatnonzero((np.diff(node_codes) != 0) | (np.diff(measurement_codes) != 0)) + 1))
+
+        return MeasurementBatch(samples=np.column_stack((columns['x'], columns['y'], columns['z']))[order],
+                                offsets=np.concatenate((starts, [order.shape[0]])),
+                                node_ids=node_ids.tolist(),
+                                measurement_ids=measurement_ids.tolist(),
+                                node_codes=node_codes[starts],
+                                measurement_codes=measurement_codes[starts])
     
-    def get_all_measurements(self, nodeId: str = None):
+
+    @cached_feature('catalog')
+    def get_measurement_catalog(self, nodeId: str = None, measurementId: str = None, start: float = None, stop: float = None):
+        '''Returns the measurements ordered by time from the catalog written at ingest, cached until new vibration data of the node is stored'''
+
         filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
+        filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
 
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: 0)\
-        |> filter(fn:(r) => r._measurement == "vibration_measurement")\
+        |> {flux_range(start=start, stop=stop)}\
+        |> filter(fn:(r) => r._measurement == "measurement_catalog" and r._field == "sample_count")\
         {filter_by_node if nodeId is not None else ""}\
-        |> keep(columns: ["_time", "_field", "_value", "measurementId"])\
-        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
-        |> unique(column: "measurementId")'
+        {filter_by_measurement if measurementId is not None else ""}\
+        |> group()\
+        |> sort(columns: ["_time"])\
+        |> keep(columns: ["_time", "_value", "nodeId", "measurementId"])'
 
-        query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
-        query_result = json.loads(query_result.to_json(orient='records'))
+        columns = self._query_columns(query=query, dtypes={'_time': 'str', '_value': 'float64', 'nodeId': 'str', 'measurementId': 'str'})
+        times = pd.to_datetime(columns['_time'], utc=True).asi8 // 1_000_000_000
 
-        results = [{'measurementId': r['measurementId'], 'time': r['_time'] // 1000} for r in query_result]
+        results = [{'measurementId': mId, 'nodeId': nId, 'time': t, 'sample_count': int(count)}
+                   for mId, nId, t, count in zip(columns['measurementId'].tolist(), columns['nodeId'].tolist(), times.tolist(), columns['_value'].tolist())]
+
+        return results
+
+
+    def get_all_nodes_id(self, start: float = None, stop: float = None):
+        query = f'import "influxdata/influxdb/schema"\n\
+        schema.tagValues(bucket: "{INFLUXDB_BUCKET}",\
+                         tag: "nodeId",\
+                         predicate: (r) => r._measurement == "measurement_catalog",\
+                         start: {flux_time(start if start is not None else 0)}\
+                         {f", stop: {flux_time(stop)}" if stop is not None else ""})'
+
+        columns = self._query_columns(query=query, dtypes={'_value': 'str'})
+
+        return columns['_value'].tolist()
+
+
+    def get_all_measurements_id(self, nodeId: str = None, start: float = None, stop: float = None):
+        results = [m['measurementId'] for m in self.get_measurement_catalog(nodeId=nodeId, start=start, stop=stop)]
 
         return results
     
     
-    def write_rms_features(self, rms_features: defaultdict(lambda: defaultdict(lambda: {}))):
-        points = []
+    def get_all_measurements(self, nodeId: str = None, measurementId: str = None, start: float = None, stop: float = None):
+        results = self.get_measurement_catalog(nodeId=nodeId, measurementId=measurementId, start=start, stop=stop)
+
+        return results
+
+
+    def rebuild_measurement_catalog(self):
+        '''Writes the catalog of vibration data stored before the catalog existed'''
+
+        source = f'from(bucket:"{INFLUXDB_BUCKET}")\
+        |> range(start: 0)\
+        |> filter(fn:(r) => r._measurement == "vibration_measurement" and r._field == "x")\
+        |> group(columns: ["nodeId", "measurementId"])'
+
+        dtypes = {'nodeId': 'str', 'measurementId': 'str'}
+        counts = self._query_columns(query=f'{source} |> count() |> group()', dtypes={**dtypes, '_value': 'int64'})
+        times = self._query_columns(query=f'{source} |> first() |> group()', dtypes={**dtypes, '_time': 'str'})
+
+        measurement_times = {(nId, mId): pd.Timestamp(t).timestamp() for nId, mId, t in zip(times['nodeId'], times['measurementId'], times['_time'])}
+
+        records = [self._encode_catalog_entry(nodeId=nId, measurementId=mId, time=measurement_times[(nId, mId)], sample_count=count)
+                   for nId, mId, count in zip(counts['nodeId'], counts['measurementId'], counts['_value'].tolist())
+                   if (nId, mId) in measurement_times]
+
+        self._write_records(records=records)
+
+        return len(records)
+    
+    
+    def _write_features(self, records: List[str], features: Dict):
+        '''Writes processed rows, cached results of their nodes and of the whole fleet no longer hold all of them'''
+
+        # Nothing changed, fleet wide entries are kept
+        if not records:
+            return
+
+        self._write_records(records=records)
+        feature_cache.invalidate(nodeIds=list(features.keys()))
+
+
+    def _feature_timestamps(self, times: Dict[Tuple[str, str], float] = None):
+        '''
+        Processed rows are stored at the time of their measurement, so writing a measurement again replaces its row.
+        Measurements missing from times are stored at the current time.
+        '''
+
+        times = times if times is not None else {}
+        now = time.time()
+
+        return lambda nId, mId: to_timestamp(times.get((nId, mId), now))
+
+
+    def get_processed_measurements(self, measurement: str, field: str, spectrum: str = None, nodeId: str = None, measurementId: str = None):
+        '''Returns the (nodeId, measurementId) pairs with a row of the given processed measurement'''
+
+        filter_by_spectrum = f'|> filter(fn:(r) => r.spectrum == "{spectrum}")'
+        filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
+        filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
+
+        query = f'from(bucket:"{INFLUXDB_BUCKET}")\
+        |> range(start: 0)\
+        |> filter(fn:(r) => r._measurement == "{measurement}" and r._field == "{field}")\
+        {filter_by_spectrum if spectrum is not None else ""}\
+        {filter_by_node if nodeId is not None else ""}\
+        {filter_by_measurement if measurementId is not None else ""}\
+        |> group(columns: ["nodeId", "measurementId"])\
+        |> first()\
+        |> group()\
+        |> keep(columns: ["nodeId", "measurementId"])'
+
+        columns = self._query_columns(query=query, dtypes={'nodeId': 'str', 'measurementId': 'str'})
+
+        return set(zip(columns['nodeId'].tolist(), columns['measurementId'].tolist()))
+
+
+    def write_outliers(self, outliers: Dict[Tuple[str, str], List[float]], times: Dict[Tuple[str, str], float] = None):
+        '''Marks the {(nodeId, measurementId): [x, y, z] average acceleration} measurements outlier detection left out, so they are not processed again'''
+
+        timestamp = self._feature_timestamps(times=times)
+
+        records = [encode_lines('outlier_measurement',
+                                tags={'nodeId': nId, 'measurementId': mId},
+                                fields={'x_average': [x], 'y_average': [y], 'z_average': [z]},
+                                timestamp=timestamp(nId, mId))
+                   for (nId, mId), (x, y, z) in outliers.items()]
+
+        self._write_features(records=records, features=dict.fromkeys(nId for nId, _ in outliers.keys()))
+
+
+    @cached_feature('outliers', cache_empty=True)
+    def get_outlier_measurements(self, nodeId: str = None, measurementId: str = None):
+        '''Returns the (nodeId, measurementId) pairs outlier detection left out'''
+
+        return self.get_processed_measurements('outlier_measurement', field='x_average', nodeId=nodeId, measurementId=measurementId)
+
+
+    def write_rms_features(self, rms_features: defaultdict(lambda: defaultdict(lambda: {})), times: Dict[Tuple[str, str], float] = None):
+        records = []
+        timestamp = self._feature_timestamps(times=times)
 
         for nId, measurements in rms_features.items():
             for mId, rms in measurements.items():
+                records.append(encode_lines('rms_feature',
+                                            tags={'nodeId': nId, 'measurementId': mId},
+                                            fields={'x_rms_value': [rms['x']], 'y_rms_value': [rms['y']], 'z_rms_value': [rms['z']]},
+                                            timestamp=timestamp(nId, mId)))
 
-                new_point = Point('rms_feature')\
-                                .tag('nodeId', nId)\
-                                    .tag('measurementId', mId)\
-                                        .field('x_rms_value', rms['x'])\
-                                            .field('y_rms_value', rms['y'])\
-                                                .field('z_rms_value', rms['z'])\
-                                                    .time(time=datetime.utcnow())
-                                            
-                points.append(new_point)
-                    
-        self.write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=points)
+        self._write_features(records=records, features=rms_features)
 
 
+    @cached_feature('rms')
     def get_rms_features(self, nodeId: str = None, measurementId: str = None):
         filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
         filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
 
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: {-1 * PROCESSED_DATA_EXPIRATION_TIME}m)\
+        |> range(start: 0)\
         |> filter(fn:(r) => r._measurement == "rms_feature")\
         {filter_by_node if nodeId is not None else ""}\
         {filter_by_measurement if measurementId is not None else ""}\
@@ -178,106 +555,138 @@ class InfluxDB:
         return results
     
 
-    def write_psd_features(self, psd_features: defaultdict(lambda: defaultdict(lambda: []))):
-        points = []
+    def _encode_spectrum_row(self, measurement: str, tags: Dict[str, str], blobs: Dict[str, str], timestamp: int) -> str:
+        '''One row per measurement, base64 blobs are split into numbered string fields small enough for influx'''
+
+        fields = {}
+        for name, text in blobs.items():
+            for k, start in enumerate(range(0, max(len(text), 1), SPECTRUM_FIELD_SIZE)):
+                fields[f'{name}_{k}'] = text[start:start + SPECTRUM_FIELD_SIZE]
 
-        for nId, measurements in psd_features.items():
-            for mId, psd in measurements.items():
-                for i, feature in enumerate(psd):
-                    points.append(Point('psd_feature')\
-                                    .tag('nodeId', nId)\
-                                        .tag('measurementId', mId)\
-                                            .tag('index', i)\
-                                                .field('psd_value', feature['psd_value'])\
-                                                    .field('frequency', feature['frequency'])\
-                                                        .time(time=datetime.utcnow()))
-                    
-        self.write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=points)
+        return encode_row(measurement, tags=tags, fields=fields, timestamp=timestamp)
 
 
-    def get_psd_features(self, nodeId: str = None, measurementId: str = None):
+    def _get_spectrum_rows(self, measurement: str, spectrum: str, nodeId: str = None, measurementId: str = None, tags: List[str] = None):
+        '''Returns the blobs and requested tags of the latest row of every measurement with their numbered fields joined'''
+
         filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
         filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
+        tags = tags if tags is not None else []
 
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: {-1 * PROCESSED_DATA_EXPIRATION_TIME}m)\
-        |> filter(fn:(r) => r._measurement == "psd_feature")\
+        |> range(start: 0)\
+        |> filter(fn:(r) => r._measurement == "{measurement}" and r.spectrum == "{spectrum}")\
         {filter_by_node if nodeId is not None else ""}\
         {filter_by_measurement if measurementId is not None else ""}\
-        |> keep(columns: ["_time", "_field", "_value", "nodeId", "measurementId", "frequency", "index"])\
-        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
-        |> yield()'
+        |> group()\
+        |> keep(columns: {json.dumps(["_time", "_field", "_value", "nodeId", "measurementId"] + tags)})'
 
-        query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
-        query_result = json.loads(query_result.to_json(orient='records'))
+        columns = self._query_columns(query=query, dtypes={'_time': 'str', '_field': 'str', '_value': 'str', 'nodeId': 'str', 'measurementId': 'str', **{tag: 'str' for tag in tags}})
+        times = pd.to_datetime(columns['_time'], utc=True).asi8
 
-        results = defaultdict(lambda: defaultdict(lambda: []))
-        for r in query_result:
-            results[r['nodeId']][r['measurementId']].append({
-                'psd_value': r['psd_value'],
-                'frequency': r['frequency']
-            })
+        # A measurement written more than once keeps only the fields of its latest row
+        latest = {}
+        for row, (t, field, value, nId, mId) in enumerate(zip(times.tolist(), columns['_field'].tolist(), columns['_value'].tolist(), columns['nodeId'].tolist(), columns['measurementId'].tolist())):
+            if (nId, mId) not in latest or t > latest[(nId, mId)][0]:
+                latest[(nId, mId)] = (t, {}, {tag: columns[tag][row] for tag in tags})
+
+            if t == latest[(nId, mId)][0]:
+                name, k = field.rsplit('_', 1)
+                latest[(nId, mId)][1][(name, int(k))] = value if isinstance(value, str) else ''
+
+        results = defaultdict(lambda: defaultdict(lambda: {}))
+        for (nId, mId), (_, chunks, tag_values) in latest.items():
+            blobs = defaultdict(lambda: '')
+            for name, k in sorted(chunks.keys()):
+                blobs[name] += chunks[(name, k)]
+
+            results[nId][mId] = {**tag_values, **blobs}
 
         return results
-    
-    
-    def write_harmonic_peaks(self, harmonic_peaks: defaultdict(lambda: defaultdict(lambda: []))):
-        points = []
 
-        for nId, measurements in harmonic_peaks.items():
-            for mId, peaks in measurements.items():
-                for i, feature in enumerate(peaks):
-                    points.append(Point('harmonic_peaks')\
-                                    .tag('nodeId', nId)\
-                                        .tag('measurementId', mId)\
-                                            .tag('index', i)\
-                                                .field('peak_value', feature['peak_value'])\
-                                                    .field('frequency', feature['frequency'])\
-                                                        .time(time=datetime.utcnow()))
 
-        self.write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=points)
+    def write_psd_features(self, psd_features: defaultdict(lambda: defaultdict(lambda: {})), times: Dict[Tuple[str, str], float] = None):
+        '''Writes compact PSD features, one row per measurement'''
 
+        timestamp = self._feature_timestamps(times=times)
 
-    def get_harmonic_peaks(self, nodeId: str = None, measurementId: str = None):
-        filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
-        filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
+        records = [self._encode_spectrum_row('psd_spectrum',
+                                             tags={'nodeId': nId, 'measurementId': mId, 'spectrum': psd['spectrum'], 'number_of_samples': psd['number_of_samples']},
+                                             blobs={'psd': psd['psd']},
+                                             timestamp=timestamp(nId, mId))
+                   for nId, measurements in psd_features.items() for mId, psd in measurements.items()]
 
-        query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: {-1 * PROCESSED_DATA_EXPIRATION_TIME}m)\
-        |> filter(fn:(r) => r._measurement == "harmonic_peaks")\
-        {filter_by_node if nodeId is not None else ""}\
-        {filter_by_measurement if measurementId is not None else ""}\
-        |> keep(columns: ["_time", "_field", "_value", "nodeId", "measurementId", "frequency", "index"])\
-        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
-        |> yield()'
+        self._write_features(records=records, features=psd_features)
 
-        query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
-        query_result = json.loads(query_result.to_json(orient='records'))
 
-        results = defaultdict(lambda: defaultdict(lambda: []))
-        for r in query_result:
-            results[r['nodeId']][r['measurementId']].append({
-                'peak_value': r['peak_value'],
-                'frequency': r['frequency']
-            })
+    @cached_feature('psd')
+    def get_psd_features(self, nodeId: str = None, measurementId: str = None, spectrum: str = 'dct'):
+        '''Returns compact PSD features of the given spectrum key, see analytics.spectrum.compact_psd'''
+
+        results = self._get_spectrum_rows('psd_spectrum', spectrum=spectrum, nodeId=nodeId, measurementId=measurementId, tags=['number_of_samples'])
+
+        for measurements in results.values():
+            for mId, row in measurements.items():
+                measurements[mId] = {'spectrum': spectrum, 'sampling_rate': SAMPLING_RATE, 'number_of_samples': int(row['number_of_samples']), 'psd': row['psd']}
 
         return results
     
     
-    def write_harmonic_peak_ditance_from_healthy_zone(self, distances):
-        ...
+    def write_harmonic_peaks(self, harmonic_peaks: defaultdict(lambda: defaultdict(lambda: {})), spectrum: str = 'dct', times: Dict[Tuple[str, str], float] = None):
+        '''Writes compact harmonic peaks found on the given spectrum, one row per measurement'''
+
+        timestamp = self._feature_timestamps(times=times)
+
+        records = [self._encode_spectrum_row('harmonic_peak_spectrum',
+                                             tags={'nodeId': nId, 'measurementId': mId, 'spectrum': spectrum},
+                                             blobs={'frequency': peaks['frequency'], 'peak_value': peaks['peak_value']},
+                                             timestamp=timestamp(nId, mId))
+                   for nId, measurements in harmonic_peaks.items() for mId, peaks in measurements.items()]
+
+        self._write_features(records=records, features=harmonic_peaks)
+
+
+    @cached_feature('harmonic_peaks')
+    def get_harmonic_peaks(self, nodeId: str = None, measurementId: str = None, spectrum: str = 'dct'):
+        '''Returns compact harmonic peaks found on the given spectrum, see analytics.spectrum.compact_peaks'''
+
+        return self._get_spectrum_rows('harmonic_peak_spectrum', spectrum=spectrum, nodeId=nodeId, measurementId=measurementId)
+    
+    
+    def write_harmonic_peak_ditance_from_healthy_zone(self, distances: defaultdict(lambda: defaultdict(lambda: [])), times: Dict[Tuple[str, str], float] = None):
+        '''Writes the distances of every measurement to the healthy references, one row per reference'''
+
+        timestamp = self._feature_timestamps(times=times)
+
+        records = [encode_lines('harmonic_peak_distance',
+                                tags={'nodeId': nId, 'measurementId': mId},
+                                fields={'distance': measurement_distances},
+                                timestamp=timestamp(nId, mId),
+                                index_tag='index')
+                   for nId, measurements in distances.items() for mId, measurement_distances in measurements.items()]
+
+        self._write_features(records=records, features=distances)
         
         
-    def write_rul_values(self, rul_values):
-        ...
+    def write_rul_values(self, rul_values: Dict[str, Dict[str, float]]):
+        '''Writes {nodeId: {'rul_in_days', 'time'}}, each at the time of the latest measurement its model was fitted on'''
+
+        records = [encode_lines('rul_values',
+                                tags={'nodeId': nId},
+                                fields={'rul_in_days': [rul['rul_in_days']]},
+                                timestamp=to_timestamp(rul['time']))
+                   for nId, rul in rul_values.items()]
+
+        self._write_features(records=records, features=rul_values)
     
     
+    @cached_feature('harmonic_peak_distance')
     def get_harmonic_peak_distance_from_healthy_zone(self, nodeId: str = None, measurementId: str = None):
         filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
         filter_by_measurement = f'|> filter(fn:(r) => r.measurementId == "{measurementId}")'
         
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: {-1 * PROCESSED_DATA_EXPIRATION_TIME}m)\
+        |> range(start: 0)\
         |> filter(fn:(r) => r._measurement == "harmonic_peak_distance")\
         {filter_by_node if nodeId is not None else ""}\
         {filter_by_measurement if measurementId is not None else ""}\
@@ -288,28 +697,37 @@ class InfluxDB:
         query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
         query_result = json.loads(query_result.to_json(orient='records'))
         
-        results = defaultdict(lambda: defaultdict(lambda: []))
+        indexed_distances = defaultdict(lambda: defaultdict(lambda: []))
         for r in query_result:
-            results[r['nodeId']][r['measurementId']].append(r['distance'])
+            indexed_distances[r['nodeId']][r['measurementId']].append((int(r['index']), r['distance']))
+
+        # Series come back ordered by the index tag as a string, distances follow the order of the references
+        results = defaultdict(lambda: defaultdict(lambda: []))
+        for nId, measurements in indexed_distances.items():
+            for mId, distances in measurements.items():
+                results[nId][mId] = [distance for _, distance in sorted(distances)]
         
         return results
     
     
+    @cached_feature('rul')
     def get_rul_values(self, nodeId = None):
+        '''Returns the latest RUL of every node with the time of the measurement it was computed at'''
+
         filter_by_node = f'|> filter(fn:(r) => r.nodeId == "{nodeId}")'
         
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
-        |> range(start: {-1 * PROCESSED_DATA_EXPIRATION_TIME}m)\
-        |> filter(fn:(r) => r._measurement == "rul_values")\
+        |> range(start: 0)\
+        |> filter(fn:(r) => r._measurement == "rul_values" and r._field == "rul_in_days")\
         {filter_by_node if nodeId is not None else ""}\
-        |> keep(columns: ["_time", "_field", "_value", "nodeId", "measurementId", "index", "rul_in_days"])\
-        |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
-        |> yield()'
+        |> last()\
+        |> group()\
+        |> keep(columns: ["_time", "_value", "nodeId"])'
         
-        query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
-        query_result = json.loads(query_result.to_json(orient='records'))
+        columns = self._query_columns(query=query, dtypes={'_time': 'str', '_value': 'float64', 'nodeId': 'str'})
+        times = pd.to_datetime(columns['_time'], utc=True).asi8 // 1_000_000_000
         
-        results = [{'node_id': r['nodeId'], 'rul_in_days': r['rul_in_days']} for r in query_result]
+        results = [{'node_id': nId, 'rul_in_days': rul, 'time': t} for nId, rul, t in zip(columns['nodeId'].tolist(), columns['_value'].tolist(), times.tolist())]
         
         return results
     
@@ -317,6 +735,7 @@ class InfluxDB:
     def get_labeled_harmonic_peaks(self):
 
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
+        |> range(start: 0)\
         |> filter(fn:(r) => r._measurement == "labeled_harmonic_peaks")\
         |> keep(columns: ["_time", "_field", "_value", "measurementId", "frequency", "index", "zone"])\
         |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
@@ -344,24 +763,87 @@ class InfluxDB:
         return results
     
     
+    def get_labeled_data_signature(self):
+        '''
+        Sorted (measurementId, zone, number of peaks, sum of peak values, latest time) of every labeled measurement,
+        labeled data is reloaded when it changes
+        '''
+
+        query = f'from(bucket:"{INFLUXDB_BUCKET}")\
+        |> range(start: 0)\
+        |> filter(fn:(r) => r._measurement == "labeled_harmonic_peaks" and r._field == "peak_value")\
+        |> group(columns: ["measurementId", "zone"])\
+        |> reduce(identity: {{count: 0, total: 0.0, latest: time(v: 0)}},\
+                  fn: (r, accumulator) => ({{count: accumulator.count + 1,\
+                                             total: accumulator.total + float(v: r._value),\
+                                             latest: if r._time > accumulator.latest then r._time else accumulator.latest}}))\
+        |> group()\
+        |> keep(columns: ["measurementId", "zone", "count", "total", "latest"])'
+
+        columns = self._query_columns(query=query, dtypes={'measurementId': 'str', 'zone': 'str', 'count': 'int64', 'total': 'float64', 'latest': 'str'})
+
+        return sorted(zip(columns['measurementId'].tolist(),
+                          columns['zone'].tolist(),
+                          columns['count'].tolist(),
+                          columns['total'].tolist(),
+                          columns['latest'].tolist()))
+    
+    
+    def get_healthy_baseline_signature(self):
+        '''Signature of the labeled data the stored distances were measured against, None before any was stored'''
+
+        query = f'from(bucket:"{INFLUXDB_BUCKET}")\
+        |> range(start: 0)\
+        |> filter(fn:(r) => r._measurement == "healthy_baseline" and r._field == "signature")\
+        |> last()\
+        |> keep(columns: ["_value"])'
+
+        columns = self._query_columns(query=query, dtypes={'_value': 'str'})
+
+        return columns['_value'][0] if columns['_value'].shape[0] else None
+    
+    
+    def write_healthy_baseline_signature(self, signature: str):
+        self._write_records(records=[encode_row('healthy_baseline', tags={}, fields={'signature': signature}, timestamp=to_timestamp(time.time()))])
+    
+    
+    def clear_healthy_zone_data(self):
+        '''Deletes the distances and RUL values measured against the healthy zone references'''
+
+        delete_api = self.client.delete_api()
+
+        for measurement in ['harmonic_peak_distance', 'rul_values']:
+            delete_api.delete(start='1970-01-01T00:00:00Z', stop=datetime.now(), predicate=f'_measurement="{measurement}"', bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG)
+
+        feature_cache.invalidate()
+    
+    
     def get_starting_service_date(self):
         
         query = f'from(bucket:"{INFLUXDB_BUCKET}")\
         |> range(start: 0)\
-        |> filter(fn:(r) => r._measurement == "vibration_measurement")\
-        |> first()'
+        |> filter(fn:(r) => r._measurement == "measurement_catalog" and r._field == "sample_count")\
+        |> group()\
+        |> sort(columns: ["_time"])\
+        |> limit(n: 1)\
+        |> keep(columns: ["_time"])'
         
-        query_result = self.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
-        query_result = json.loads(query_result.to_json(orient='records'))
+        columns = self._query_columns(query=query, dtypes={'_time': 'str'})
         
         try:
-            return query_result[0]['_time'] // 1000
-        except:
+            return int(pd.Timestamp(columns['_time'][0]).timestamp())
+        except IndexError:
             return None
     
     
+    def close(self):
+        self.background_writer.close()
+        self.client.close()
+
+
     def clear_cached_data(self):
         delete_api = self.client.delete_api()
+        feature_cache.invalidate()
         
         for measurement in InfluxDB.ALL_MEASUREMENTS:
             if measurement not in InfluxDB.MAIN_MEASUREMENT:
@@ -371,6 +853,7 @@ class InfluxDB:
     
     def clear_vibration_data(self):
         delete_api = self.client.delete_api()
+        feature_cache.invalidate()
         
         for measurement in InfluxDB.ALL_MEASUREMENTS:
             delete_api.delete(start='1970-01-01T00:00:00Z', stop=datetime.now(), predicate=f'_measurement="{measurement}"', bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG)
\ No newline at end of file
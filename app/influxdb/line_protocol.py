@@ -0,0 +1,104 @@
+import numpy as np
+
+from typing import Dict
+
+from influxdb_client import WritePrecision
+
+
+# Every timestamp produced by the encoder is in microseconds, it is exact in float64 and fine enough for sample offsets
+WRITE_PRECISION = WritePrecision.US
+
+
+def to_timestamp(seconds: float) -> int:
+    '''Converts unix seconds to the integer timestamp used by the encoder'''
+
+    return int(round(seconds * 1_000_000))
+
+
+def _check_line_breaks(value: str) -> str:
+    # Line breaks end a record and cannot be escaped in keys and tag values, they would start a new record
+    value = str(value)
+    if '\n' in value or '\r' in value:
+        raise ValueError(f'{value!r} contains a line break')
+
+    return value
+
+
+def _escape_key(value: str) -> str:
+    return _check_line_breaks(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def _escape_measurement(value: str) -> str:
+    return _check_line_breaks(value).replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+
+
+def encode_lines(measurement: str,
+                 tags: Dict[str, str],
+                 fields: Dict[str, np.ndarray],
+                 timestamp: int = None,
+                 timestamps: np.ndarray = None,
+                 index_tag: str = None) -> str:
+    '''
+    Encodes the rows of a whole measurement into line protocol in one formatting call.
+
+    Tags shared by all rows and the timestamp are formatted once, fields are float columns of the same length.
+    The rows are told apart by `index_tag` holding the row number, or by per row `timestamps`.
+    '''
+
+    names = list(fields.keys())
+    columns = [np.asarray(fields[name], dtype=np.float64).ravel() for name in names]
+    number_of_rows = columns[0].shape[0]
+
+    if number_of_rows == 0:
+        return ''
+
+    values = np.column_stack(columns)
+    if not np.isfinite(values).all():
+        raise ValueError(f'Fields of {measurement} contain non-finite values')
+
+    prefix = _escape_measurement(measurement)
+    for key in sorted(tags.keys()):
+        prefix += f',{_escape_key(key)}={_escape_key(tags[key])}'
+
+    # The line is used as a format template, literal percent signs must be doubled
+    prefix = prefix.replace('%', '%%')
+    leading, trailing = [], []
+
+    if index_tag is not None:
+        prefix += ',' + _escape_key(index_tag).replace('%', '%%') + '=%d'
+        leading.append(np.arange(number_of_rows, dtype=np.float64))
+
+    line = prefix + ' ' + ','.join(_escape_key(name).replace('%', '%%') + '=%r' for name in names)
+
+    if timestamps is not None:
+        line += ' %d'
+        trailing.append(np.asarray(timestamps, dtype=np.float64))
+    elif timestamp is not None:
+        line += f' {int(timestamp)}'
+
+    values = np.column_stack(leading + [values] + trailing)
+
+    # A single % over the repeated template formats every row in C instead of building objects per row
+    return ((line + '\n') * number_of_rows % tuple(values.ravel().tolist()))[:-1]
+
+
+def _escape_string(value: str) -> str:
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def encode_row(measurement: str, tags: Dict[str, str], fields: Dict[str, str], timestamp: int = None) -> str:
+    '''Encodes a single row of string fields, used for blobs that do not fit the float columns of encode_lines'''
+
+    if not fields:
+        return ''
+
+    line = _escape_measurement(measurement)
+    for key in sorted(tags.keys()):
+        line += f',{_escape_key(key)}={_escape_key(tags[key])}'
+
+    line += ' ' + ','.join(f'{_escape_key(name)}={_escape_string(value)}' for name, value in fields.items())
+
+    if timestamp is not None:
+        line += f' {int(timestamp)}'
+
+    return line
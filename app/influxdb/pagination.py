@@ -0,0 +1,54 @@
+import json
+import base64
+
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from ..utils.constants import SAMPLING_RATE
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(time: float, measurementId: str, nodeId: str) -> str:
+    '''Continuation token pointing after the last measurement of a page'''
+
+    payload = json.dumps({'time': time, 'measurementId': measurementId, 'nodeId': nodeId}, separators=(',', ':'))
+
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+        return float(payload['time']), str(payload['measurementId']), str(payload['nodeId'])
+    except Exception:
+        raise InvalidCursorError('Invalid cursor')
+
+
+def flux_time(seconds: float) -> str:
+    '''Formats unix seconds as a flux time literal'''
+
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def flux_range(start: float = None, stop: float = None) -> str:
+    '''Builds the range stage from unix seconds, the whole bucket is read when no bound is given'''
+
+    if start is None and stop is None:
+        return 'range(start: 0)'
+
+    start = flux_time(start) if start is not None else '0'
+
+    if stop is None:
+        return f'range(start: {start})'
+
+    return f'range(start: {start}, stop: {flux_time(stop)})'
+
+
+def samples_range(measurements: List[Dict]) -> Tuple[float, float]:
+    '''Time range holding the samples of the given catalog measurements, catalog times are floored to the second'''
+
+    return min(m['time'] for m in measurements), max(m['time'] + 1 + m['sample_count'] / SAMPLING_RATE for m in measurements)
\ No newline at end of file
@@ -0,0 +1,243 @@
+import time
+import random
+import logging
+import threading
+
+from queue import Queue, Empty
+from typing import Callable, List
+
+from influxdb_client import WritePrecision
+
+from ..utils.constants import WRITE_QUEUE_MAX_POINTS, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, WRITE_MAX_RETRIES, WRITE_RETRY_INTERVAL, WRITE_MAX_RETRY_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueueFullError(Exception):
+    pass
+
+
+class BackgroundWriter:
+    '''
+    Buffers records in a bounded queue and writes them to influx in large batches from a worker thread.
+    Accepted records are kept and retried while influx is unavailable, the full queue then rejects new requests instead.
+    Only records influx refuses, or that still fail when the writer is closed, are dropped and reported by status.
+    '''
+
+    _STOP = object()
+
+    def __init__(self,
+                 write_api,
+                 bucket: str,
+                 org: str,
+                 write_precision: str = WritePrecision.NS,
+                 max_queue_points: int = WRITE_QUEUE_MAX_POINTS,
+                 batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval: float = WRITE_FLUSH_INTERVAL,
+                 max_retries: int = WRITE_MAX_RETRIES,
+                 retry_interval: float = WRITE_RETRY_INTERVAL,
+                 max_retry_interval: float = WRITE_MAX_RETRY_INTERVAL):
+
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.write_precision = write_precision
+
+        self.max_queue_points = max_queue_points
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+
+        self._pending_points = 0
+        self._written_points = 0
+        self._written_batches = 0
+        self._failed_batches = 0
+        self._dropped_points = 0
+        self._retries = 0
+        self._retrying = False
+        self._last_error = None
+        self._last_error_time = None
+        self._rejected_requests = 0
+        self._last_batch_size = 0
+        self._last_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='influx-background-writer', daemon=True)
+            self._thread.start()
+
+
+    def enqueue(self, records: List, number_of_points: int, on_written: Callable[[], None] = None):
+        '''
+        Queues the records for writing, raises WriteQueueFullError if the queue can not take them.
+        on_written is called from the worker thread once the batch holding the records is written.
+        '''
+
+        with self._lock:
+            if self._pending_points + number_of_points > self.max_queue_points:
+                self._rejected_requests += 1
+                raise WriteQueueFullError('Influx write queue is full')
+
+            self._pending_points += number_of_points
+            self._start()
+
+        self._queue.put((records, number_of_points, on_written))
+
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is BackgroundWriter._STOP:
+                return
+
+            batch, batch_points = list(item[0]), item[1]
+            callbacks = [item[2]]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+
+            # Collecting records until the batch is large enough or the flush interval is over
+            while batch_points < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except Empty:
+                    break
+
+                if item is BackgroundWriter._STOP:
+                    stop = True
+                    break
+
+                batch.extend(item[0])
+                batch_points += item[1]
+                callbacks.append(item[2])
+
+            if self._flush(batch=batch, batch_points=batch_points):
+                self._notify(callbacks=callbacks)
+
+            if stop:
+                return
+
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        '''Unavailability and throttling pass, influx refusing the records themselves does not change by writing them again'''
+
+        status = getattr(error, 'status', None)
+
+        return not isinstance(status, int) or status == 429 or status >= 500
+
+
+    def _failed(self, error: Exception, retrying: bool):
+        with self._lock:
+            self._retrying = retrying
+            self._last_error = str(error)
+            self._last_error_time = time.time()
+
+            if retrying:
+                self._retries += 1
+
+
+    def _flush(self, batch: List, batch_points: int):
+        started_at = time.monotonic()
+        written = False
+        attempt = 0
+
+        while True:
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=batch, write_precision=self.write_precision)
+                written = True
+                break
+            except Exception as e:
+                if not self._retryable(e) or (self._closing and attempt >= self.max_retries):
+                    logger.error(f'Dropping {batch_points} points after {attempt + 1} failed writes: {e}')
+                    self._failed(e, retrying=False)
+                    break
+
+                if attempt == self.max_retries:
+                    logger.warning(f'Writing {batch_points} points failed {attempt + 1} times, retrying until influx is available: {e}')
+
+                self._failed(e, retrying=True)
+
+                # Exponential backoff with jitter so several workers do not retry in lockstep
+                time.sleep(min(self.retry_interval * (2 ** min(attempt, 16)), self.max_retry_interval) * random.uniform(0.5, 1.5))
+                attempt += 1
+
+        latency = time.monotonic() - started_at
+
+        with self._lock:
+            self._pending_points -= batch_points
+            self._last_batch_size = batch_points
+            self._last_flush_latency = latency
+            self._total_flush_latency += latency
+
+            self._retrying = False
+
+            if written:
+                self._written_points += batch_points
+                self._written_batches += 1
+            else:
+                self._failed_batches += 1
+                self._dropped_points += batch_points
+
+        return written
+
+
+    def _notify(self, callbacks: List):
+        for callback in callbacks:
+            if callback is None:
+                continue
+
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f'Write callback failed: {e}')
+
+
+    def close(self, timeout: float = None):
+        '''Flushes the queued records and stops the worker, writes failing by now are retried max_retries times'''
+
+        self._closing = True
+
+        if self._thread is None:
+            return
+
+        self._queue.put(BackgroundWriter._STOP)
+        self._thread.join(timeout=timeout)
+
+
+    def status(self):
+        with self._lock:
+            flushed_batches = self._written_batches + self._failed_batches
+
+            return {
+                'queue_depth': self._queue.qsize(),
+                'pending_points': self._pending_points,
+                'max_queue_points': self.max_queue_points,
+                'batch_size': self.batch_size,
+                'last_batch_size': self._last_batch_size,
+                'written_points': self._written_points,
+                'written_batches': self._written_batches,
+                # Accepted records that were never written, and the state of the batch being retried
+                'failed_batches': self._failed_batches,
+                'dropped_points': self._dropped_points,
+                'retrying': self._retrying,
+                'retries': self._retries,
+                'last_error': self._last_error,
+                'last_error_time': self._last_error_time,
+                'rejected_requests': self._rejected_requests,
+                'last_flush_latency': self._last_flush_latency,
+                'average_flush_latency': self._total_flush_latency / flushed_batches if flushed_batches else 0.0
+            }
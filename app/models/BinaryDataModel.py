@@ -0,0 +1,146 @@
+import struct
+import numpy as np
+
+from typing import List
+
+
+class BinaryFrameError(ValueError):
+    pass
+
+
+class InvalidMeasurementError(ValueError):
+    pass
+
+
+class MeasurementArrays:
+    '''Samples of a single measurement kept as x, y, z float arrays'''
+
+    __slots__ = ('node_id', 'measurement_id', 'time', 'x', 'y', 'z')
+
+    def __init__(self, node_id: str, measurement_id: str, time: float, x: np.ndarray, y: np.ndarray, z: np.ndarray):
+        self.node_id = node_id
+        self.measurement_id = measurement_id
+        self.time = time
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+    @property
+    def number_of_samples(self):
+        return self.x.shape[0]
+
+
+def check_measurement(measurement: MeasurementArrays):
+    '''Rejects measurements that cannot be stored, ids become line protocol tags and samples float fields'''
+
+    for name, value in (('Node', measurement.node_id), ('Measurement', measurement.measurement_id)):
+        if not value:
+            raise InvalidMeasurementError(f'{name} id must not be empty')
+
+        if '\n' in value or '\r' in value:
+            raise InvalidMeasurementError(f'{name} id {value!r} must not contain line breaks')
+
+    if not np.isfinite(measurement.time):
+        raise InvalidMeasurementError(f'Measurement {measurement.measurement_id} has an invalid time')
+
+    # A catalog entry without samples would be listed and fetched as missing features on every request
+    if measurement.number_of_samples == 0:
+        raise InvalidMeasurementError(f'Measurement {measurement.measurement_id} has no samples')
+
+    for axis in (measurement.x, measurement.y, measurement.z):
+        if not np.isfinite(axis).all():
+            raise InvalidMeasurementError(f'Measurement {measurement.measurement_id} contains non-finite samples')
+
+
+# Compact gateway frame, every number is little-endian:
+#
+#   header: magic b'PDMV' | version u8 | 3 reserved bytes | number of measurements u32
+#   record: node id length u16 | measurement id length u16 | time f64 | number of samples u32
+#           node id (utf-8) | measurement id (utf-8) | x f32[n] | y f32[n] | z f32[n]
+FRAME_MAGIC = b'PDMV'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<4sB3xI')
+RECORD_HEADER = struct.Struct('<HHdI')
+SAMPLE_DTYPE = np.dtype('<f4')
+
+
+def decode_vibration_frame(body: bytes) -> List[MeasurementArrays]:
+    '''Decodes a binary frame into per measurement arrays without creating per sample objects'''
+
+    if len(body) < FRAME_HEADER.size:
+        raise BinaryFrameError('Frame is shorter than its header')
+
+    magic, version, number_of_measurements = FRAME_HEADER.unpack_from(body, 0)
+    if magic != FRAME_MAGIC:
+        raise BinaryFrameError('Invalid frame magic')
+
+    if version != FRAME_VERSION:
+        raise BinaryFrameError(f'Unsupported frame version {version}')
+
+    offset = FRAME_HEADER.size
+    measurements = []
+
+    for _ in range(number_of_measurements):
+        if offset + RECORD_HEADER.size > len(body):
+            raise BinaryFrameError('Truncated measurement header')
+
+        node_id_length, measurement_id_length, time, number_of_samples = RECORD_HEADER.unpack_from(body, offset)
+        offset += RECORD_HEADER.size
+
+        samples_size = 3 * number_of_samples * SAMPLE_DTYPE.itemsize
+        if offset + node_id_length + measurement_id_length + samples_size > len(body):
+            raise BinaryFrameError('Truncated measurement record')
+
+        try:
+            node_id = body[offset:offset + node_id_length].decode('utf-8')
+            offset += node_id_length
+            measurement_id = body[offset:offset + measurement_id_length].decode('utf-8')
+            offset += measurement_id_length
+        except UnicodeDecodeError:
+            raise BinaryFrameError('Node and measurement ids must be utf-8 encoded')
+
+        if not node_id or not measurement_id:
+            raise BinaryFrameError('Node and measurement ids must not be empty')
+
+        if any(character in node_id + measurement_id for character in '\r\n'):
+            raise BinaryFrameError('Node and measurement ids must not contain line breaks')
+
+        if not np.isfinite(time) or number_of_samples == 0:
+            raise BinaryFrameError(f'Measurement {measurement_id} has an invalid time or no samples')
+
+        # Samples are referenced in place, the request body is not copied
+        samples = np.frombuffer(body, dtype=SAMPLE_DTYPE, count=3 * number_of_samples, offset=offset).reshape(3, number_of_samples)
+        offset += samples_size
+
+        if not np.isfinite(samples).all():
+            raise BinaryFrameError(f'Measurement {measurement_id} contains non-finite samples')
+
+        measurements.append(MeasurementArrays(node_id=node_id,
+                                              measurement_id=measurement_id,
+                                              time=time,
+                                              x=samples[0],
+                                              y=samples[1],
+                                              z=samples[2]))
+
+    if offset != len(body):
+        raise BinaryFrameError('Unexpected trailing bytes after the last measurement')
+
+    return measurements
+
+
+def encode_vibration_frame(measurements: List[MeasurementArrays]) -> bytes:
+    '''Builds a binary frame, used by gateways and scripts sending data to the server'''
+
+    parts = [FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, len(measurements))]
+
+    for measurement in measurements:
+        node_id = measurement.node_id.encode('utf-8')
+        measurement_id = measurement.measurement_id.encode('utf-8')
+
+        parts.append(RECORD_HEADER.pack(len(node_id), len(measurement_id), measurement.time, measurement.number_of_samples))
+        parts.append(node_id)
+        parts.append(measurement_id)
+        parts.append(np.asarray([measurement.x, measurement.y, measurement.z], dtype=SAMPLE_DTYPE).tobytes())
+
+    return b''.join(parts)
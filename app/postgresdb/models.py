@@ -1,4 +1,4 @@
-from sqlalchemy import String, Integer, Column, Boolean, DateTime
+from sqlalchemy import String, Integer, Column, Boolean, DateTime, Float, JSON
 from sqlalchemy.sql import func
 
 from .postgres import Base
@@ -62,3 +62,19 @@ class MachineClass(Base):
 
     def __repr__(self):
         return f'<Machine Class {self.string}: {self.description}>'
+
+
+class RulModel(Base):
+    __tablename__ = 'rulModels'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    node_id = Column(String(255), nullable=False, unique=True)
+    version = Column(Integer, nullable=False, default=0)
+    coefficients = Column(JSON, nullable=False)
+    # Time of the latest measurement and number of distance points the model was fitted on
+    watermark = Column(Float, nullable=False)
+    number_of_points = Column(Integer, nullable=False)
+    fitted_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+    def __repr__(self):
+        return f'<RUL Model node={self.node_id} version={self.version}>'
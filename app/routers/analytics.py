@@ -1,11 +1,28 @@
-from fastapi import APIRouter, status, Depends
+import asyncio
+
+from collections import defaultdict
+from typing import Dict, Tuple
+
+from fastapi import APIRouter, status, Depends, HTTPException, Request, Query
 from fastapi.responses import JSONResponse
 
-from ..influxdb.influx import InfluxDB
+from ..influxdb.async_influx import AsyncInfluxDB
+from ..influxdb.feature_cache import feature_cache
+from ..influxdb.pagination import samples_range
 from ..analytics.rul import RemainingUsefulLifetimeModel
-from ..analytics.transformer import Transformer
 from ..analytics.preprocesser import Preprocesser
+from ..analytics.outliers import outlier_filter
+from ..analytics.incremental import IncrementalFeatureExtractor
+from ..analytics.parallel import shutdown_pool
+from ..analytics.scheduler import precompute_scheduler
+from ..analytics.rul_store import RulModelStore
+from ..analytics.baseline import HealthyBaseline
+from ..analytics.spectrum import SpectrumParameters, expand_features, expand_psd, expand_peaks
 from ..auth.deps import get_current_admin
+from ..utils.ndjson import wants_ndjson, ndjson_response, nested_rows
+from ..utils.singleflight import SingleFlight
+from ..utils.env_vars import PRECOMPUTE_ENABLED
+from ..utils.constants import WELCH_SEGMENT_LENGTH, PSD_NUMBER_OF_BINS
 
 router = APIRouter(
     prefix='/analytics',
@@ -15,140 +32,432 @@ router = APIRouter(
     }
 )
 
-influx = InfluxDB()
+influx = AsyncInfluxDB()
+rul_models = RulModelStore(influx=influx.influx)
+healthy_baseline = HealthyBaseline(influx=influx.influx, rul_models=rul_models)
+single_flight = SingleFlight()
 
-@router.get('/rms')
-async def get_rms_features(nodeId: str = None, measurementId: str = None, admin = Depends(get_current_admin)):
-    
-    rms_features = influx.get_rms_features(nodeId=nodeId, measurementId=measurementId)
-    if rms_features:
-        return JSONResponse(content=rms_features, status_code=status.HTTP_200_OK)
-    
-    vibration_data = influx.get_vibration_data(nodeId=nodeId, measurementId=measurementId)
-    nodes_ids = influx.get_all_nodes_id()
-    measurements_ids = influx.get_all_measurements_id()
 
-    transformer = Transformer(vibration_data=vibration_data)
-    matrices = transformer.get_matrices()
+@router.on_event('startup')
+async def start_precompute_scheduler():
+    if PRECOMPUTE_ENABLED:
+        precompute_scheduler.start(influx=influx, rul_models=rul_models, baseline=healthy_baseline)
+
+
+@router.on_event('shutdown')
+async def stop_precompute_scheduler():
+    await precompute_scheduler.stop()
+
+
+@router.on_event('shutdown')
+async def close_influx():
+    await influx.close()
+
+
+@router.on_event('shutdown')
+def close_feature_extraction_pool():
+    shutdown_pool()
+
+
+def _feature_response(request: Request, features, key: str):
+    '''
+    NDJSON writes one line per measurement instead of encoding the whole result into a single body,
+    the features themselves are read or computed before the response starts.
+    '''
+
+    if wants_ndjson(request):
+        return ndjson_response(nested_rows(features, key=key))
+
+    return JSONResponse(content=features, status_code=status.HTTP_200_OK)
+
+
+def _spectrum_response(request: Request, features, key: str, format: str, expand):
+    '''Compact features are served as they are stored, the json format expands them to one dict per bin or peak'''
+
+    # Lines are expanded while they are sent, the expanded result is never held as a whole
+    if wants_ndjson(request):
+        rows = nested_rows(features, key=key)
+        if format == 'json':
+            rows = ({**row, key: expand(row[key])} for row in rows)
+
+        return ndjson_response(rows)
+
+    if format == 'json':
+        features = expand_features(features, expand=expand)
+
+    return _feature_response(request=request, features=features, key=key)
+
+
+def spectrum_parameters(method: str = Query(default='dct', regex='^(dct|welch|binned)$'),
+                        segment_length: int = Query(default=WELCH_SEGMENT_LENGTH),
+                        overlap: int = Query(default=None),
+                        number_of_bins: int = Query(default=PSD_NUMBER_OF_BINS)) -> SpectrumParameters:
+    '''
+    PSD method and resolution of the request, welch uses segment_length and overlap, half of the segment by default,
+    binned uses number_of_bins. Parameters of the other methods are ignored.
+    '''
+
+    try:
+        return SpectrumParameters(method=method, segment_length=segment_length, overlap=overlap, number_of_bins=number_of_bins)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=str(e))
+
+
+def _measurements_ids(measurements: Dict[Tuple[str, str], float] = None):
+    return sorted({mId for _, mId in measurements.keys()}) if measurements is not None else None
+
+
+async def _samples_range(nodeId: str = None, measurementId: str = None, measurements: Dict[Tuple[str, str], float] = None):
+    '''Time range holding the samples of the given measurements of the scope, the whole bucket is read without them'''
+
+    if measurements is None:
+        return None, None
+
+    # The catalog of the scope is cached since the missing measurements were looked up in it
+    catalog = await influx.get_measurement_catalog(nodeId=nodeId, measurementId=measurementId)
+    entries = [m for m in catalog if (m['nodeId'], m['measurementId']) in measurements]
+
+    return samples_range(entries) if entries else (None, None)
+
+
+async def _load_preprocesser(nodeId: str = None, measurementId: str = None, spectrum: SpectrumParameters = None, measurements: Dict[Tuple[str, str], float] = None) -> Preprocesser:
+    '''
+    Shared fetch plan of the analytics endpoints, samples and ids of the requested scope come from one query.
+    measurements limits the batch to the given (nodeId, measurementId) keys of the scope.
+    '''
+
+    start, stop = await _samples_range(nodeId=nodeId, measurementId=measurementId, measurements=measurements)
+    batch = await influx.get_analytics_input(nodeId=nodeId, measurementId=measurementId, measurementsIds=_measurements_ids(measurements), start=start, stop=stop)
+
+    # Measurement ids are filtered across all nodes of the scope, pairs that were not asked for are dropped
+    if measurements is not None:
+        batch = batch.select([key in measurements for key in batch.keys()])
+
+    # Outlier detection and normalization run with the extraction off the event loop, see PrecomputeScheduler._extract
+    preprocessor = await influx.run(Preprocesser, batch=batch, spectrum=spectrum)
+
+    # Outliers get no features, they are marked so they are not fetched again
+    if preprocessor.outliers:
+        times = measurements if measurements is not None else await _measurement_times(nodeId=nodeId, measurementId=measurementId)
+        await influx.write_outliers(outliers=preprocessor.outliers, times=times)
+
+    return preprocessor
+
+
+async def _load_incremental_extractor(nodeId: str = None,
+                                      measurementId: str = None,
+                                      spectrum: SpectrumParameters = None,
+                                      psd: bool = True,
+                                      measurements: Dict[Tuple[str, str], float] = None) -> IncrementalFeatureExtractor:
+    '''Streams the samples of the requested scope through the incremental extractor, memory stays bounded by the query chunk size'''
+
+    try:
+        extractor = IncrementalFeatureExtractor(spectrum=spectrum, psd=psd)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=str(e))
+
+    start, stop = await _samples_range(nodeId=nodeId, measurementId=measurementId, measurements=measurements)
+    pieces = influx.iter_vibration_chunks(nodeId=nodeId, measurementId=measurementId, measurementsIds=_measurements_ids(measurements), start=start, stop=stop)
+    if measurements is not None:
+        pieces = (piece for piece in pieces if (piece[0], piece[1]) in measurements)
+
+    return await influx.run(extractor.consume, pieces)
+
+
+def _precomputed(spectrum: SpectrumParameters = None) -> bool:
+    '''Features precomputed by the running scheduler are only read by the endpoints, other spectra are computed on request'''
+
+    return precompute_scheduler.running and (spectrum is None or spectrum.key == precompute_scheduler.SPECTRUM.key)
+
+
+async def _queue_missing_features(nodeId: str = None, measurementId: str = None) -> bool:
+    '''Queues the measurements of the scope the scheduler has not processed, returns whether any of them is still pending'''
+
+    await single_flight.run(('reconcile', nodeId, measurementId), precompute_scheduler.reconcile, nodeId=nodeId, measurementId=measurementId)
+
+    return precompute_scheduler.is_pending(nodeId=nodeId, measurementId=measurementId)
+
+
+def _pending_response():
+    return JSONResponse(content='Features are being computed', status_code=status.HTTP_202_ACCEPTED)
+
+
+async def _measurement_times(nodeId: str = None, measurementId: str = None):
+    '''Processed rows are written at the time of their measurement, taken from the catalog'''
+
+    catalog = await influx.get_measurement_catalog(nodeId=nodeId, measurementId=measurementId)
+
+    return {(m['nodeId'], m['measurementId']): m['time'] for m in catalog}
+
+
+async def _outlier_measurements(nodeId: str = None, measurementId: str = None):
+    if not outlier_filter.enabled:
+        return set()
+
+    return await influx.get_outlier_measurements(nodeId=nodeId, measurementId=measurementId)
+
+
+async def _read_features(getter, nodeId: str = None, measurementId: str = None, **kwargs):
+    '''
+    Reads the stored features of the scope with the catalog, returns them and the {(nodeId, measurementId): time}
+    of the measurements that have none and were not left out as outliers.
+    The catalog and the outlier marks are cached like the features until new rows of their node are written.
+    '''
+
+    features, times, outliers = await asyncio.gather(getter(nodeId=nodeId, measurementId=measurementId, **kwargs),
+                                                     _measurement_times(nodeId=nodeId, measurementId=measurementId),
+                                                     _outlier_measurements(nodeId=nodeId, measurementId=measurementId))
+
+    missing = {(nId, mId): t for (nId, mId), t in times.items() if mId not in features.get(nId, {}) and (nId, mId) not in outliers}
+
+    return features, missing
+
+
+def _merge_features(features, computed):
+    '''Stored features may be shared with the feature cache, they are merged into new dicts'''
+
+    merged = {nId: dict(measurements) for nId, measurements in features.items()}
+    for nId, measurements in computed.items():
+        merged.setdefault(nId, {}).update(measurements)
 
-    preprocessor = Preprocesser(matrices=matrices, nodes_ids=nodes_ids, measurements_ids=measurements_ids)  
-    rms_features = preprocessor.rms_feature_extraction()
+    return merged
+
+
+async def _rms_features(nodeId: str = None, measurementId: str = None, incremental: bool = False):
+    '''Reads the rms features of the scope, computing and writing those of the measurements that have none'''
+
+    if _precomputed():
+        return await influx.get_rms_features(nodeId=nodeId, measurementId=measurementId)
+
+    rms_features, missing = await _read_features(influx.get_rms_features, nodeId=nodeId, measurementId=measurementId)
+    if not missing:
+        return rms_features
     
-    influx.write_rms_features(rms_features=rms_features)
+    # Without any stored feature the whole scope is missing and is fetched without an id filter
+    measurements = missing if rms_features else None
+
+    if incremental:
+        extractor = await _load_incremental_extractor(nodeId=nodeId, measurementId=measurementId, psd=False, measurements=measurements)
+        computed = await influx.run(extractor.rms_feature_extraction)
+    else:
+        preprocessor = await _load_preprocesser(nodeId=nodeId, measurementId=measurementId, measurements=measurements)
+        computed = await influx.run(preprocessor.rms_feature_extraction)
     
-    return JSONResponse(content=rms_features, status_code=status.HTTP_200_OK)
+    await influx.write_rms_features(rms_features=computed, times=missing)
 
+    return _merge_features(rms_features, computed)
 
-@router.get('/psd')
-async def get_psd_features(nodeId: str = None, measurementId: str = None, admin = Depends(get_current_admin)):
-        
-    psd_features = influx.get_psd_features(nodeId=nodeId, measurementId=measurementId)
-    if psd_features:
-        return JSONResponse(content=psd_features, status_code=status.HTTP_200_OK)
-    
-    vibration_data = influx.get_vibration_data(nodeId=nodeId, measurementId=measurementId)
-    nodes_ids = influx.get_all_nodes_id()
-    measurements_ids = influx.get_all_measurements_id()
 
-    transformer = Transformer(vibration_data=vibration_data)
-    matrices = transformer.get_matrices()
+async def _psd_features(nodeId: str = None, measurementId: str = None, spectrum: SpectrumParameters = None, incremental: bool = False):
+    '''Reads the compact psd features of the scope, computing and writing those of the measurements that have none'''
+
+    if _precomputed(spectrum):
+        return await influx.get_psd_features(nodeId=nodeId, measurementId=measurementId, spectrum=spectrum.key)
 
-    preprocessor = Preprocesser(matrices=matrices, nodes_ids=nodes_ids, measurements_ids=measurements_ids)  
-    psd_features = preprocessor.psd_feature_extraction()
+    psd_features, missing = await _read_features(influx.get_psd_features, nodeId=nodeId, measurementId=measurementId, spectrum=spectrum.key)
+    if not missing:
+        return psd_features
     
-    influx.write_psd_features(psd_features=psd_features)
+    measurements = missing if psd_features else None
+
+    # Only the welch PSD can be computed incrementally, the other methods transform whole measurements
+    if incremental:
+        extractor = await _load_incremental_extractor(nodeId=nodeId, measurementId=measurementId, spectrum=spectrum, measurements=measurements)
+        computed = await influx.run(extractor.compact_psd_feature_extraction)
+    else:
+        preprocessor = await _load_preprocesser(nodeId=nodeId, measurementId=measurementId, spectrum=spectrum, measurements=measurements)
+        computed = await influx.run(preprocessor.compact_psd_feature_extraction)
     
-    return JSONResponse(content=psd_features, status_code=status.HTTP_200_OK)
+    await influx.write_psd_features(psd_features=computed, times=missing)
 
+    return _merge_features(psd_features, computed)
 
-@router.get('/peaks')
-async def get_harmonic_peaks(nodeId: str = None, measurementId: str = None, admin = Depends(get_current_admin)):
+
+async def _harmonic_peaks(nodeId: str = None, measurementId: str = None, spectrum: SpectrumParameters = None):
+    '''Reads the compact harmonic peaks of the scope, computing and writing those of the measurements that have none'''
+
+    if _precomputed(spectrum):
+        return await influx.get_harmonic_peaks(nodeId=nodeId, measurementId=measurementId, spectrum=spectrum.key)
+
+    harmonic_peaks, missing = await _read_features(influx.get_harmonic_peaks, nodeId=nodeId, measurementId=measurementId, spectrum=spectrum.key)
+    if not missing:
+        return harmonic_peaks
     
-    harmonic_peaks = influx.get_harmonic_peaks(nodeId=nodeId, measurementId=measurementId)
-    if harmonic_peaks:
-        return JSONResponse(content=harmonic_peaks, status_code=status.HTTP_200_OK)
+    preprocessor = await _load_preprocesser(nodeId=nodeId, measurementId=measurementId, spectrum=spectrum, measurements=missing if harmonic_peaks else None)
+    computed = await influx.run(preprocessor.compact_harmonic_peak_feature_extraction)
     
-    vibration_data = influx.get_vibration_data(nodeId=nodeId, measurementId=measurementId)
-    nodes_ids = influx.get_all_nodes_id()
-    measurements_ids = influx.get_all_measurements_id()
+    await influx.write_harmonic_peaks(harmonic_peaks=computed, spectrum=spectrum.key, times=missing)
+
+    return _merge_features(harmonic_peaks, computed)
+
+
+def _coalesced_harmonic_peaks(nodeId: str = None, measurementId: str = None, spectrum: SpectrumParameters = None):
+    spectrum = spectrum if spectrum is not None else SpectrumParameters()
 
-    transformer = Transformer(vibration_data=vibration_data)
-    matrices = transformer.get_matrices()
+    return single_flight.run(('harmonic_peaks', nodeId, measurementId, spectrum.key), _harmonic_peaks, nodeId=nodeId, measurementId=measurementId, spectrum=spectrum)
 
-    preprocessor = Preprocesser(matrices=matrices, nodes_ids=nodes_ids, measurements_ids=measurements_ids)  
-    harmonic_peaks = preprocessor.harmonic_peak_feature_extraction()
+
+async def _healthy_references():
+    '''Packed healthy zone references to measure distances against, None without labeled data or measurements'''
+
+    starting_service_date, references = await asyncio.gather(influx.get_starting_service_date(),
+                                                             influx.run(healthy_baseline.references))
+
+    return references if references is not None and starting_service_date else None
+
+
+async def _harmonic_peak_distances(nodeId: str = None, measurementId: str = None):
+    '''Reads the distances of the scope, measuring and writing those of the measurements that have none, None without labeled data'''
+
+    harmonic_peaks_distances, missing = await _read_features(influx.get_harmonic_peak_distance_from_healthy_zone, nodeId=nodeId, measurementId=measurementId)
+    if harmonic_peaks_distances and not missing:
+        return harmonic_peaks_distances
+
+    references = await _healthy_references()
+    if references is None:
+        return None
+
+    harmonic_peaks = await _coalesced_harmonic_peaks(nodeId=nodeId, measurementId=measurementId)
+
+    # Only the measurements without stored distances are measured
+    missing_peaks = defaultdict(lambda: {})
+    for nId, mId in missing.keys():
+        if mId in harmonic_peaks.get(nId, {}):
+            missing_peaks[nId][mId] = harmonic_peaks[nId][mId]
+    
+    missing_peaks = expand_features(missing_peaks, expand=expand_peaks)
+    rul_model = RemainingUsefulLifetimeModel()
     
-    influx.write_harmonic_peaks(harmonic_peaks=harmonic_peaks)
+    distances = rul_model.get_measurements_distance_from_healthy_zone(harmonic_peaks=missing_peaks, references=references)
     
-    return JSONResponse(content=harmonic_peaks, status_code=status.HTTP_200_OK)
+    await influx.write_harmonic_peak_ditance_from_healthy_zone(distances=distances, times=missing)
 
+    return _merge_features(harmonic_peaks_distances, distances)
 
-@router.get('/harmonicPeakDistance')
-async def get_harmonic_peak_distance_from_labeled_data(nodeId: str = None, measurementId: str = None, admin = Depends(get_current_admin)):
+
+async def _rul_values(nodeId: str = None):
+    '''Measures the missing distances of the scope and refits the models of nodes with new distance points before reading their RUL'''
+
+    harmonic_peaks_distances = await single_flight.run(('harmonic_peak_distance', nodeId, None), _harmonic_peak_distances, nodeId=nodeId)
+    if harmonic_peaks_distances is None:
+        return None
+
+    await influx.run(rul_models.refresh, nodeId=nodeId)
+
+    return await influx.get_rul_values(nodeId=nodeId)
+
+
+@router.get('/rms')
+async def get_rms_features(request: Request, nodeId: str = None, measurementId: str = None, incremental: bool = False, admin = Depends(get_current_admin)):
     
-    harmonic_peaks_distances = influx.get_harmonic_peak_distance_from_healthy_zone(nodeId=nodeId, measurementId=measurementId)
-    if harmonic_peaks_distances:
-        return JSONResponse(content=harmonic_peaks_distances, status_code=status.HTTP_200_OK)
+    # Concurrent requests for the same features wait on a single computation
+    rms_features = await single_flight.run(('rms', nodeId, measurementId, incremental), _rms_features, nodeId=nodeId, measurementId=measurementId, incremental=incremental)
+    if not rms_features and _precomputed() and await _queue_missing_features(nodeId=nodeId, measurementId=measurementId):
+        return _pending_response()
     
-    starting_service_date = influx.get_starting_service_date()
-    labeled_peaks = influx.get_labeled_harmonic_peaks()
-    if not labeled_peaks or not starting_service_date:
-        return JSONResponse(content='Not implemented yet!', status_code=status.HTTP_501_NOT_IMPLEMENTED)
-
-    harmonic_peaks = influx.get_harmonic_peaks(nodeId=nodeId, measurementId=measurementId)
-    if not harmonic_peaks:
-        vibration_data = influx.get_vibration_data(nodeId=nodeId, measurementId=measurementId)
-        nodes_ids = influx.get_all_nodes_id()
-        measurements_ids = influx.get_all_measurements_id()
+    return _feature_response(request=request, features=rms_features, key='rms')
 
-        transformer = Transformer(vibration_data=vibration_data)
-        matrices = transformer.get_matrices()
 
-        preprocessor = Preprocesser(matrices=matrices, nodes_ids=nodes_ids, measurements_ids=measurements_ids)  
-        harmonic_peaks = preprocessor.harmonic_peak_feature_extraction()
+@router.get('/psd')
+async def get_psd_features(request: Request,
+                           nodeId: str = None,
+                           measurementId: str = None,
+                           format: str = Query(default='json', regex='^(json|compact)$'),
+                           spectrum: SpectrumParameters = Depends(spectrum_parameters),
+                           incremental: bool = False,
+                           admin = Depends(get_current_admin)):
         
-        influx.write_harmonic_peaks(harmonic_peaks=harmonic_peaks) 
+    psd_features = await single_flight.run(('psd', nodeId, measurementId, spectrum.key, incremental), _psd_features, nodeId=nodeId, measurementId=measurementId, spectrum=spectrum, incremental=incremental)
+    if not psd_features and _precomputed(spectrum) and await _queue_missing_features(nodeId=nodeId, measurementId=measurementId):
+        return _pending_response()
     
-    rul_model = RemainingUsefulLifetimeModel()
+    return _spectrum_response(request=request, features=psd_features, key='psd', format=format, expand=expand_psd)
+
+
+@router.get('/peaks')
+async def get_harmonic_peaks(request: Request,
+                             nodeId: str = None,
+                             measurementId: str = None,
+                             format: str = Query(default='json', regex='^(json|compact)$'),
+                             spectrum: SpectrumParameters = Depends(spectrum_parameters),
+                             admin = Depends(get_current_admin)):
     
-    distances = rul_model.get_measurements_distance_from_healthy_zone(harmonic_peaks=harmonic_peaks, labeled_peaks=labeled_peaks)
+    harmonic_peaks = await _coalesced_harmonic_peaks(nodeId=nodeId, measurementId=measurementId, spectrum=spectrum)
+    if not harmonic_peaks and _precomputed(spectrum) and await _queue_missing_features(nodeId=nodeId, measurementId=measurementId):
+        return _pending_response()
     
-    influx.write_harmonic_peak_ditance_from_healthy_zone(distances=distances)
+    return _spectrum_response(request=request, features=harmonic_peaks, key='harmonic_peaks', format=format, expand=expand_peaks)
+
+
+@router.get('/harmonicPeakDistance')
+async def get_harmonic_peak_distance_from_labeled_data(request: Request, nodeId: str = None, measurementId: str = None, admin = Depends(get_current_admin)):
     
-    return JSONResponse(content=distances, status_code=status.HTTP_200_OK)
+    # Distances are written by the scheduler together with the peaks they are measured from
+    if _precomputed():
+        harmonic_peaks_distances = await influx.get_harmonic_peak_distance_from_healthy_zone(nodeId=nodeId, measurementId=measurementId)
+
+        if not harmonic_peaks_distances:
+            if await _healthy_references() is None:
+                return JSONResponse(content='Not implemented yet!', status_code=status.HTTP_501_NOT_IMPLEMENTED)
+
+            if await _queue_missing_features(nodeId=nodeId, measurementId=measurementId):
+                return _pending_response()
+
+        return _feature_response(request=request, features=harmonic_peaks_distances, key='distances')
+
+    harmonic_peaks_distances = await single_flight.run(('harmonic_peak_distance', nodeId, measurementId), _harmonic_peak_distances, nodeId=nodeId, measurementId=measurementId)
+    if harmonic_peaks_distances is None:
+        return JSONResponse(content='Not implemented yet!', status_code=status.HTTP_501_NOT_IMPLEMENTED)
+    
+    return _feature_response(request=request, features=harmonic_peaks_distances, key='distances')
 
 
 @router.get('/rul')
 async def get_rul_values(nodeId: str = None, admin = Depends(get_current_admin)):
     
-    rul_values = influx.get_rul_values(nodeId=nodeId)
-    if rul_values:
-        return JSONResponse(content=rul_values, status_code=status.HTTP_200_OK)
-    
-    starting_service_date = influx.get_starting_service_date()
-    labeled_peaks = influx.get_labeled_harmonic_peaks()
-    if not labeled_peaks or not starting_service_date:
-        return JSONResponse(content='Not implemented yet!', status_code=status.HTTP_501_NOT_IMPLEMENTED)
+    # RUL values are written when the scheduler refits a model, reading them is a single lookup
+    if _precomputed():
+        rul_values = await influx.get_rul_values(nodeId=nodeId)
 
-    harmonic_peaks = influx.get_harmonic_peaks(nodeId=nodeId)
-    if not harmonic_peaks:
-        vibration_data = influx.get_vibration_data(nodeId=nodeId)
-        nodes_ids = influx.get_all_nodes_id()
-        measurements_ids = influx.get_all_measurements_id()
+        if not rul_values:
+            if await _healthy_references() is None:
+                return JSONResponse(content='Not implemented yet!', status_code=status.HTTP_501_NOT_IMPLEMENTED)
 
-        transformer = Transformer(vibration_data=vibration_data)
-        matrices = transformer.get_matrices()
+            if await _queue_missing_features(nodeId=nodeId):
+                return _pending_response()
 
-        preprocessor = Preprocesser(matrices=matrices, nodes_ids=nodes_ids, measurements_ids=measurements_ids)  
-        harmonic_peaks = preprocessor.harmonic_peak_feature_extraction()
-        
-        influx.write_harmonic_peaks(harmonic_peaks=harmonic_peaks) 
+        return JSONResponse(content=rul_values, status_code=status.HTTP_200_OK)
+
+    rul_values = await single_flight.run(('rul', nodeId), _rul_values, nodeId=nodeId)
+    if rul_values is None:
+        return JSONResponse(content='Not implemented yet!', status_code=status.HTTP_501_NOT_IMPLEMENTED)
     
-    rul_model = RemainingUsefulLifetimeModel()
+    return JSONResponse(content=rul_values, status_code=status.HTTP_200_OK)
     
 
+@router.get('/status')
+async def get_analytics_status(admin = Depends(get_current_admin)):
+    result = {
+        'cache': feature_cache.status(),
+        'single_flight': single_flight.status(),
+        'scheduler': precompute_scheduler.status(),
+        'outlier_detection': outlier_filter.status(),
+        'baseline': healthy_baseline.status()
+    }
+
+    return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+
+
 @router.delete('/cachedData')
 async def delete_cached_processed_data(admin = Depends(get_current_admin)):
-    influx.clear_cached_data()
+    await influx.clear_cached_data()
+
+    # Models are fitted on the deleted distances, they are fitted again once the distances are recomputed
+    await influx.run(rul_models.clear)
+
+    # Labeled data is cleared together with the processed data
+    healthy_baseline.invalidate()
     
     return JSONResponse(content='Cached data deleted successfully!', status_code=status.HTTP_200_OK)
\ No newline at end of file
@@ -1,13 +1,17 @@
 from typing import Dict
 
-from fastapi import APIRouter, status, Depends
+from fastapi import APIRouter, status, Depends, HTTPException, Request, Query
 from fastapi.responses import JSONResponse
 
 from ..models.SendDataModel import NodeModel
-from ..influxdb.influx import InfluxDB
+from ..models.BinaryDataModel import BinaryFrameError, InvalidMeasurementError, decode_vibration_frame
+from ..influxdb.async_influx import AsyncInfluxDB
+from ..influxdb.writer import WriteQueueFullError
+from ..influxdb.pagination import InvalidCursorError
+from ..analytics.scheduler import precompute_scheduler
 from ..auth.deps import get_current_admin, get_current_gateway
-
-from pydantic import parse_obj_as
+from ..utils.constants import WRITE_FLUSH_INTERVAL
+from ..utils.ndjson import wants_ndjson, ndjson_response, nested_rows
 
 import pandas as pd
 
@@ -20,54 +24,107 @@ router = APIRouter(
 )
 
 
-influx = InfluxDB()
+influx = AsyncInfluxDB()
 
 
-@router.get('')
-async def get_all_data(admin = Depends(get_current_admin)):
-    result = influx.get_vibration_data()
+@router.on_event('shutdown')
+async def close_influx():
+    await influx.close()
 
-    return JSONResponse(content=result, status_code=status.HTTP_200_OK)
 
+async def _page_response(request: Request, nodeId: str = None, measurementId: str = None, start: float = None, stop: float = None, limit: int = None, cursor: str = None):
+    if wants_ndjson(request) and limit is None and cursor is None:
+        # Measurements are sent while the query result is still being read
+        return ndjson_response(influx.iter_vibration_measurements(nodeId=nodeId, measurementId=measurementId, start=start, stop=stop))
 
-@router.get('/node/{nodeId}')
-async def get_node_data(nodeId: str, admin = Depends(get_current_admin)):
-    result = influx.get_vibration_data(nodeId=nodeId)
+    try:
+        result, next_cursor = await influx.get_vibration_data_page(nodeId=nodeId, measurementId=measurementId, start=start, stop=stop, limit=limit, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
+                            detail=str(e))
 
-    return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor is not None else None
 
+    if wants_ndjson(request):
+        return ndjson_response(nested_rows(result, key='samples'), headers=headers)
 
-@router.get('/measurement/{measurementId}')
-async def get_measurement_data(measurementId: str, admin = Depends(get_current_admin)):
-    result = influx.get_vibration_data(measurementId=measurementId)
+    return JSONResponse(content=result, status_code=status.HTTP_200_OK, headers=headers)
 
-    return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+
+@router.get('')
+async def get_all_data(request: Request, start: float = None, stop: float = None, limit: int = Query(default=None, ge=1), cursor: str = None, admin = Depends(get_current_admin)):
+    return await _page_response(request=request, start=start, stop=stop, limit=limit, cursor=cursor)
+
+
+@router.get('/node/{nodeId}')
+async def get_node_data(request: Request, nodeId: str, start: float = None, stop: float = None, limit: int = Query(default=None, ge=1), cursor: str = None, admin = Depends(get_current_admin)):
+    return await _page_response(request=request, nodeId=nodeId, start=start, stop=stop, limit=limit, cursor=cursor)
+
+
+@router.get('/measurement/{measurementId}')
+async def get_measurement_data(request: Request, measurementId: str, start: float = None, stop: float = None, limit: int = Query(default=None, ge=1), cursor: str = None, admin = Depends(get_current_admin)):
+    # Nodes may reuse a measurement id, its measurements are paged like those of a node
+    return await _page_response(request=request, measurementId=measurementId, start=start, stop=stop, limit=limit, cursor=cursor)
 
 
 @router.get('/allNodes')
-async def get_nodes_id(admin = Depends(get_current_admin)):
-    result = influx.get_all_nodes_id()
+async def get_nodes_id(start: float = None, stop: float = None, admin = Depends(get_current_admin)):
+    result = await influx.get_all_nodes_id(start=start, stop=stop)
 
     return JSONResponse(content=result, status_code=status.HTTP_200_OK)
 
 
 @router.get('/allMeasurements')
-async def get_measurments_id(admin = Depends(get_current_admin)):
-    result = influx.get_all_measurements()
+async def get_measurments_id(nodeId: str = None, start: float = None, stop: float = None, admin = Depends(get_current_admin)):
+    result = await influx.get_all_measurements(nodeId=nodeId, start=start, stop=stop)
 
     return JSONResponse(content=result, status_code=status.HTTP_200_OK)
 
 
 @router.post('')
 async def send_data(dataList: Dict[str, NodeModel], gateway = Depends(get_current_gateway)):
-    dList = parse_obj_as(Dict[str, NodeModel], dataList)
-    influx.write_vibration_data(data=dList)
+    try:
+        await influx.write_vibration_data(data=dataList, on_written=precompute_scheduler.notify)
+    except InvalidMeasurementError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
+                            detail=str(e))
+    except WriteQueueFullError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+                            detail=str(e),
+                            headers={'Retry-After': str(WRITE_FLUSH_INTERVAL)})
+
+    return JSONResponse(content='', status_code=status.HTTP_202_ACCEPTED)
+
+
+@router.post('/binary')
+async def send_binary_data(request: Request, gateway = Depends(get_current_gateway)):
+    body = await request.body()
+
+    try:
+        measurements = decode_vibration_frame(body)
+    except BinaryFrameError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
+                            detail=str(e))
+
+    try:
+        await influx.write_vibration_arrays(measurements=measurements, on_written=precompute_scheduler.notify)
+    except WriteQueueFullError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+                            detail=str(e),
+                            headers={'Retry-After': str(WRITE_FLUSH_INTERVAL)})
 
     return JSONResponse(content='', status_code=status.HTTP_202_ACCEPTED)
 
 
+@router.get('/writer')
+async def get_writer_status(admin = Depends(get_current_admin)):
+    result = influx.background_writer.status()
+
+    return JSONResponse(content=result, status_code=status.HTTP_200_OK)
+
+
 @router.delete('')
 async def delete_vibration_data(admin = Depends(get_current_admin)):
-    influx.clear_vibration_data()
+    await influx.clear_vibration_data()
     
     return JSONResponse(content='Vibration data deleted successfully!', status_code=status.HTTP_200_OK)
\ No newline at end of file
@@ -11,8 +11,56 @@ MAXIMUM_NUMBER_OF_PEAKS = 20
 
 SAMPLING_RATE = 4000
 
-# Processed Data Expiration Time in Minutes
+# Cached Feature Query Expiration Time in Minutes, the processed data itself is kept
 PROCESSED_DATA_EXPIRATION_TIME = 15
 
 # Distance From Healthy Zone Threshold
-HEALTHY_ZONE_THRESHOLD = 0.2
\ No newline at end of file
+HEALTHY_ZONE_THRESHOLD = 0.2
+# RUL reported for nodes whose distance from the healthy zone does not grow
+MAXIMUM_RUL_IN_DAYS = 10 * 365
+
+# Background Influx Writer Vars
+WRITE_QUEUE_MAX_POINTS = 2_000_000
+WRITE_BATCH_SIZE = 50_000
+# Flush interval, first and longest retry interval in seconds. Failed writes are retried until they succeed,
+# WRITE_MAX_RETRIES only bounds the retries of a closing writer
+WRITE_FLUSH_INTERVAL = 1
+WRITE_MAX_RETRIES = 5
+WRITE_RETRY_INTERVAL = 0.5
+WRITE_MAX_RETRY_INTERVAL = 30
+
+# Number of rows parsed at a time when vibration data is streamed from influx
+VIBRATION_STREAM_CHUNK_SIZE = 100_000
+
+# Threads running influx queries for the async route handlers
+INFLUXDB_EXECUTOR_WORKERS = 8
+
+# Batches with fewer samples are processed in the request instead of the feature extraction pool
+PARALLEL_MIN_SAMPLES = 1_000_000
+
+# Characters of a base64 spectrum stored per string field, influx limits string fields to 64KiB
+SPECTRUM_FIELD_SIZE = 48_000
+
+# Default resolution of the welch and binned PSD methods, welch segments overlap by half of their length by default
+WELCH_SEGMENT_LENGTH = 1024
+PSD_NUMBER_OF_BINS = 256
+
+# In-process cache of feature query results, bytes are measured on the json encoded results
+FEATURE_CACHE_MAX_ENTRIES = 1024
+FEATURE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Precompute scheduler, measurements taken per batch, seconds between catalog reconciliations and the throughput window in seconds
+PRECOMPUTE_BATCH_SIZE = 16
+PRECOMPUTE_RECONCILE_INTERVAL = 300
+PRECOMPUTE_THROUGHPUT_WINDOW = 60
+
+# Outlier detection, scaled median absolute deviations an average acceleration may be away from the median of its node,
+# measurements of a node needed before the mad and the meanshift method mark anything, averages kept per node and averages MeanShift is fitted on
+OUTLIER_MAD_THRESHOLD = 5.0
+OUTLIER_MIN_MEASUREMENTS = 8
+OUTLIER_CLUSTERING_MIN_MEASUREMENTS = 128
+OUTLIER_HISTORY_SIZE = 256
+OUTLIER_SAMPLE_SIZE = 1000
+
+# Seconds between checks for changed labeled data, the healthy zone references are reloaded when it changed
+HEALTHY_BASELINE_CHECK_INTERVAL = 30
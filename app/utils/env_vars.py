@@ -27,4 +27,18 @@ INFLUXDB_ORG = os.getenv('INFLUXDB_ORG')
 INFLUXDB_BUCKET = os.getenv('INFLUXDB_BUCKET')
 INFLUXDB_TOKEN = os.getenv('INFLUXDB_TOKEN')
 
-INFLUXDB_URI = f'http://{INFLUXDB_HOST}:{INFLUXDB_PORT}'.replace(' ', '%20')
\ No newline at end of file
+INFLUXDB_URI = f'http://{INFLUXDB_HOST}:{INFLUXDB_PORT}'.replace(' ', '%20')
+
+# v1 stores every sample at the measurement time with an index tag, v2 stores sample i at time + i / SAMPLING_RATE
+INFLUXDB_STORAGE_LAYOUT = os.getenv('INFLUXDB_STORAGE_LAYOUT', 'v1')
+
+# Worker processes used for feature extraction of large batches, 1 keeps it in the request process
+FEATURE_EXTRACTION_WORKERS = int(os.getenv('FEATURE_EXTRACTION_WORKERS', '1'))
+
+# Background computation of the features of newly ingested measurements, the analytics endpoints only read them while it runs
+PRECOMPUTE_ENABLED = os.getenv('PRECOMPUTE_ENABLED', 'true').lower() == 'true'
+# Batches of measurements the precompute scheduler processes at the same time
+PRECOMPUTE_CONCURRENCY = int(os.getenv('PRECOMPUTE_CONCURRENCY', '2'))
+
+# Outlier detection of the preprocesser, none, mad (per node median absolute deviation) or meanshift (sampled MeanShift clustering)
+OUTLIER_DETECTION = os.getenv('OUTLIER_DETECTION', 'none').lower()
@@ -0,0 +1,27 @@
+import json
+
+from typing import Dict, Iterable
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def ndjson_response(rows: Iterable[Dict], status_code: int = 200, headers: Dict[str, str] = None) -> StreamingResponse:
+    '''Streams every row as a separate json line, rows are serialized only when the client reads them'''
+
+    return StreamingResponse((json.dumps(row) + '\n' for row in rows), status_code=status_code, headers=headers, media_type=NDJSON_MEDIA_TYPE)
+
+
+def nested_rows(result: Dict[str, Dict], key: str) -> Iterable[Dict]:
+    '''Flattens a {nodeId: {measurementId: value}} result into one row per measurement'''
+
+    for nId, measurements in result.items():
+        for mId, value in measurements.items():
+            yield {'nodeId': nId, 'measurementId': mId, key: value}
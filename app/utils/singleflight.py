@@ -0,0 +1,48 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls with the same key, the first caller starts the computation and the others await its result.
+    The computation runs as its own task, a caller that goes away does not cancel it for the rest.
+    '''
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+        self._executed = 0
+        self._coalesced = 0
+
+
+    async def run(self, key: Hashable, function: Callable[..., Awaitable[Any]], *args, **kwargs):
+        task = self._tasks.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            task.add_done_callback(lambda done: self._done(key, done))
+
+            self._tasks[key] = task
+            self._executed += 1
+        else:
+            self._coalesced += 1
+
+        return await asyncio.shield(task)
+
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+        # Retrieving the exception keeps asyncio from reporting it when every caller went away
+        if not task.cancelled():
+            task.exception()
+
+
+    def status(self):
+        return {
+            'in_flight': len(self._tasks),
+            'executed': self._executed,
+            'coalesced': self._coalesced
+        }
@@ -0,0 +1,60 @@
+import time
+import argparse
+import numpy as np
+
+from sklearn.cluster import MeanShift
+
+from app.analytics.clustering import MeanShiftClustering
+from app.analytics.outliers import RobustOutlierDetection
+
+
+def synthetic_averages(number_of_measurements: int, outlier_ratio: float, seed: int = 0):
+    '''Average accelerations of one node around gravity on its mounting axis, with a share of them displaced like a loose or faulty sensor'''
+
+    rng = np.random.default_rng(seed)
+
+    averages = np.array([0.0, 0.0, 9.81]) + rng.normal(scale=0.05, size=(number_of_measurements, 3))
+    outliers = rng.random(number_of_measurements) < outlier_ratio
+
+    averages[outliers] += rng.choice([-1.0, 1.0], size=(outliers.sum(), 3)) * rng.uniform(1.0, 5.0, size=(outliers.sum(), 3))
+
+    return averages, outliers
+
+
+def original_meanshift(averages: np.ndarray) -> np.ndarray:
+    '''MeanShift with the default bandwidth estimation on every average, as the preprocesser used to run it'''
+
+    labels = MeanShift().fit(averages).labels_
+
+    return labels != np.bincount(labels).argmax()
+
+
+def benchmark(name: str, detect, averages: np.ndarray, outliers: np.ndarray):
+    start = time.perf_counter()
+    detected = detect(averages)
+    elapsed = time.perf_counter() - start
+
+    recall = (detected & outliers).sum() / max(outliers.sum(), 1)
+    false_positives = (detected & ~outliers).sum()
+
+    print(f'{name:<12} {averages.shape[0]:>10} {elapsed:>10.4f}s {recall:>8.2%} {false_positives:>8}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Timings of the outlier detection methods on synthetic average accelerations of one node')
+    parser.add_argument('--measurements', type=int, nargs='+', default=[100, 1000, 10000, 100000], help='Number of measurements of each run')
+    parser.add_argument('--outlier-ratio', type=float, default=0.02, help='Share of displaced measurements')
+    parser.add_argument('--original-limit', type=int, default=5000, help='Runs with more measurements skip the quadratic original MeanShift')
+
+    args = parser.parse_args()
+
+    print(f'{"method":<12} {"measurements":>10} {"time":>11} {"recall":>8} {"false":>8}')
+
+    for number_of_measurements in args.measurements:
+        averages, outliers = synthetic_averages(number_of_measurements=number_of_measurements, outlier_ratio=args.outlier_ratio)
+
+        if number_of_measurements <= args.original_limit:
+            benchmark('original', original_meanshift, averages, outliers)
+
+        benchmark('meanshift', MeanShiftClustering().outliers, averages, outliers)
+        benchmark('mad', RobustOutlierDetection().outliers, averages, outliers)
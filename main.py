@@ -1,9 +1,6 @@
 import os
 import uvicorn
 from dotenv import load_dotenv
-from app import initialize_server
-
-app = initialize_server()
 
 load_dotenv()
 
@@ -12,5 +9,6 @@ SERVER_HOST = os.getenv('SERVER_HOST')
 SERVER_PORT = int(os.getenv('SERVER_PORT'))
 
 
+# The app is built by uvicorn through its factory, feature extraction workers are spawned and import this file again
 if __name__ == '__main__':
-    uvicorn.run(SERVER_STR, host=SERVER_HOST, port=SERVER_PORT, reload=True)
\ No newline at end of file
+    uvicorn.run(SERVER_STR, host=SERVER_HOST, port=SERVER_PORT, reload=True, factory=True)
\ No newline at end of file
@@ -0,0 +1,103 @@
+import argparse
+import tqdm
+import numpy as np
+
+from app.influxdb.influx import InfluxDB
+from app.influxdb.line_protocol import WRITE_PRECISION
+from app.models.BinaryDataModel import MeasurementArrays
+from app.utils.env_vars import INFLUXDB_BUCKET, INFLUXDB_ORG
+
+
+def read_v1_measurement(source: InfluxDB, nodeId: str, measurementId: str) -> MeasurementArrays:
+    '''Reads one v1 measurement with its samples ordered by the numeric index tag'''
+
+    query = f'from(bucket:"{INFLUXDB_BUCKET}")\
+    |> range(start: 0)\
+    |> filter(fn:(r) => r._measurement == "vibration_measurement")\
+    |> filter(fn:(r) => r.nodeId == "{nodeId}")\
+    |> filter(fn:(r) => r.measurementId == "{measurementId}")\
+    |> keep(columns: ["_time", "_field", "_value", "nodeId", "measurementId", "index"])\
+    |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")\
+    |> group()'
+
+    df = source.query_api.query_data_frame(org=INFLUXDB_ORG, query=query)
+    if df.empty:
+        return None
+
+    df = df.assign(index=df['index'].astype(int)).sort_values('index')
+
+    return MeasurementArrays(node_id=nodeId,
+                             measurement_id=measurementId,
+                             time=df['_time'].iloc[0].timestamp(),
+                             x=df['x'].to_numpy(dtype=np.float64),
+                             y=df['y'].to_numpy(dtype=np.float64),
+                             z=df['z'].to_numpy(dtype=np.float64))
+
+
+def copy_other_measurements(source: InfluxDB, target_bucket: str):
+    '''Copies labeled data and processed features server side, they have the same layout in v1 and v2'''
+
+    query = f'from(bucket:"{INFLUXDB_BUCKET}")\
+    |> range(start: 0)\
+    |> filter(fn:(r) => r._measurement != "vibration_measurement")\
+    |> to(bucket: "{target_bucket}", org: "{INFLUXDB_ORG}")'
+
+    source.query_api.query(org=INFLUXDB_ORG, query=query)
+
+
+def migrate_layout(target_bucket: str):
+    source = InfluxDB(storage_layout='v1')
+    target = InfluxDB(storage_layout='v2')
+
+    print('***LISTING MEASUREMENTS***')
+
+    # The listing reads the measurement catalog, which older v1 buckets do not have yet
+    source.rebuild_measurement_catalog()
+    measurements = [(nodeId, measurement['measurementId']) for nodeId in source.get_all_nodes_id() for measurement in source.get_all_measurements(nodeId=nodeId)]
+
+    print('***MIGRATING VIBRATION DATA***')
+
+    for nodeId, measurementId in tqdm.tqdm(measurements):
+        measurement = read_v1_measurement(source=source, nodeId=nodeId, measurementId=measurementId)
+        if measurement is None:
+            continue
+
+        record = target.encode_vibration_measurement(measurement=measurement)
+        target.write_api.write(bucket=target_bucket, org=INFLUXDB_ORG, record=record, write_precision=WRITE_PRECISION)
+
+    print('***COPYING OTHER MEASUREMENTS***')
+
+    copy_other_measurements(source=source, target_bucket=target_bucket)
+
+    source.close()
+    target.close()
+
+    print(f'DONE, point INFLUXDB_BUCKET to {target_bucket} and set INFLUXDB_STORAGE_LAYOUT=v2')
+
+
+def rebuild_catalog():
+    influx = InfluxDB()
+
+    print('***REBUILDING MEASUREMENT CATALOG***')
+
+    number_of_measurements = influx.rebuild_measurement_catalog()
+    influx.close()
+
+    print(f'DONE, {number_of_measurements} measurements cataloged')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrations for the data stored in influx')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    layout_parser = subparsers.add_parser('layout', help='Copies the v1 bucket (index tag per sample) into a v2 bucket (sample offsets as timestamps)')
+    layout_parser.add_argument('--target-bucket', required=True, help='Existing empty bucket receiving the v2 data')
+
+    subparsers.add_parser('catalog', help='Writes the measurement catalog for vibration data stored before the catalog existed')
+
+    args = parser.parse_args()
+
+    if args.command == 'layout':
+        migrate_layout(target_bucket=args.target_bucket)
+    elif args.command == 'catalog':
+        rebuild_catalog()
@@ -0,0 +1,102 @@
+import struct
+import numpy as np
+import pytest
+
+from app.models.BinaryDataModel import (BinaryFrameError, MeasurementArrays, FRAME_HEADER, RECORD_HEADER, FRAME_MAGIC, FRAME_VERSION,
+                                        encode_vibration_frame, decode_vibration_frame)
+
+
+def random_measurement(rng: np.random.Generator, node_id: str, measurement_id: str, number_of_samples: int):
+    x, y, z = rng.normal(size=(3, number_of_samples)).astype(np.float32)
+
+    return MeasurementArrays(node_id=node_id, measurement_id=measurement_id, time=float(rng.uniform(1e9, 2e9)), x=x, y=y, z=z)
+
+
+def record(node_id: bytes, measurement_id: bytes, time: float, samples: np.ndarray) -> bytes:
+    '''Hand built record, lets a test write what encode_vibration_frame would refuse to'''
+
+    return RECORD_HEADER.pack(len(node_id), len(measurement_id), time, samples.shape[1]) + node_id + measurement_id + samples.astype('<f4').tobytes()
+
+
+def frame(*records: bytes, number_of_measurements: int = None, magic: bytes = FRAME_MAGIC, version: int = FRAME_VERSION) -> bytes:
+    number_of_measurements = len(records) if number_of_measurements is None else number_of_measurements
+
+    return FRAME_HEADER.pack(magic, version, number_of_measurements) + b''.join(records)
+
+
+def test_round_trip():
+    rng = np.random.default_rng(0)
+    measurements = [random_measurement(rng, 'node-1', 'm1', 1000),
+                    random_measurement(rng, 'node-1', 'm2', 1),
+                    random_measurement(rng, 'nœud-2', 'mesure é', 37)]
+
+    decoded = decode_vibration_frame(encode_vibration_frame(measurements))
+
+    assert len(decoded) == len(measurements)
+
+    for expected, actual in zip(measurements, decoded):
+        assert (actual.node_id, actual.measurement_id, actual.time) == (expected.node_id, expected.measurement_id, expected.time)
+        assert actual.number_of_samples == expected.number_of_samples
+
+        for axis in ('x', 'y', 'z'):
+            np.testing.assert_array_equal(getattr(actual, axis), getattr(expected, axis))
+
+
+def test_empty_frame():
+    assert decode_vibration_frame(encode_vibration_frame([])) == []
+
+
+def test_every_truncation_is_rejected():
+    rng = np.random.default_rng(0)
+    body = encode_vibration_frame([random_measurement(rng, 'n1', 'm1', 5), random_measurement(rng, 'n2', 'm2', 3)])
+
+    for length in range(len(body)):
+        with pytest.raises(BinaryFrameError):
+            decode_vibration_frame(body[:length])
+
+
+def test_trailing_bytes():
+    body = encode_vibration_frame([random_measurement(np.random.default_rng(0), 'n1', 'm1', 5)])
+
+    with pytest.raises(BinaryFrameError, match='trailing'):
+        decode_vibration_frame(body + b'\x00')
+
+
+def test_more_measurements_than_records():
+    samples = np.ones((3, 4))
+
+    with pytest.raises(BinaryFrameError, match='Truncated'):
+        decode_vibration_frame(frame(record(b'n1', b'm1', 1.0, samples), number_of_measurements=2))
+
+
+@pytest.mark.parametrize('magic, version', [(b'XXXX', FRAME_VERSION), (FRAME_MAGIC, FRAME_VERSION + 1)])
+def test_invalid_header(magic, version):
+    with pytest.raises(BinaryFrameError):
+        decode_vibration_frame(frame(record(b'n1', b'm1', 1.0, np.ones((3, 4))), magic=magic, version=version))
+
+
+@pytest.mark.parametrize('node_id, measurement_id, time, samples', [
+    (b'\xff\xfe', b'm1', 1.0, np.ones((3, 4))),
+    (b'', b'm1', 1.0, np.ones((3, 4))),
+    (b'n1', b'', 1.0, np.ones((3, 4))),
+    (b'n1\nvibration_measurement,nodeId=n2 x=1', b'm1', 1.0, np.ones((3, 4))),
+    (b'n1', b'm\r1', 1.0, np.ones((3, 4))),
+    (b'n1', b'm1', float('nan'), np.ones((3, 4))),
+    (b'n1', b'm1', float('inf'), np.ones((3, 4))),
+    (b'n1', b'm1', 1.0, np.ones((3, 0))),
+    (b'n1', b'm1', 1.0, np.array([[1.0, np.nan], [1.0, 1.0], [1.0, 1.0]])),
+    (b'n1', b'm1', 1.0, np.array([[1.0, 1.0], [1.0, 1.0], [np.inf, 1.0]])),
+])
+def test_invalid_record(node_id, measurement_id, time, samples):
+    with pytest.raises(BinaryFrameError):
+        decode_vibration_frame(frame(record(node_id, measurement_id, time, samples)))
+
+
+def test_sample_count_past_the_end():
+    body = bytearray(frame(record(b'n1', b'm1', 1.0, np.ones((3, 4)))))
+
+    # A corrupted sample count claiming more samples than the frame holds
+    struct.pack_into('<I', body, FRAME_HEADER.size + RECORD_HEADER.size - 4, 10 ** 6)
+
+    with pytest.raises(BinaryFrameError, match='Truncated'):
+        decode_vibration_frame(bytes(body))
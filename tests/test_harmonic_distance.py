@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from app.analytics.rul import RemainingUsefulLifetimeModel
+from app.analytics.harmonic_distance import PackedPeaks, harmonic_peak_distances
+from app.utils.constants import SMOOTHING_WINDOW_SIZE
+
+
+def random_peaks(rng: np.random.Generator, maximum_number_of_peaks: int, minimum_number_of_peaks: int = 0):
+    number_of_peaks = rng.integers(minimum_number_of_peaks, maximum_number_of_peaks + 1)
+
+    return [{'frequency': float(freq), 'peak_value': float(peak_value)}
+            for freq, peak_value in zip(rng.uniform(1.0, 500.0, number_of_peaks), rng.uniform(0.01, 2.0, number_of_peaks))]
+
+
+def reference_distances(measurements, references):
+    '''Distances of the pair by pair implementation harmonic_peak_distances replaces'''
+
+    model = RemainingUsefulLifetimeModel()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.array([[model._harmonic_peak_distance(p_1, p_2) for p_2 in references] for p_1 in measurements]).reshape(len(measurements), len(references))
+
+
+def assert_matches_reference(measurements, references):
+    distances = harmonic_peak_distances(measurements=PackedPeaks.from_lists(measurements), references=PackedPeaks.from_lists(references))
+
+    np.testing.assert_allclose(distances, reference_distances(measurements, references), rtol=1e-12, atol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_randomized_peak_sets(seed):
+    rng = np.random.default_rng(seed)
+
+    measurements = [random_peaks(rng, maximum_number_of_peaks=8, minimum_number_of_peaks=1) for _ in range(rng.integers(1, 15))]
+    references = [random_peaks(rng, maximum_number_of_peaks=8, minimum_number_of_peaks=1) for _ in range(rng.integers(1, 6))]
+
+    assert_matches_reference(measurements, references)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_close_frequencies(seed):
+    # Frequencies within a few smoothing windows of each other exercise matching and the removal of matched reference peaks
+    rng = np.random.default_rng(seed)
+
+    def close_peaks(number_of_peaks):
+        return [{'frequency': float(freq), 'peak_value': float(peak_value)}
+                for freq, peak_value in zip(100.0 + rng.uniform(0.0, 3 * SMOOTHING_WINDOW_SIZE, number_of_peaks), rng.uniform(0.01, 2.0, number_of_peaks))]
+
+    measurements = [close_peaks(rng.integers(1, 6)) for _ in range(8)]
+    references = [close_peaks(rng.integers(1, 6)) for _ in range(4)]
+
+    assert_matches_reference(measurements, references)
+
+
+def test_empty_peak_lists():
+    rng = np.random.default_rng(0)
+
+    measurements = [[], random_peaks(rng, maximum_number_of_peaks=5, minimum_number_of_peaks=1), []]
+    references = [random_peaks(rng, maximum_number_of_peaks=5, minimum_number_of_peaks=1), []]
+
+    assert_matches_reference(measurements, references)
+
+
+def test_no_measurements_or_references():
+    rng = np.random.default_rng(0)
+    peaks = [random_peaks(rng, maximum_number_of_peaks=5, minimum_number_of_peaks=1) for _ in range(3)]
+
+    assert harmonic_peak_distances(measurements=PackedPeaks.from_lists([]), references=PackedPeaks.from_lists(peaks)).shape == (0, 3)
+    assert harmonic_peak_distances(measurements=PackedPeaks.from_lists(peaks), references=PackedPeaks.from_lists([])).shape == (3, 0)
+
+
+def test_references_without_peaks():
+    rng = np.random.default_rng(0)
+
+    measurements = [random_peaks(rng, maximum_number_of_peaks=5, minimum_number_of_peaks=1) for _ in range(3)] + [[]]
+
+    assert_matches_reference(measurements, [[], []])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_single_reference(seed):
+    rng = np.random.default_rng(seed)
+
+    measurements = [random_peaks(rng, maximum_number_of_peaks=8) for _ in range(10)]
+    references = [random_peaks(rng, maximum_number_of_peaks=8, minimum_number_of_peaks=1)]
+
+    assert_matches_reference(measurements, references)
+
+
+@pytest.mark.parametrize('offset', [SMOOTHING_WINDOW_SIZE - 1, SMOOTHING_WINDOW_SIZE, SMOOTHING_WINDOW_SIZE + 1])
+def test_frequencies_at_the_tolerance_boundary(offset):
+    # The maximum frequency of every pair is 256 so normalized frequencies are exact, only differences below SMOOTHING_WINDOW_SIZE match
+    measurements = [[{'frequency': 256.0 - offset, 'peak_value': 0.5}],
+                    [{'frequency': 128.0, 'peak_value': 1.0}, {'frequency': 256.0 - offset, 'peak_value': 0.5}]]
+    references = [[{'frequency': 256.0, 'peak_value': 0.4}],
+                  [{'frequency': 128.0 + offset, 'peak_value': 0.8}, {'frequency': 256.0, 'peak_value': 0.4}]]
+
+    assert_matches_reference(measurements, references)
+
+    distance = harmonic_peak_distances(measurements=PackedPeaks.from_lists(measurements[:1]), references=PackedPeaks.from_lists(references[:1]))[0, 0]
+
+    if offset < SMOOTHING_WINDOW_SIZE:
+        expected = np.hypot(offset / 256.0, 1.0 - 0.4 / 0.5) / 2
+    else:
+        expected = (np.hypot((256.0 - offset) / 256.0, 1.0) + 0.4 / 0.5) / 2
+
+    assert distance == pytest.approx(expected)
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from app.analytics.batch import MeasurementBatch
+from app.analytics.incremental import IncrementalFeatureExtractor
+from app.analytics.outliers import OutlierFilter
+from app.analytics.preprocesser import Preprocesser
+from app.analytics.spectrum import SpectrumParameters, decode_array
+
+
+def random_measurements(rng: np.random.Generator, lengths):
+    '''{(nodeId, measurementId): (number of samples, 3)} measurements around gravity on the z axis'''
+
+    return {(f'n{i % 2}', f'm{i}'): np.array([0.0, 0.0, 9.81]) + rng.normal(size=(number_of_samples, 3))
+            for i, number_of_samples in enumerate(lengths)}
+
+
+def batch_of(measurements):
+    keys = list(measurements.keys())
+    node_ids = sorted({nId for nId, _ in keys})
+    measurement_ids = sorted({mId for _, mId in keys})
+
+    return MeasurementBatch(samples=np.concatenate([measurements[key] for key in keys]),
+                            offsets=np.concatenate(([0], np.cumsum([measurements[key].shape[0] for key in keys]))),
+                            node_ids=node_ids,
+                            measurement_ids=measurement_ids,
+                            node_codes=[node_ids.index(nId) for nId, _ in keys],
+                            measurement_codes=[measurement_ids.index(mId) for _, mId in keys])
+
+
+def split_stream(rng: np.random.Generator, measurements, maximum_piece_size: int):
+    '''(nodeId, measurementId, time, x, y, z) pieces the way InfluxDB.iter_vibration_chunks yields them, cut at random points'''
+
+    for (nId, mId), samples in measurements.items():
+        start = 0
+
+        while start < samples.shape[0]:
+            end = min(start + int(rng.integers(1, maximum_piece_size + 1)), samples.shape[0])
+            yield nId, mId, 0.0, samples[start:end, 0], samples[start:end, 1], samples[start:end, 2]
+            start = end
+
+
+def batch_features(measurements, spectrum: SpectrumParameters):
+    preprocesser = Preprocesser(batch=batch_of(measurements), spectrum=spectrum, workers=1, outlier_filter=OutlierFilter(method='none'))
+
+    return preprocesser.rms_feature_extraction(), preprocesser.compact_psd_feature_extraction()
+
+
+def assert_same_features(measurements, spectrum: SpectrumParameters, extractor: IncrementalFeatureExtractor):
+    batch_rms, batch_psd = batch_features(measurements, spectrum=spectrum)
+    incremental_rms, incremental_psd = extractor.rms_feature_extraction(), extractor.compact_psd_feature_extraction()
+
+    for nId, mId in measurements.keys():
+        for axis in ('x', 'y', 'z'):
+            assert incremental_rms[nId][mId][axis] == pytest.approx(batch_rms[nId][mId][axis], rel=1e-10)
+
+        expected, actual = batch_psd[nId][mId], incremental_psd[nId][mId]
+
+        assert actual['spectrum'] == expected['spectrum']
+        assert actual['number_of_samples'] == expected['number_of_samples']
+        # PSD vectors are stored as float32
+        np.testing.assert_allclose(decode_array(actual['psd']), decode_array(expected['psd']), rtol=1e-5, atol=1e-12)
+
+
+@pytest.mark.parametrize('overlap', [None, 0, 100, 255])
+@pytest.mark.parametrize('seed', range(3))
+def test_split_stream_matches_batch(overlap, seed):
+    rng = np.random.default_rng(seed)
+    spectrum = SpectrumParameters(method='welch', segment_length=256, overlap=overlap)
+
+    # Several segments with a trailing partial one, an exact number of segments and a measurement shorter than a segment
+    measurements = random_measurements(rng, lengths=[4000, 256 * 4, 100])
+    extractor = IncrementalFeatureExtractor(spectrum=spectrum).consume(split_stream(rng, measurements, maximum_piece_size=300))
+
+    assert_same_features(measurements, spectrum=spectrum, extractor=extractor)
+
+
+def test_piece_size_does_not_change_features():
+    rng = np.random.default_rng(0)
+    spectrum = SpectrumParameters(method='welch', segment_length=128, overlap=64)
+    measurements = random_measurements(rng, lengths=[1000, 333])
+
+    whole = IncrementalFeatureExtractor(spectrum=spectrum).consume(split_stream(rng, measurements, maximum_piece_size=10 ** 6))
+    single_samples = IncrementalFeatureExtractor(spectrum=spectrum).consume(split_stream(rng, measurements, maximum_piece_size=1))
+
+    assert_same_features(measurements, spectrum=spectrum, extractor=whole)
+    assert_same_features(measurements, spectrum=spectrum, extractor=single_samples)
+
+
+def test_rms_only():
+    rng = np.random.default_rng(0)
+    measurements = random_measurements(rng, lengths=[500, 1])
+
+    extractor = IncrementalFeatureExtractor(psd=False).consume(split_stream(rng, measurements, maximum_piece_size=64))
+    batch_rms, _ = batch_features(measurements, spectrum=SpectrumParameters(method='welch'))
+
+    assert not extractor.compact_psd_feature_extraction()
+
+    for nId, mId in measurements.keys():
+        for axis in ('x', 'y', 'z'):
+            assert extractor.rms_feature_extraction()[nId][mId][axis] == pytest.approx(batch_rms[nId][mId][axis], rel=1e-10)
+
+
+def test_only_welch_is_incremental():
+    with pytest.raises(ValueError):
+        IncrementalFeatureExtractor(spectrum=SpectrumParameters(method='dct'))
@@ -0,0 +1,141 @@
+import math
+import numpy as np
+import pytest
+
+from app.influxdb.line_protocol import encode_lines, encode_row
+from app.models.BinaryDataModel import MeasurementArrays, InvalidMeasurementError, check_measurement
+
+
+def split_unescaped(text: str, separator: str):
+    '''Splits on separators that are not escaped by a backslash, escapes are kept'''
+
+    parts, current, escaped = [], '', False
+
+    for character in text:
+        if escaped:
+            current += character
+            escaped = False
+        elif character == '\\':
+            current += character
+            escaped = True
+        elif character == separator:
+            parts.append(current)
+            current = ''
+        else:
+            current += character
+
+    return parts + [current]
+
+
+def unescape(text: str) -> str:
+    result, escaped = '', False
+
+    for character in text:
+        if character == '\\' and not escaped:
+            escaped = True
+            continue
+
+        result += character
+        escaped = False
+
+    return result
+
+
+def parse_line(line: str):
+    '''Reads back a line of float fields the way influx splits it, (measurement, tags, fields, timestamp)'''
+
+    series, fields, *timestamp = split_unescaped(line, ' ')
+    measurement, *tags = split_unescaped(series, ',')
+
+    tags = dict(tuple(unescape(part) for part in split_unescaped(tag, '=')) for tag in tags)
+    fields = {unescape(name): float(value) for name, value in (split_unescaped(field, '=') for field in split_unescaped(fields, ','))}
+
+    return unescape(measurement), tags, fields, int(timestamp[0]) if timestamp else None
+
+
+def test_rows_read_back():
+    x, y = np.array([0.5, -1.25, 3e-9]), np.array([1.0, 2.0, 1e12])
+
+    lines = encode_lines('vibration_measurement', tags={'nodeId': 'n1', 'measurementId': 'm1'}, fields={'x': x, 'y': y}, timestamp=1_000_000, index_tag='index').split('\n')
+
+    assert len(lines) == 3
+
+    for i, line in enumerate(lines):
+        assert parse_line(line) == ('vibration_measurement', {'index': str(i), 'measurementId': 'm1', 'nodeId': 'n1'}, {'x': x[i], 'y': y[i]}, 1_000_000)
+
+
+def test_per_row_timestamps():
+    lines = encode_lines('m', tags={'nodeId': 'n1'}, fields={'x': [1.0, 2.0]}, timestamps=np.array([10, 20])).split('\n')
+
+    assert [parse_line(line)[3] for line in lines] == [10, 20]
+
+
+@pytest.mark.parametrize('value', ['a,b', 'a=b', 'a b', 'a\\', 'a\\,b', '100%', '%d %s', 'é"\''])
+def test_special_characters_are_escaped(value):
+    line = encode_lines(f'm {value}', tags={'nodeId': value, value: 'v'}, fields={'x': [1.0]}, timestamp=1)
+
+    assert '\n' not in line
+    assert parse_line(line) == (f'm {value}', {'nodeId': value, value: 'v'}, {'x': 1.0}, 1)
+
+
+@pytest.mark.parametrize('line_break', ['\n', '\r', '\r\n'])
+def test_line_breaks_are_rejected(line_break):
+    injected = f'n1{line_break}vibration_measurement,nodeId=n2 x=1'
+
+    with pytest.raises(ValueError):
+        encode_lines('m', tags={'nodeId': injected}, fields={'x': [1.0]})
+
+    with pytest.raises(ValueError):
+        encode_lines('m', tags={injected: 'n1'}, fields={'x': [1.0]})
+
+    with pytest.raises(ValueError):
+        encode_lines(injected, tags={'nodeId': 'n1'}, fields={'x': [1.0]})
+
+    with pytest.raises(ValueError):
+        encode_lines('m', tags={'nodeId': 'n1'}, fields={injected: [1.0]})
+
+    with pytest.raises(ValueError):
+        encode_row('m', tags={'nodeId': injected}, fields={'blob': 'abc'})
+
+
+@pytest.mark.parametrize('value', [math.nan, math.inf, -math.inf])
+def test_non_finite_fields_are_rejected(value):
+    with pytest.raises(ValueError):
+        encode_lines('m', tags={'nodeId': 'n1'}, fields={'x': [1.0, value]})
+
+
+def test_no_rows():
+    assert encode_lines('m', tags={'nodeId': 'n1'}, fields={'x': []}) == ''
+    assert encode_row('m', tags={'nodeId': 'n1'}, fields={}) == ''
+
+
+def test_string_fields_are_quoted():
+    line = encode_row('m', tags={'nodeId': 'n 1'}, fields={'blob': 'a"b\\c'}, timestamp=5)
+
+    assert line == 'm,nodeId=n\\ 1 blob="a\\"b\\\\c" 5'
+
+
+def measurement(node_id: str = 'n1', measurement_id: str = 'm1', time: float = 1.0, samples=None):
+    samples = np.ones((3, 4)) if samples is None else np.asarray(samples, dtype=np.float64)
+
+    return MeasurementArrays(node_id=node_id, measurement_id=measurement_id, time=time, x=samples[0], y=samples[1], z=samples[2])
+
+
+def test_valid_measurement():
+    check_measurement(measurement())
+
+
+@pytest.mark.parametrize('invalid', [
+    measurement(node_id=''),
+    measurement(measurement_id=''),
+    measurement(node_id='n1\nvibration_measurement,nodeId=n2 x=1'),
+    measurement(measurement_id='m\r1'),
+    measurement(time=math.nan),
+    measurement(time=math.inf),
+    measurement(samples=np.ones((3, 0))),
+    measurement(samples=[[1.0, math.nan], [1.0, 1.0], [1.0, 1.0]]),
+    measurement(samples=[[1.0, 1.0], [-math.inf, 1.0], [1.0, 1.0]]),
+])
+def test_invalid_measurements_are_rejected(invalid):
+    with pytest.raises(InvalidMeasurementError):
+        check_measurement(invalid)